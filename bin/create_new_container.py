@@ -9,12 +9,15 @@ import re
 
 import logging
 
-sys.path.append(os.path.dirname(__file__),"..","lib")
+sys.path.append(os.path.join(os.path.dirname(__file__),"..","lib"))
 
 from fattybrewing import container
+from fattybrewing.container import persistence
 
 CONTAINER_TYPES = ("mash_tun", "fermenter", "storage", "keg", "bottle")
 UNITS = ("gal","l","kg","g","lb", "ml", "oz")
+COUCHDB_URL = "http://localhost:5984/"
+DATABASE = "fattybrewing"
 
 def usage():
     usage_str = """
@@ -23,10 +26,16 @@ def usage():
 CONTAINER_TYPE - one of mash_tun, fermenter, storage, keg, bottle
 SIZE - must be of format NUMBER+UNIT, e.g. 35Gal, 20L, 10kg
 
-""".format(sys.argv[0])
+OPTIONS
+-n, --count NUMBER - number of containers to create, default 1
+-u, --url URL - CouchDB server, or a directory to keep the database in a file, default {}
+-d, --database NAME - database to store the containers in, default {}
 
+""".format(sys.argv[0], COUCHDB_URL, DATABASE)
+    print(usage_str)
 
-def generate_new_contaier(container_type, size):
+
+def generate_new_container(container_type, size):
     """Return a new container object
 """
     
@@ -56,9 +65,12 @@ def main():
     args = sys.argv[1:]
     container_type = None
     size = None ## Size is a tuplet of (number, unit)
+    count = 1
+    url = COUCHDB_URL
+    database_name = DATABASE
 
     try: 
-        opts, args = getopt.getopt(args, "hs:t:", ["size=", "container-type=", "help"])
+        opts, args = getopt.getopt(args, "hs:t:n:u:d:", ["size=", "container-type=", "count=", "url=", "database=", "help"])
     except getopt.GetoptError as err:
         print(str(err))
         usage()
@@ -78,13 +90,21 @@ def main():
                 raise Exception("Units must be one of %s" % (UNITS))
             if not (size[0] and size[1]):
                 raise Exception("Size must be provided as NUMBER+UNITS (e.g. 25L, 10gal, 5g, 20kg)")
+        elif o in ("-n", "--count"):
+            count = int(a)
+        elif o in ("-u", "--url"):
+            url = a
+        elif o in ("-d", "--database"):
+            database_name = a
             
-    new_container = None
+    database = persistence.open_database(url, database_name)
+    store = persistence.ContainerStore(database)
+    for i in range(count):
+        new_container = generate_new_container(container_type, size)
+        print("Saving new container: {}".format(new_container))
+        store.add(new_container)
+    for conflict in store.flush():
+        print("Unable to save container {}: {}".format(conflict.id, conflict.error))
 
-    new_container = generate_new_container(container_type, size)
-    print("Saving new container: {}".format(new_container))
-    new_container.save()
-
-            
 if __name__ == "__main__":
     main()
@@ -2,7 +2,9 @@ import unittest
 
 import install
 import os
+import shutil
 import sqlite3
+import tempfile
 
 
 class TestInstallDB(unittest.TestCase):
@@ -89,5 +91,57 @@ class TestInstallDB(unittest.TestCase):
         #os.remove(os.path.join(os.path.dirname(__file__),"brewery-test.db3"))
 
 
+class TestIndexes(unittest.TestCase):
+
+    ## The queries the brewery runs on the tables that grow, and the table each must find through an index
+    QUERIES=[
+        ("container_contents","""SELECT solid_ingredient,liquid FROM container_contents WHERE container=?"""),
+        ("container_contents","""SELECT containers.id,ingredient_alias FROM containers
+JOIN container_contents ON container_contents.container = containers.id
+LEFT JOIN ingredients ON container_contents.solid_ingredient = ingredients.id WHERE containers.name=?"""),
+        ("containers_valves_join","""SELECT valve,cont_valve_relationship FROM containers_valves_join WHERE container=?"""),
+        ("containers_valves_join","""SELECT container FROM containers_valves_join WHERE valve=?"""),
+        ("mash_tuns","""SELECT containers.id FROM containers JOIN mash_tuns ON containers.id=mash_tuns.container WHERE containers.name=?"""),
+        ("fermenters","""SELECT id FROM fermenters WHERE container=?"""),
+        ("liquid_reservoirs","""SELECT id FROM liquid_reservoirs WHERE container=?"""),
+        ("batches","""SELECT id,batch_alias FROM batches WHERE batch_status=?"""),
+        ]
+
+    def setUp(self):
+        self.tmpdir=tempfile.mkdtemp()
+        self.dbfile=os.path.join(self.tmpdir,"brewery-test.db3")
+
+    def assertIndexed(self,dbconn):
+        for (table,query) in self.QUERIES:
+            plan=[ r[3] for r in dbconn.execute("EXPLAIN QUERY PLAN "+query,(1,)) ]
+            self.assertFalse([ step for step in plan if step.startswith("SCAN {0}".format(table)) ],(query,plan))
+            self.assertTrue([ step for step in plan if step.startswith("SEARCH {0} USING".format(table)) and "INDEX" in step ],(query,plan))
+
+    def test_install(self):
+        install.main([self.dbfile])
+        dbconn=sqlite3.connect(self.dbfile)
+        self.assertEqual(dbconn.execute("PRAGMA user_version").fetchone()[0],install.migrations()[-1][0])
+        self.assertIndexed(dbconn)
+        dbconn.close()
+
+    def test_migrate(self):
+        dbconn=sqlite3.connect(self.dbfile)
+        with open(os.path.join(os.path.dirname(os.path.realpath(__file__)),"fattybrewery-schema.sql")) as sfh:
+            dbconn.executescript(sfh.read())
+        dbconn.execute("INSERT INTO containers (name) VALUES ('an old fermenter')")
+        dbconn.commit()
+        dbconn.close()
+
+        install.main(["--migrate",self.dbfile])
+        dbconn=sqlite3.connect(self.dbfile)
+        self.assertEqual(dbconn.execute("SELECT name FROM containers").fetchone()[0],"an old fermenter")
+        self.assertIndexed(dbconn)
+        self.assertEqual(install.migrate(dbconn),[])
+        dbconn.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+
 if __name__=='__main__':
     unittest.main()
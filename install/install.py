@@ -1,14 +1,48 @@
 #!/usr/bin/env python
 
-"""This script installs the database"""
+"""This script installs the database, or with --migrate brings an
+installed database up to date.
+
+Changes to an installed database are in the migrations directory, as
+NNN-description.sql files applied in order. The number of the last one
+applied is kept in the database's user_version.
+"""
 
 import os
+import re
 import sqlite3
 import sys
 
 def usage():
-    print("""Usage: install.py DBNAME""")
+    print("""Usage: install.py [--migrate] DBNAME""")
+
+
+def migrations():
+    """Return (number, file) of the migrations, in order"""
+    migrations_dir=os.path.join(os.path.dirname(os.path.realpath(__file__)),"migrations")
+    found=[]
+    for name in os.listdir(migrations_dir):
+        match=re.match(r'^(\d+)-.*\.sql$',name)
+        if match:
+            found.append((int(match.group(1)),os.path.join(migrations_dir,name)))
+    return sorted(found)
+
 
+def migrate(dbconn):
+    """Apply the migrations newer than the database's user_version
+    :return the numbers of those applied
+    """
+    version=dbconn.execute("PRAGMA user_version").fetchone()[0]
+    applied=[]
+    for (number,migration_file) in migrations():
+        if number <= version:
+            continue
+        with open(migration_file) as mfh:
+            sql=mfh.read()
+        ## executescript commits first, so each migration is its own transaction
+        dbconn.executescript("BEGIN;\n{0}\nPRAGMA user_version={1};\nCOMMIT;".format(sql,number))
+        applied.append(number)
+    return applied
 
 
 def main(args):
@@ -17,6 +51,13 @@ def main(args):
 
         raise Exception("No filename given")
 
+    migrate_only=args[0] == "--migrate"
+    if migrate_only:
+        args=args[1:]
+        if not args:
+            usage()
+            raise Exception("No filename given")
+
     filename=args[0]
     sql_src_dir=os.path.dirname(os.path.realpath(__file__))
     
@@ -38,11 +79,15 @@ def main(args):
         if not os.path.isfile(f):
             raise OSError("Unable to find required file {0}".format(f))
 
-    for f in [schema_file,init_file]:
-        with open(f) as sfh:
-            sql=sfh.read()
-            dbconn.executescript(sql)
-    
+    if not migrate_only:
+        for f in [schema_file,init_file]:
+            with open(f) as sfh:
+                sql=sfh.read()
+                dbconn.executescript(sql)
+        ## The schema makes the tables afresh
+        dbconn.execute("PRAGMA user_version=0")
+
+    migrate(dbconn)
     dbconn.close()
 
 if __name__=='__main__':
@@ -0,0 +1,18 @@
+-- Indexes on the tables that grow with the brewery's history
+
+-- Contents of a container: container_contents joined from containers.
+-- The ingredient and liquid columns make it a covering index for the
+-- joins on to ingredients and liquids.
+CREATE INDEX IF NOT EXISTS container_contents_container ON container_contents(container, solid_ingredient, liquid);
+
+-- Pipes, from a container to its valves and from a valve to its containers
+CREATE INDEX IF NOT EXISTS containers_valves_container ON containers_valves_join(container, valve, cont_valve_relationship);
+CREATE INDEX IF NOT EXISTS containers_valves_valve ON containers_valves_join(valve, container);
+
+-- The subtype rows of a container
+CREATE INDEX IF NOT EXISTS mash_tuns_container ON mash_tuns(container);
+CREATE INDEX IF NOT EXISTS fermenters_container ON fermenters(container);
+CREATE INDEX IF NOT EXISTS liquid_reservoirs_container ON liquid_reservoirs(container);
+
+-- Batches in a status, e.g. those in progress
+CREATE INDEX IF NOT EXISTS batches_batch_status ON batches(batch_status);
@@ -0,0 +1,19 @@
+-- Name search for containers: an FTS5 trigram index over containers.name,
+-- which answers LIKE '%part%' and 'prefix%' patterns of three or more
+-- characters, and trigram matches for fuzzy lookups. Kept up to date by
+-- triggers.
+CREATE VIRTUAL TABLE IF NOT EXISTS containers_search USING fts5(name, content='containers', content_rowid='id', tokenize='trigram');
+INSERT INTO containers_search(containers_search) VALUES ('rebuild');
+
+CREATE TRIGGER IF NOT EXISTS containers_search_insert AFTER INSERT ON containers BEGIN
+  INSERT INTO containers_search(rowid, name) VALUES (new.id, new.name);
+END;
+
+CREATE TRIGGER IF NOT EXISTS containers_search_delete AFTER DELETE ON containers BEGIN
+  INSERT INTO containers_search(containers_search, rowid, name) VALUES ('delete', old.id, old.name);
+END;
+
+CREATE TRIGGER IF NOT EXISTS containers_search_update AFTER UPDATE OF name ON containers BEGIN
+  INSERT INTO containers_search(containers_search, rowid, name) VALUES ('delete', old.id, old.name);
+  INSERT INTO containers_search(rowid, name) VALUES (new.id, new.name);
+END;
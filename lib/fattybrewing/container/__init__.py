@@ -21,16 +21,33 @@ mash_tun.
 """
 
 from couchdb.mapping import Document, TextField, FloatField, IntegerField, DateTimeField, DecimalField, DictField, Mapping, ListField, BooleanField
-from datetime import datetime
+from datetime import datetime, timedelta
+from decimal import Decimal
 import logging
+import sys
+
+import numpy
 
 LOGGER = logging.getLogger("fattybrewing-container")
-LOGGER.setLevel(logging.DEBUG)
 
 WEIGHT_UNITS = ['g','kg','lb','oz']
 VOLUME_UNITS = ['l','gal','oz','ml']
 TEMP_UNITS = ['C','K','F']
+# Size of one of each unit, in litres. Weights assume the density of water
+# (1 kg to 1 l). 'oz' is both a weight and a volume unit, it is taken as a
+# US fluid ounce.
+UNIT_SIZES = {'l': 1.0,
+              'ml': 0.001,
+              'gal': 3.78541,
+              'oz': 0.0295735,
+              'kg': 1.0,
+              'g': 0.001,
+              'lb': 0.453592,
+              }
 RUBBISH_CONTENTS = ('used malt', 'used hops')
+# Set to True to re-scan the contents after every change and compare the
+# scan with the running fill level of the container (slow, for debugging)
+CHECK_FILL = False
 WORT_INGREDIENTS = {'liquid': ['water', 
                                'malt extract'
                                ],
@@ -42,6 +59,14 @@ WORT_INGREDIENTS = {'liquid': ['water',
 class ContainerError(Exception):
     pass
 
+# numpy record type for batches of contents, see Container.add_many
+CONTENT_DTYPE = numpy.dtype([('content', 'U64'),
+                             ('amount', numpy.float64),
+                             ('unit', 'U8'),
+                             ('degrees', numpy.float64),
+                             ('temp_unit', 'U1'),
+                             ])
+
 class ContentType:
     Wort = 'wort'
     Hops = 'hops'
@@ -51,6 +76,31 @@ class ContentType:
     Beer = 'beer'
     
 
+class ContentsField(ListField):
+    """ListField for Container.contents that keeps the container's lookup
+    state in step. Reading the field first drops the lots emptied by
+    remove_content, setting it throws away the index and fill level.
+    """
+
+    def __get__(self, instance, owner):
+        if instance is not None:
+            if instance.ledger is not None:
+                # A copy, changing it does not change the ledger
+                return self.Proxy(instance.ledger.to_contents(), self.field)
+            if instance._dead:
+                instance._compact()
+        return ListField.__get__(self, instance, owner)
+
+    def __set__(self, instance, value):
+        ListField.__set__(self, instance, value)
+        instance._index = None
+        instance._dead = None
+        instance._filled = None
+        if instance.ledger is not None:
+            instance.ledger = ContentLedger.from_contents(instance._data['contents'])
+            instance._data['contents'] = []
+
+
 class Container(Document):
     name = TextField()
     container_type = TextField()
@@ -59,7 +109,7 @@ class Container(Document):
         unit = TextField()
         ))
 
-    contents = ListField(DictField(Mapping.build(
+    contents = ContentsField(DictField(Mapping.build(
         amount = DecimalField(),
         unit = TextField(),
         content = TextField(),
@@ -72,20 +122,145 @@ class Container(Document):
     )))
     full = BooleanField(default=False)
 
+    # Running total of the filled amount, in the unit of the size. None until
+    # first needed, so loaded documents compute it from their contents.
+    _filled = None
+    # Lower-cased content name -> positions of its lots in the stored
+    # contents list. Built when first needed, like _filled.
+    _index = None
+    # Positions of lots emptied by remove_content, not yet dropped
+    _dead = None
+    # ContentLedger holding the contents instead of the document, see use_ledger
+    ledger = None
+
     def total_filled(self):
         """Return the amount of filled content. However, there is no weight to volume conversion. 
         E.g. weight is free in volume-organized container
         volume is free in weight-organized containers
         """
+        if self._filled is None:
+            self._filled = self.scan_filled()
+        return (self._filled, self._data['size']['unit'])
+
+    def scan_filled(self):
+        """Compute the filled amount from scratch, going through all contents
+        """
+        if self.ledger is not None:
+            return Decimal(repr(self.ledger.total_filled(self.size.unit)))
         total_amount = 0
-        target_unit = self.size.unit
-        for content in self.contents:
-            if content.unit in VOLUME_UNITS and target_unit in WEIGHT_UNITS:
-                continue
-            converted_amount = convert_amount( (content.amount, content.unit), target_unit)
-            total_amount += converted_amount
+        for lot in self._data.get('contents') or ():
+            total_amount += self._lot_fill(lot)
+        return total_amount
 
-        return (total_amount, target_unit)
+    def check_filled(self):
+        """Compare the running fill level with a full scan of the contents
+        :throw ContainerError if they disagree
+        """
+        scanned = self.scan_filled()
+        if abs(Decimal(str(self.total_filled()[0])) - Decimal(str(scanned))) > Decimal('1e-9'):
+            raise ContainerError("Running fill level %s %s does not match the contents (%s %s)" % (self._filled, self.size.unit, scanned, self.size.unit))
+
+    def use_ledger(self):
+        """Keep the contents in a columnar ContentLedger rather than in the
+        document. Worth it for containers holding very many lots.
+        The document contents are only written when the container is stored,
+        and reading contents returns a copy.
+        """
+        if self.ledger is None:
+            self._compact()
+            self.ledger = ContentLedger.from_contents(self._data['contents'])
+            self._data['contents'] = []
+            self._index = None
+
+    def _lots(self):
+        """Return the content lots as stored, dictionaries in the shape of the
+        document, without wrapping each in a mapping. Read only.
+        """
+        if self.ledger is not None:
+            return self.ledger.to_contents()
+        self._compact()
+        return self._data.get('contents') or []
+
+    def _content_index(self):
+        """Return the content name -> lot positions index, building it if needed
+        """
+        if self._index is None:
+            index = {}
+            for (position, lot) in enumerate(self._data.get('contents') or ()):
+                index.setdefault(lot['content'].lower(), []).append(position)
+            self._index = index
+        return self._index
+
+    def _append_lot(self, lot):
+        """Store a new content lot (a dictionary of the contents fields)
+        """
+        if self.ledger is not None:
+            self.ledger.append(lot['content'], lot['amount'], lot['unit'],
+                               lot['temperature']['degrees'], lot['temperature']['unit'],
+                               lot['content_type'], lot['updated_datetime'])
+            return {'amount': str(lot['amount']), 'unit': lot['unit']}
+        lots = self._data['contents']
+        temperature = lot['temperature']
+        lots.append({'amount': str(lot['amount']),
+                     'unit': lot['unit'],
+                     'content': lot['content'],
+                     'updated_datetime': Container.contents.field.mapping.updated_datetime._to_json(lot['updated_datetime']),
+                     'temperature': {'degrees': str(temperature['degrees']),
+                                     'unit': temperature['unit']},
+                     'content_type': lot['content_type']})
+        if self._index is not None:
+            self._index.setdefault(lot['content'].lower(), []).append(len(lots) - 1)
+        return lots[-1]
+
+    def _compact(self):
+        """Drop the lots emptied by remove_content from the stored contents
+        """
+        if self._dead:
+            dead = set(self._dead)
+            self._data['contents'] = [ lot for (position, lot) in enumerate(self._data['contents']) if position not in dead ]
+            self._index = None
+        self._dead = None
+
+    def store(self, db):
+        self._compact()
+        if self.ledger is None:
+            return super(Container, self).store(db)
+        self._data['contents'] = self.ledger.to_contents()
+        try:
+            return super(Container, self).store(db)
+        finally:
+            self._data['contents'] = []
+
+    def _replace_data(self, data):
+        """Take on data, a newer revision of this container loaded from the
+        database, keeping this instance
+        """
+        self._data = data
+        self._index = None
+        self._dead = None
+        self._filled = None
+        if self.ledger is not None:
+            self.ledger = ContentLedger.from_contents(data.get('contents') or [])
+            data['contents'] = []
+
+    def _document(self):
+        """Return the dictionary to store for this container, as store would
+        write it. For a container using a ledger this is a copy.
+        """
+        self._compact()
+        if self.ledger is None:
+            return self._data
+        document = dict(self._data)
+        document['contents'] = self.ledger.to_contents()
+        return document
+
+    def _lot_fill(self, lot):
+        """Return the amount a stored content lot fills, in the unit of the size
+        """
+        target_unit = self._data['size']['unit']
+        if lot['unit'] in VOLUME_UNITS and target_unit in WEIGHT_UNITS:
+            return 0
+        return convert_amount( (Decimal(lot['amount']), lot['unit']), target_unit)
 
     def heat_contents(self, temp_tuple):
         """Set all the contents of the container to be a temperature of temp_tuple
@@ -94,6 +269,8 @@ class Container(Document):
 
         if temp_tuple[1].upper() not in TEMP_UNITS:
             raise ContainerError("Unable to use the specified temperature unit %s" % (temp_tuple[1]))
+        elif self.ledger is not None:
+            self.ledger.heat(temp_tuple[0], temp_tuple[1])
         else:
             for content in self.contents:
                 content.temperature = dict( degrees = temp_tuple[0],
@@ -106,6 +283,7 @@ class Container(Document):
 
         self.size = {'amount': size_tuple[0],
                          'unit': size_tuple[1].lower() }
+        self._filled = None
     def determine_content_type(self, content):
         if "wort" in content.lower():
             return ContentType.Wort
@@ -129,6 +307,7 @@ class Container(Document):
         LOGGER.info("Attempting to add content %s (amount %s, temp %s)", content, amount, temp)
         amount_dict = {}
         temp_dict = {}
+        size = self.size
         if not content_type:
             content_type = self.determine_content_type(content)
         
@@ -137,13 +316,12 @@ class Container(Document):
                         "unit": amount[1]}
         else:
             amount_dict = amount
-        if amount_dict["unit"] != self.size.unit and amount_dict["unit"] in VOLUME_UNITS:
-            raise ContainerError("Only able to add volume content measured in '{0}'".format(self.size.unit))
+        if amount_dict["unit"] != size.unit and amount_dict["unit"] in VOLUME_UNITS:
+            raise ContainerError("Only able to add volume content measured in '{0}'".format(size.unit))
         
-        #Assume room temperature
         if "unit" not in temp:
-            temp_dict = {"degrees": 23,
-                         "unit": "C"}
+            temp_dict = {"degrees": temp[0],
+                         "unit": temp[1]}
         else:
             temp_dict = temp
         if not amount_dict:
@@ -151,28 +329,32 @@ class Container(Document):
 
         # adding_amount is the value to add to the container
         adding_amount = amount_dict["amount"]
-        if amount_dict["unit"] != self.size.unit:
+        if amount_dict["unit"] != size.unit:
             try:
-                adding_amount = convert_amount(amount_dict, self.size.unit)
+                adding_amount = convert_amount(amount_dict, size.unit)
             except ContainerError as e:
-                LOGGER.info("Unable to convert to unit %s. Not adding any volume. %s", self.size.unit, e)
+                LOGGER.info("Unable to convert to unit %s. Not adding any volume. %s", size.unit, e)
                 adding_amount = 0
 
         filled = self.total_filled()
-        if float(filled[0]) + float(adding_amount) > self.size.amount:
-            adding_amount = self.size.amount - filled[0]
-            self.contents.append(
+        if float(filled[0]) + float(adding_amount) > size.amount:
+            adding_amount = size.amount - filled[0]
+            lot = self._append_lot(
                 dict( amount = adding_amount,
-                      unit = self.size.unit,
+                      unit = size.unit,
                       content = content,
                       temperature = temp_dict,
                       content_type = content_type,
                       updated_datetime = updated_datetime,
                 )
             )
-            raise ContainerError("Error filling container: trying to add too much, only %s %s added (%s %s not added)" % (adding_amount, self.size.unit, amount_dict["amount"] - adding_amount, self.size.unit))
-        LOGGER.info("Adding full content %s %s %s" % (content, amount_dict["amount"], amount_dict["unit"]))
-        self.contents.append(
+            self._filled = filled[0] + self._lot_fill(lot)
+            self.full = True
+            if CHECK_FILL:
+                self.check_filled()
+            raise ContainerError("Error filling container: trying to add too much, only %s %s added (%s %s not added)" % (adding_amount, size.unit, Decimal(str(amount_dict["amount"])) - adding_amount, size.unit))
+        LOGGER.info("Adding full content %s %s %s", content, amount_dict["amount"], amount_dict["unit"])
+        lot = self._append_lot(
             dict( amount = amount_dict["amount"],
                   unit = amount_dict["unit"],
                   content = content,
@@ -180,18 +362,34 @@ class Container(Document):
                   content_type = content_type,
                   updated_datetime = updated_datetime,
               ))
+        self._filled = filled[0] + self._lot_fill(lot)
+        if CHECK_FILL:
+            self.check_filled()
 
-        if self.total_filled()[0] >= self.size.amount:
+        if self._filled >= size.amount:
             self.full = True
 
         
     def remove_all(self):
         """Remove all contents, and return a list
         """
+        if self.ledger is not None:
+            removed = self.ledger.remove_all()
+            self._filled = 0
+            self.full = False
+            return removed
         removed = []
         for content in self.contents:
-            removed.extend(self.remove_content(content.content, (content.amount, content.unit)))
-            
+            if not content.amount:
+                continue
+            removed.append( (content.content,
+                             {"amount": content.amount,
+                              "unit": content.unit},
+                             {"degrees": content.temperature.degrees,
+                              "unit": content.temperature.unit}) )
+        self.contents = []
+        self._filled = 0
+        self.full = False
         return removed
 
     def add_all(self, content_list):
@@ -202,143 +400,276 @@ class Container(Document):
         if not content_list:
             LOGGER.info("No contents to add")
             return
+        valid = []
         for content in content_list:
-            LOGGER.info("Attempting to add content %s", content)
-            #for (content, amount_tuple, temperature_tuple) in content_list:
-
-            try:
-                self.add_content(content[0], content[1], content[2])
-                LOGGER.info("Added content: %s", content)
-            except IndexError:
-
+            if isinstance(content, (tuple, list)) and len(content) == 3:
+                valid.append(content)
+            else:
                 LOGGER.error("Unable to add content %s", content)
+        if valid:
+            self.add_many(valid)
+
+    def add_many(self, content_list, updated_datetime=None):
+        """Add a batch of contents in one update.
+        content_list is a list of tuples ('content', (amount, unit), (degrees, unit)),
+        where amounts and temperatures may also be dictionaries as for add_content,
+        or a numpy array of CONTENT_DTYPE.
+        Capacity is checked once for the whole batch. If it does not all fit,
+        contents are added in order until the container is full, and a
+        ContainerError is raised.
+        """
+        (names, amounts, units, degrees, temp_units) = _content_columns(content_list)
+        if not names:
+            return
+        size_unit = self.size.unit
+        for unit in set(units):
+            if unit != size_unit and unit in VOLUME_UNITS:
+                raise ContainerError("Only able to add volume content measured in '{0}'".format(size_unit))
+        for unit in set(temp_units):
+            if unit.upper() not in TEMP_UNITS:
+                raise ContainerError("Unable to use the specified temperature unit %s" % (unit))
+        content_types = {}
+        for name in set(names):
+            content_types[name] = self.determine_content_type(name)
+        content_types = [ content_types[name] for name in names ]
+
+        filling = convert_many(numpy.asarray(amounts, dtype=numpy.float64), units, size_unit)
+        if size_unit in WEIGHT_UNITS:
+            filling[numpy.isin(units, VOLUME_UNITS)] = 0
+        cumulative = numpy.cumsum(filling)
+        filled = self.total_filled()[0]
+        room = self.size.amount - filled
+        fits = int(numpy.searchsorted(cumulative, float(room), side='right'))
+        if fits < len(names):
+            # Fill up with part of the first content that does not fit
+            partial = room - Decimal(repr(float(cumulative[fits - 1]))) if fits else room
+            names = names[:fits] + [names[fits]]
+            amounts = amounts[:fits] + [partial]
+            units = units[:fits] + [size_unit]
+            degrees = degrees[:fits + 1]
+            temp_units = temp_units[:fits + 1]
+            content_types = content_types[:fits + 1]
+        LOGGER.debug("Adding %s contents to %s", len(names), self.container_type)
+        self._extend_lots(names, amounts, units, degrees, temp_units, content_types,
+                          updated_datetime or datetime.now())
+
+        if fits < len(filling):
+            self._filled = Decimal(str(self.size.amount))
+            self.full = True
+            total = Decimal(repr(float(cumulative[-1])))
+            raise ContainerError("Error filling container: trying to add too much, only %s %s added (%s %s not added)" % (room, size_unit, total - room, size_unit))
+        self._filled = filled + Decimal(repr(float(cumulative[-1])))
+        if CHECK_FILL:
+            self.check_filled()
+        if self._filled >= self.size.amount:
+            self.full = True
+
+    def _extend_lots(self, names, amounts, units, degrees, temp_units, content_types, updated_datetime):
+        """Store many new content lots, the arguments are parallel lists
+        """
+        if self.ledger is not None:
+            self.ledger.extend(names, numpy.asarray(amounts, dtype=numpy.float64), units,
+                               degrees, temp_units, content_types, updated_datetime)
+            return
+        stamp = Container.contents.field.mapping.updated_datetime._to_json(updated_datetime)
+        lots = self._data['contents']
+        start = len(lots)
+        lots.extend( {'amount': str(amount),
+                      'unit': unit,
+                      'content': name,
+                      'updated_datetime': stamp,
+                      'temperature': {'degrees': str(temp_degrees),
+                                      'unit': temp_unit.upper()},
+                      'content_type': content_type}
+                     for (name, amount, unit, temp_degrees, temp_unit, content_type)
+                     in zip(names, amounts, units, degrees, temp_units, content_types) )
+        if self._index is not None:
+            for (position, name) in enumerate(names, start):
+                self._index.setdefault(name.lower(), []).append(position)
+
+    def remove_many(self, removals):
+        """Remove a batch of contents in one update.
+        removals is a list of tuples ('content', (amount, unit)), the amount may
+        also be a dictionary, or a numpy array with content, amount and unit fields.
+        Every content is checked to be in the container before anything is removed.
+        :return a list of tuples of the removed contents (content, amount, temperature)
+        """
+        (names, amounts, units) = _content_columns(removals)[:3]
+        # Amounts of the same content are added up, in the unit it was first asked in
+        wanted = {}
+        order = []
+        for (name, amount, unit) in zip(names, amounts, units):
+            key = name.lower()
+            if key not in wanted:
+                wanted[key] = [name, Decimal(str(amount)), unit]
+                order.append(key)
+            else:
+                wanted[key][1] += convert_amount( (Decimal(str(amount)), unit), wanted[key][2])
+        for key in order:
+            if not self._holds(wanted[key][0]):
+                raise ContainerError("Unable to remove the specify contents %s. The container is not currently filled with any" % (wanted[key][0]))
+        all_removed = []
+        for key in order:
+            all_removed.extend(self._take(*wanted[key]))
+        self._removed()
+        return all_removed
 
-        
     def remove_content(self, content, amount_tuple):
-        """Remove the specified amount of content
+        """Remove the specified amount of content, taking it from the lots of
+        that content in the order they were added
         :return a list of tuples of the removed contents (content, amount, temperature)
         """
-        
-        if content not in [ c.content for c in self.contents ]:
-            raise ContainerError("Unable to remove the specify contents %s. The container is not currently filled with any")
+        all_removed = self._take(content, amount_tuple[0], amount_tuple[1])
+        LOGGER.info("All removed content: %s", all_removed)
+        self._removed()
+        return all_removed
 
-        same_content = [ c for c in self.contents if c.content.lower() == content ]
-        reducing_amount = amount_tuple[0]
-        reducing_unit = amount_tuple[1]
+    def _holds(self, content):
+        """Return whether any of content is left in the container"""
+        if self.ledger is not None:
+            return self.ledger.holds(content)
+        lots = self._data['contents']
+        for position in self._content_index().get(content.lower(), ()):
+            if Decimal(lots[position]['amount']):
+                return True
+        return False
+
+    def _take(self, content, amount, unit):
+        """Take amount of content out of its lots and off the fill level.
+        Call _removed() once done taking.
+        :return a list of tuples of the removed contents (content, amount, temperature)
+        """
+        filled = self.total_filled()[0]
+        if self.ledger is not None:
+            all_removed = self.ledger.remove(content, amount, unit)
+            for (removed_content, removed_amount, temperature) in all_removed:
+                filled -= self._lot_fill(dict(amount=repr(removed_amount["amount"]), unit=removed_amount["unit"]))
+            self._filled = filled
+            return all_removed
+        positions = self._content_index().get(content.lower(), ())
+        lots = self._data['contents']
+        reducing_amount = Decimal(str(amount))
+        reducing_unit = unit
+        found = False
         all_removed = []
-        for current_content in self.contents:
-            if current_content.content.lower() == content.lower():
-                reducing_amount = convert_amount( (reducing_amount, reducing_unit), current_content.unit)
-                LOGGER.info("Converted amount to remove: %s %s", reducing_amount, current_content.unit)
-                if reducing_amount > current_content.amount:
-                    LOGGER.info("Amount reduce %s %s more than current contained content %s %s", reducing_amount, current_content.unit, current_content.amount, current_content.unit)
-                    reducing_amount = current_content.amount
-                    content_tuple = (content,
-                        (reducing_amount, current_content.unit),
-                        (current_content.temperature.degrees, current_content.temperature.unit))
-                    LOGGER.info("Removed content Appending content, amount, temperature %s to removed list %s", content_tuple,  all_removed)
-                    # Reduce the total amount of content to be removed
-                    reducing_amount -= current_content.amount
-
-                    all_removed.append(content_tuple)
-                    current_content.amount = 0
-                else:
-                    # Remove everything specified
-                    LOGGER.info("Removing full specified amount %s %s", reducing_amount, current_content.unit)
-                    current_content.amount -= reducing_amount
-                    content_tuple = (content,
-                                     {"amount": reducing_amount,
-                                      "unit": current_content.unit},
-                                     {"degrees": current_content.temperature.degrees,
-                                      "unit": current_content.temperature.unit})
-                    LOGGER.info("Updated content amount after reduction: %s %s", current_content.amount, current_content.unit)
-                    #LOGGER.info("Removed list: appending content, amount, temperature %s to removed list %s", content_tuple,  all_removed)
-                    LOGGER.info("Removed list addition: %s", content_tuple)
-                    all_removed.append(content_tuple)
-        LOGGER.info("List of all removed contents: %s", all_removed)
-        # Remove the empty contents
-        self.contents = [ c for c in self.contents if c.amount ]
+        for position in positions:
+            lot = lots[position]
+            lot_amount = Decimal(lot['amount'])
+            if not lot_amount:
+                continue
+            found = True
+            if not reducing_amount:
+                break
+            wanted = convert_amount( (reducing_amount, reducing_unit), lot['unit'])
+            if wanted < lot_amount:
+                taking = wanted
+                reducing_amount = 0
+            else:
+                taking = lot_amount
+                reducing_amount -= convert_amount( (lot_amount, lot['unit']), reducing_unit)
+                self._dead = self._dead or []
+                self._dead.append(position)
+            filled -= self._lot_fill(lot)
+            lot['amount'] = str(lot_amount - taking)
+            filled += self._lot_fill(lot)
+            all_removed.append( (lot['content'],
+                                 {"amount": taking,
+                                  "unit": lot['unit']},
+                                 {"degrees": Decimal(lot['temperature']['degrees']),
+                                  "unit": lot['temperature']['unit']}) )
+        if not found:
+            raise ContainerError("Unable to remove the specify contents %s. The container is not currently filled with any" % (content))
+        self._filled = filled
+        return all_removed
+
+    def _removed(self):
+        """Tidy up after taking contents out"""
+        # Emptied lots stay in place until they make up half the list
+        if self._dead and len(self._dead) * 2 > len(self._data['contents']):
+            self._compact()
+        if CHECK_FILL:
+            self.check_filled()
         if self.total_filled()[0] < self.size.amount:
             self.full = False
-        LOGGER.info("All removed content: %s", all_removed)
-        return all_removed
+
+    def into_kegs(self, kegs):
+        """Move the beer content into kegs, or any other containers such as
+        bottles, filling them in order. Usually done from a fermenter or a
+        holding tank. The whole fill plan is worked out at once (see
+        packaging.plan_packaging), the beer leaves the container in one
+        removal and each keg gets one addition.
+        :return the PackagingPlan
+        :throw PackagingError if the kegs cannot take all the beer, after filling them
+        """
+        beer_to_move = [ c for c in self.contents if c.content_type == ContentType.Beer ]
+
+        if len(beer_to_move) != 1:
+            raise PackagingError("Must have exactly one beer to transfer into kegs")
+        beer = beer_to_move[0]
+        kegs = list(kegs)
+        sizes = [ keg.size for keg in kegs ]
+        rooms = [ size.amount - keg.total_filled()[0] for (size, keg) in zip(sizes, kegs) ]
+        capacities = convert_many(rooms, [ size.unit for size in sizes ], beer.unit)
+        plan = plan_packaging(beer.amount, capacities)
+
+        if plan.filled_count:
+            moving = beer.amount if not plan.remainder else plan.packaged
+            removed = self.remove_content(beer.content, (moving, beer.unit))
+            temperature = removed[0][2]
+            updated_datetime = datetime.now()
+            for i in plan.filled.tolist():
+                keg = kegs[i]
+                fill = plan.fills[i]
+                if fill >= capacities[i]:
+                    amount = rooms[i]
+                else:
+                    amount = convert_amount( (float(fill), beer.unit), sizes[i].unit)
+                keg.add_content(beer.content, (amount, sizes[i].unit), temperature, ContentType.Beer, updated_datetime)
+        if plan.remainder:
+            LOGGER.error("Insufficient kegs to package remaining beer: %s %s", plan.remainder, beer.unit)
+            raise PackagingError("Insufficient kegs to package remaining beer: %s %s (%s more needed)" % (plan.remainder, beer.unit, plan.shortfall))
+        return plan
 
 class MashTun(Container):
 
-    def __init__(self, size_tuple):
+    def __init__(self, size_tuple=None):
         super(MashTun, self).__init__(container_type='mash_tun')
-        self.set_size(size_tuple)
+        # Loading a stored container (Document.wrap) gives no size
+        if size_tuple is not None:
+            self.set_size(size_tuple)
 
     def convert_to_wort(self):
         """Convert the contents to wort.
-        This replaces liquid contents with wort, and solid contents with 'used ...'
-        :return a list of the previous contents
+        This replaces liquid contents with wort, and solid contents with 'used ...'.
+        The wort and the used solids are left at the temperature all of them
+        settle at when mixed, measured in the unit of the first liquid.
+        :return a list of tuples of the previous contents (content, amount, temperature)
         """
-        wort_contents = []
-        total_wort_amount = {'amount': 0, 'unit': None}
-        wort_temperature = {'degrees': None, 'unit': None}
-        replaced_liquids = [] # liquids only
-        all_replaced = [] # all OLD content
-        new_contents = [] # all contents to be added again
-        LOGGER.info("Type of contents: %s", type(self.contents))
-        LOGGER.debug("Converting the following contents to wort: %s", self.contents)
-        
-        for content in self.contents:
-            if content.content in WORT_INGREDIENTS['liquid']:
-                if not total_wort_amount['amount']:
-                    total_wort_amount['amount'] = content.amount
-                    total_wort_amount['unit'] = content.unit
-                    wort_temperature['degrees'] = content.temperature.degrees
-                    wort_temperature['unit'] = content.temperature.unit
-                else:
-                    content_amount = convert_amount((content.amount, content.unit), total_wort_amount['unit'])
-                    ratio = content_amount / total_wort_amount['amount']
-                    content_temp = convert_temp((content.temperature.degrees, content.temperature.unit), wort_temperature['unit'])
-                    if content_temp == wort_temperature['degrees']:
-                        new_temperature = wort_temperature['degrees']
-                    elif content_temp > wort_temperature['degrees']:
-                        new_temperature = wort_temperature['degrees'] + ratio * content_temp
-                    elif content_temp < wort_temperature['degrees']:
-                        new_temperature = wort_temperature['degrees'] - ratio * content_temp
-                    wort_temperature['degrees'] = new_temperature
-                    total_wort_amount += convert_amount( (content.amount, content.unit), total_wort_amount['unit'])
-                replaced_liquids.append(content)
-                all_replaced.append(content)
-                LOGGER.info("Tracking content %s for replacement"% content.content)
-            elif content.content in WORT_INGREDIENTS['solid']:
-                content.content = "used " + content.content
-                all_replaced.append(content)
-                LOGGER.info("Tracking content %s for replacement"% content.content)
-        removed = []
-        to_add = []
-        wort_content = ("wort", total_wort_amount, wort_temperature)
-        to_add += [ wort_content ]
-        LOGGER.info("All content to be replaced: %s", [ c.content for c in all_replaced ])
-        for content in all_replaced:
-            LOGGER.info("Removing content: %s", content.content)
-            removed.extend(self.remove_content(content.content, (content.amount, content.unit))) 
-
-            if content.content in WORT_INGREDIENTS['solid'] or content.content.replace("used ","") in WORT_INGREDIENTS["solid"]:
-                LOGGER.debug("Will 'add' back in solid ingredient %s", content.content)
-                to_add.append( (content.content, 
-                                {"amount": content.amount, "unit": content.unit}, 
-                                {"degrees": content.temperature.degrees, "unit": content.temperature.unit}) )
-            LOGGER.info("Updated list of temporarily 'removed' contents: %s", removed)            
-
+        contents = self.contents
+        LOGGER.debug("Converting the following contents to wort: %s", contents)
+        replaced = [ c for c in contents if c.content in WORT_INGREDIENTS['liquid'] or c.content in WORT_INGREDIENTS['solid'] ]
+        liquids = [ c for c in replaced if c.content in WORT_INGREDIENTS['liquid'] ]
+        if not liquids:
+            raise ContainerError("No liquid in the %s to make wort from" % (self.container_type))
+
+        wort_unit = liquids[0].unit
+        temp_unit = liquids[0].temperature.unit
+        wort_amount = sum( convert_amount( (c.amount, c.unit), wort_unit) for c in liquids )
+        mixed = mix_temperatures(convert_many([ c.amount for c in replaced ], [ c.unit for c in replaced ], 'kg'),
+                                 convert_temps([ c.temperature.degrees for c in replaced ],
+                                               [ c.temperature.unit for c in replaced ], temp_unit),
+                                 heat_capacities([ c.content_type for c in replaced ]))
+        wort_temperature = (float(mixed), temp_unit)
+
+        to_add = [ ("wort", (wort_amount, wort_unit), wort_temperature) ]
+        to_add += [ ("used " + c.content, (c.amount, c.unit), wort_temperature)
+                    for c in replaced if c.content in WORT_INGREDIENTS['solid'] ]
+        removed = self.remove_many([ (c.content, (c.amount, c.unit)) for c in replaced ])
         LOGGER.info("Adding replacement content in the container: %s", to_add)
+        self.add_many(to_add)
+        return removed
+
 
-        
-        for content in to_add:
-            LOGGER.info("Adding replacement content %s", content)
-            LOGGER.info("Content: %s", content[0])
-            LOGGER.info("Amount: %s", content[1])
-            LOGGER.info("Temperature %s", content[2])
-            self.add_content(content[0], content[1], content[2])
-
-        return all_replaced
-            
-            
-            
 class FermentationError(Exception):
     pass
 
@@ -346,110 +677,177 @@ class PackagingError(Exception):
     pass
 
 class Fermenter(Container):
-    def __init__(self, size_tuple):
-        super(Fermenter, self).__init__(container_type='fermenter')
-        self.set_size(size_tuple)
-
-    def into_kegs(self, kegs):
-        """Move the beer content into kegs
-        """
-        beer_to_move = [ c for c in self.contents if c.content_type == c.ContentType.Beer ]
-
-        if len(beer_to_move) != 1:
-            raise PackagingError("Must have exactly one beer to transfer into kegs")
-        beer = beer_to_move[0]
-        total_remaining = {"amount": beer.amount, "unit": beer.unit }
-        for keg in kegs:
-            (amount, unit) = (keg.size.amount, keg.size.unit)
-            # if unit != self.size.unit:
-            #     raise PackagingError("Keg unit must be the same as container unit %s", self.size.unit)
-            move_amount = convert_amount( (amount, unit), self.size.unit)
-            removed = self.remove_content(beer.content, (move_amount, self.size.unit))
-            
-            for content in removed:
-                keg.add_content(content[0], content[1], content[2], ContentType.Beer)
-                total_remaining["amount"] -= convert_amount(content[1], beer.unit)
-            if not total_remaining["amount"]
-                LOGGER.info("No more volume to put into kegs")
-                break
-        if total_remaining:
-            LOGGER.error("Insufficient kegs to package remaining beer: %s", total_remaining)
-            raise PackagingError("Insufficient kegs to package remaining beer: %s" % total_remaining)
+    # Progress of the fermentation, concentrations in g/l, see fermentation.py
+    fermentation = DictField(Mapping.build(
+        sugar = FloatField(),
+        ethanol = FloatField(),
+        co2 = FloatField(),
+        biomass = FloatField(),
+        hours = FloatField()
+        ))
 
-    def ferment_wort(self, timedelta):
-        """Convert wort to beer, over the given timespan
-        :return a list of the previous contents of the fermenter
+    def __init__(self, size_tuple=None):
+        super(Fermenter, self).__init__(container_type='fermenter')
+        if size_tuple is not None:
+            self.set_size(size_tuple)
+
+    def ferment_wort(self, timedelta, mode='fixed', step=1.0):
+        """Ferment the wort over the given timespan, see fermentation.ferment_fleet.
+        The wort becomes beer once its sugar is used up, until then the
+        progress is kept in self.fermentation.
+        :return a list of the previous contents of the fermenter (empty while still fermenting)
         """
-        if "wort" not in [ c.content for c in self.contents ]:
+        worts = [ c.content for c in self.contents if c.content_type == ContentType.Wort ]
+        if not worts:
             raise FermentationError("No wort found in the fermenter, unable to ferment!")
-        else:
-            worts = [ c.content for c in self.contents if c.content == "wort" ]
         if len(worts) != 1:
             raise FermentationError("Unable to ferment multiple worts at one time: %s" % (worts))
+        return ferment_fleet([self], timedelta, mode, step)[self]
 
-        removed = []
-        updated_datetime = None
-        for content in self.contents:
-            updated_datetime = content.updated_datetime+timedelta
-            if content.content_type == ContentType.Wort:
-                removed.extend(self.remove_content(content.content, (content.amount, content.unit)))
-            
-        to_add = []
+    def _wort_to_beer(self):
+        """Replace the wort with beer, dated the hours fermented after the
+        wort, and clear the progress for the next wort
+        :return a list of the removed wort contents
+        """
+        wort = [ c for c in self.contents if c.content_type == ContentType.Wort ][0]
+        updated_datetime = wort.updated_datetime + timedelta(hours=self.fermentation.hours or 0)
+        removed = self.remove_content(wort.content, (wort.amount, wort.unit))
         for (content, amount, temperature) in removed:
-            self.add_content("beer", amount, temperature, ContentType.Beer, updated_datetime )
-
+            self.add_content("beer", amount, temperature, ContentType.Beer, updated_datetime)
+        self.fermentation = {}
         return removed
 
 class Storage(Container):
-    def __init__(self, size_tuple):
+    def __init__(self, size_tuple=None):
         super(Storage, self).__init__(container_type='container')
-        self.set_size(size_tuple)
+        if size_tuple is not None:
+            self.set_size(size_tuple)
 
 class Keg(Container):
-    def __init__(self, size_tuple):
-        super(Keg, self).__init__(name, container_type='keg')
-        self.set_size(size_tuple)
+    def __init__(self, size_tuple=None):
+        super(Keg, self).__init__(container_type='keg')
+        if size_tuple is not None:
+            self.set_size(size_tuple)
 
 class Bottle(Container):
-    def __init__(self, size_tuple):
-        super(Bottle, self).__init__(name, container_type='bottle')
-        self.set_size(size_tuple)
+    def __init__(self, size_tuple=None):
+        super(Bottle, self).__init__(container_type='bottle')
+        if size_tuple is not None:
+            self.set_size(size_tuple)
+
+class UnitRegistry(object):
+    """Conversion factors between every pair of units, computed once.
 
-def convert_amount( amount, target_unit):
+    matrix[codes[unit], codes[target]] is the factor taking an amount in
+    unit to an amount in target.
     """
-    Convert the given amount into a target unit. Return a number (of the specified target_unit)
+
+    def __init__(self, unit_sizes):
+        self.units = tuple(sorted(unit_sizes))
+        self.codes = dict((unit, code) for (code, unit) in enumerate(self.units))
+        sizes = numpy.array([ unit_sizes[unit] for unit in self.units ], dtype=numpy.float64)
+        self.matrix = sizes[:, numpy.newaxis] / sizes[numpy.newaxis, :]
+        self.factors = {}
+        self.decimal_factors = {}
+        for unit in self.units:
+            for target in self.units:
+                self.factors[(unit, target)] = float(self.matrix[self.codes[unit], self.codes[target]])
+                self.decimal_factors[(unit, target)] = Decimal(repr(unit_sizes[unit])) / Decimal(repr(unit_sizes[target]))
+
+    def code(self, unit):
+        """Return the integer code of unit, as used to index matrix"""
+        try:
+            return self.codes[unit]
+        except KeyError:
+            pass
+        try:
+            return self.codes[unit.lower()]
+        except (KeyError, AttributeError):
+            raise ContainerError("Unknown unit %s" % (unit,))
+
+    def convert(self, amount, unit, target_unit):
+        """Return amount (of unit) as a number of target_unit.
+        Decimal amounts stay Decimal, anything else is multiplied as a float
+        """
+        if unit == target_unit:
+            return amount
+        key = (unit, target_unit)
+        if key not in self.factors:
+            key = (self.units[self.code(unit)], self.units[self.code(target_unit)])
+        if isinstance(amount, Decimal):
+            return amount * self.decimal_factors[key]
+        return amount * self.factors[key]
+
+    def convert_many(self, amounts, units, target_unit):
+        """Convert an array of amounts into target_unit in one pass.
+
+        :param units - a single unit for all amounts, a sequence of unit
+        names, or an integer array of unit codes
+        :return a float64 numpy array
+        """
+        amounts = numpy.asarray(amounts, dtype=numpy.float64)
+        target_code = self.code(target_unit)
+        if isinstance(units, str):
+            return amounts * self.matrix[self.code(units), target_code]
+        units = numpy.asarray(units)
+        if units.dtype.kind in 'iu':
+            codes = units
+        else:
+            (names, inverse) = numpy.unique(units, return_inverse=True)
+            codes = numpy.array([ self.code(name) for name in names ], dtype=numpy.intp)[inverse]
+        return amounts * self.matrix[codes, target_code]
+
+
+UNITS = UnitRegistry(UNIT_SIZES)
+
+def _content_columns(content_list):
+    """Split a batch of contents into parallel lists:
+    names, amounts, units, degrees and temperature units.
+    See Container.add_many for the accepted forms.
     """
+    if isinstance(content_list, numpy.ndarray):
+        fields = content_list.dtype.names
+        count = len(content_list)
+        degrees = content_list['degrees'].tolist() if 'degrees' in fields else [23] * count
+        temp_units = content_list['temp_unit'].tolist() if 'temp_unit' in fields else ['C'] * count
+        return (content_list['content'].tolist(), content_list['amount'].tolist(),
+                content_list['unit'].tolist(), degrees, temp_units)
+    names = []
+    amounts = []
+    units = []
+    degrees = []
+    temp_units = []
+    for content in content_list:
+        names.append(content[0])
+        amount = content[1]
+        if "unit" in amount:
+            amounts.append(amount["amount"])
+            units.append(amount["unit"])
+        else:
+            amounts.append(amount[0])
+            units.append(amount[1])
+        temp = content[2] if len(content) > 2 else (23, "C")
+        if "unit" in temp:
+            degrees.append(temp["degrees"])
+            temp_units.append(temp["unit"])
+        else:
+            degrees.append(temp[0])
+            temp_units.append(temp[1])
+    return (names, amounts, units, degrees, temp_units)
 
+def convert_amount(amount, target_unit):
+    """
+    Convert the given amount into a target unit. Return a number (of the specified target_unit)
+    :param amount - may be dictionary: {"amount": amount, "unit": unit}, or tuple (amount, unit)
+    """
     if "amount" in amount:
-        amount_tuple = (amount["amount"], amount["unit"])
-    else:
-        amount_tuple = amount
-    if amount_tuple[1] == target_unit:
-        return amount_tuple[0]
-    LOGGER.debug("Converting amount,unit %s into target unit %s", amount_tuple, target_unit)
-    try:
-        amount = amount_tuple[0]
-        unit = amount_tuple[1]
-    except IndexError as e:
-        LOGGER.error("Unable to determine amount value based on (value, unit) %s: %s", amount_tuple, e)
-        raise
-        
-    if unit == target_unit:
-        return amount
-    if target_unit == "l" and unit == "gal":
-        return amount / 3.78541
-    elif target_unit == "l" and unit == "ml":
-        return amount / 1000
-    elif target_unit == 'l' and unit == 'kg':
-        # use 1 to 1 for kg to l
-        return amount
-    elif target_unit == 'l' and unit == 'g':
-        if amount < 500:
-            return 0
-        else:
-            return amount / 1000
-    else:
-        raise ContainerError("Unable to convert from %s into %s" % (unit, target_unit))
+        return UNITS.convert(amount["amount"], amount["unit"], target_unit)
+    return UNITS.convert(amount[0], amount[1], target_unit)
+
+def convert_many(amounts, units, target_unit):
+    """Convert a whole array of amounts into target_unit, see UnitRegistry.convert_many
+    """
+    return UNITS.convert_many(amounts, units, target_unit)
 
 
 def move_all(first_container, second_container):
@@ -460,16 +858,37 @@ def move_all(first_container, second_container):
     
     removed = first_container.remove_all()
     LOGGER.info("Removed from the first container %s: %s", first_container.container_type, removed)
-    to_add = [ content for content in removed if content not in RUBBISH_CONTENTS ]
+    to_add = [ content for content in removed if content[0].lower() not in RUBBISH_CONTENTS ]
 
-    garbage = [ content for content in removed if content in RUBBISH_CONTENTS ]
+    garbage = [ content for content in removed if content[0].lower() in RUBBISH_CONTENTS ]
     if garbage:
-        LOGGER.info("Garbage from the moving process:", garbage)
+        LOGGER.info("Garbage from the moving process: %s", garbage)
     LOGGER.info("Items to add to second container %s: %s", second_container.container_type, to_add)
     second_container.add_all(to_add)
-    LOGGER.info("Second container contents: %s", second_container.contents)
+    if LOGGER.isEnabledFor(logging.INFO):
+        LOGGER.info("Second container contents: %s", second_container.contents)
     return garbage
     
     
     
     
+
+
+from fattybrewing.container.ledger import ContentLedger
+from fattybrewing.container.temperature import convert_temp, convert_temps, mix_temperatures, heat_capacities
+from fattybrewing.container.fermentation import ferment_fleet
+from fattybrewing.container.packaging import plan_packaging
+from fattybrewing.container.transfer import Transfer
+from fattybrewing.container import hooks
+
+hooks.register('add', Container, 'add_content')
+hooks.register('add', Container, 'add_many')
+hooks.register('remove', Container, 'remove_content')
+hooks.register('remove', Container, 'remove_many')
+hooks.register('remove', Container, 'remove_all')
+hooks.register('heat', Container, 'heat_contents')
+hooks.register('mash', MashTun, 'convert_to_wort')
+hooks.register('ferment', Fermenter, 'ferment_wort')
+hooks.register('package', Container, 'into_kegs')
+hooks.register('transfer', sys.modules[__name__], 'move_all')
+hooks.register('transfer', Transfer, 'move')
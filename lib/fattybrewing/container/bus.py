@@ -0,0 +1,98 @@
+"""In process message bus for the brewery controllers
+
+Named topics, each a bounded asyncio queue: publishing to a full topic
+waits until a controller has taken something off it, so a slow stage
+holds back the stages feeding it. Controllers listening on the same topic
+share its messages, each message going to one of them, and may take
+several at a time.
+
+The README topology uses three topics: MASH_TOPIC for work orders,
+FERMENT_TOPIC ('ferment-queue') and PACKAGE_TOPIC ('fattypackaging').
+PACKAGED_TOPIC reports finished orders.
+
+Synopsis:
+-----------
+
+from fattybrewing.container import bus
+
+message_bus = bus.MessageBus()
+await message_bus.publish(bus.Message(bus.MASH_TOPIC, 1, recipe))
+messages = await message_bus.receive(bus.FERMENT_TOPIC, max_batch=8)
+
+"""
+
+import asyncio
+
+MASH_TOPIC = 'mash-queue'
+FERMENT_TOPIC = 'ferment-queue'
+PACKAGE_TOPIC = 'fattypackaging'
+PACKAGED_TOPIC = 'packaged'
+
+
+class Message(object):
+    """A message about one order
+
+    order_number, recipe - the order, as sent with every message
+    holding_tanks - containers the order's wort or beer is waiting in
+    measurements - anything measured on the way, e.g. {'volume': (1000, 'l')}
+    """
+
+    def __init__(self, topic, order_number, recipe, holding_tanks=(), measurements=None):
+        self.topic = topic
+        self.order_number = order_number
+        self.recipe = recipe
+        self.holding_tanks = list(holding_tanks)
+        self.measurements = measurements or {}
+
+    def forward(self, topic, holding_tanks=(), **measurements):
+        """Return a message about the same order for topic, adding measurements"""
+        forwarded = dict(self.measurements)
+        forwarded.update(measurements)
+        return Message(topic, self.order_number, self.recipe, holding_tanks, forwarded)
+
+    def __repr__(self):
+        return "<Message %s order %s>" % (self.topic, self.order_number)
+
+
+class MessageBus(object):
+    """Topics created when first used, each holding at most maxsize messages"""
+
+    def __init__(self, maxsize=16):
+        self.maxsize = maxsize
+        self.topics = {}
+        self.published = {}
+        self.delivered = {}
+
+    def topic(self, name):
+        """Return the queue of topic name"""
+        if name not in self.topics:
+            self.topics[name] = asyncio.Queue(self.maxsize)
+            self.published[name] = 0
+            self.delivered[name] = 0
+        return self.topics[name]
+
+    async def publish(self, message):
+        """Put message on its topic, waiting while the topic is full"""
+        await self.topic(message.topic).put(message)
+        self.published[message.topic] += 1
+
+    async def publish_many(self, messages):
+        for message in messages:
+            await self.publish(message)
+
+    async def receive(self, name, max_batch=1):
+        """Wait for a message on topic name
+        :return a list of up to max_batch messages, those waiting on the topic
+        """
+        queue = self.topic(name)
+        batch = [await queue.get()]
+        while len(batch) < max_batch and not queue.empty():
+            batch.append(queue.get_nowait())
+        for i in range(len(batch)):
+            queue.task_done()
+        self.delivered[name] += len(batch)
+        return batch
+
+    def pending(self, name):
+        """Return the number of messages waiting on topic name"""
+        return self.topic(name).qsize()
@@ -0,0 +1,211 @@
+"""A read-through cache of containers loaded from CouchDB
+
+ContainerCache keeps the most recently used containers in memory, keyed
+by document id, up to a size bound (CACHE_SIZE by default, set with the
+FATTYBREW_CACHE_SIZE environment variable). Controllers reading the same
+vessel get the same Container instance without going to the database.
+
+The database's _changes feed keeps the cache honest: when a cached
+container's revision moves on because someone else stored it, the entry
+is dropped, or with refresh=True reloaded into the cached instance.
+follow_changes reads the feed on a background thread; process_changes
+applies changes got some other way.
+
+A container missing from the cache is loaded by the first thread asking
+for it, the others wait for that load. If a change to it comes in while
+it is loading the revision read may be out of date, so it is loaded
+again before being cached.
+
+Synopsis:
+-----------
+
+from fattybrewing.container import cache
+
+containers = cache.ContainerCache(database, refresh=True)
+containers.follow_changes()
+mash_tun = containers.get(mash_tun_id)
+...
+containers.stop()
+
+"""
+
+from collections import OrderedDict
+import logging
+import os
+import threading
+
+from fattybrewing.container.persistence import load_container
+
+LOGGER = logging.getLogger(__name__)
+
+CACHE_SIZE = int(os.environ.get("FATTYBREW_CACHE_SIZE", 1024))
+
+
+class _Loading(object):
+    """A container being loaded by one thread, for the others asking for it"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.stale = False
+        self.failed = False
+        self.container = None
+
+
+class ContainerCache(object):
+    """The size most recently used containers of database, by id"""
+
+    def __init__(self, database, size=None, refresh=False):
+        self.database = database
+        self.size = CACHE_SIZE if size is None else size
+        self.refresh = refresh
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.last_seq = None
+        self._entries = OrderedDict()
+        # id -> _Loading of the containers being loaded
+        self._loading = {}
+        self._lock = threading.RLock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, id):
+        return id in self._entries
+
+    def get(self, id):
+        """Return the container with id, loading it if not cached
+        :return the Container, or None if there is none with id
+        """
+        with self._lock:
+            container = self._entries.get(id)
+            if container is not None:
+                self._entries.move_to_end(id)
+                self.hits += 1
+                return container
+            self.misses += 1
+            loading = self._loading.get(id)
+            waiting = loading is not None
+            if not waiting:
+                loading = self._loading[id] = _Loading()
+        if waiting:
+            loading.done.wait()
+            if loading.failed:
+                return self.get(id)
+            return loading.container
+        try:
+            loading.container = self._load(id, loading)
+        except Exception:
+            loading.failed = True
+            raise
+        finally:
+            with self._lock:
+                del self._loading[id]
+            loading.done.set()
+        return loading.container
+
+    def _load(self, id, loading):
+        """Load id until no change to it came in meanwhile, and cache it
+        unless another thread put it first
+        """
+        while True:
+            container = load_container(self.database, id)
+            with self._lock:
+                if loading.stale:
+                    loading.stale = False
+                    continue
+                if container is None:
+                    return None
+                cached = self._entries.get(id)
+                if cached is not None:
+                    self._entries.move_to_end(id)
+                    return cached
+                self.put(container)
+                return container
+
+    def put(self, container):
+        """Cache a container (which must have an id), e.g. after storing it"""
+        with self._lock:
+            self._entries[container.id] = container
+            self._entries.move_to_end(container.id)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def evict(self, id):
+        with self._lock:
+            if self._entries.pop(id, None) is not None:
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def process_changes(self, changes):
+        """Apply changes from the _changes feed, dictionaries with id,
+        changes (a list of {'rev': rev}) and deleted
+        """
+        for change in changes:
+            id = change['id']
+            with self._lock:
+                if id in self._loading:
+                    self._loading[id].stale = True
+                container = self._entries.get(id)
+                if container is None:
+                    continue
+                revs = [ c['rev'] for c in change.get('changes') or () ]
+                if container.rev in revs and not change.get('deleted'):
+                    continue
+                if not self.refresh or change.get('deleted'):
+                    self.evict(id)
+                    continue
+            data = self.database.get(id)
+            with self._lock:
+                if self._entries.get(id) is not container:
+                    continue
+                if data is None:
+                    self.evict(id)
+                elif data['_rev'] != container.rev:
+                    LOGGER.debug("Refreshing %s to revision %s", id, data['_rev'])
+                    container._replace_data(data)
+
+    def poll_changes(self, timeout=10000):
+        """Wait up to timeout ms for changes since the last seen, and apply them
+        :return the number of changes
+        """
+        if self.last_seq is None:
+            self.last_seq = self.database.info()['update_seq']
+        feed = self.database.changes(feed='longpoll', since=self.last_seq, timeout=timeout)
+        self.process_changes(feed['results'])
+        self.last_seq = feed['last_seq']
+        return len(feed['results'])
+
+    def follow_changes(self, timeout=10000):
+        """Keep applying changes on a background thread, until stop.
+        Changes from before the call are not looked at.
+        """
+        if self._thread is not None:
+            return
+        self.last_seq = self.database.info()['update_seq']
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._follow, args=(timeout,), daemon=True)
+        self._thread.start()
+
+    def _follow(self, timeout):
+        while not self._stop.is_set():
+            try:
+                self.poll_changes(timeout)
+            except Exception:
+                # Cached containers may be stale, start again from empty
+                LOGGER.exception("Unable to read the changes feed, clearing the cache")
+                self.clear()
+                self._stop.wait(1)
+
+    def stop(self):
+        """Stop following changes, waiting for the current poll (at most its timeout)"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
@@ -0,0 +1,126 @@
+"""Controllers running the brewery from the message bus
+
+As in the README: the mash tun controller takes work orders, mashes and
+passes the wort into a holding tank, telling the ferment-queue. A
+ferment controller fills its fermenter from the holding tank, ferments,
+drains the beer into a bright tank and tells fattypackaging, where a
+package controller puts it into kegs or bottles.
+
+Each controller is a coroutine looking after one vessel, and all of them
+run concurrently in one event loop. Free holding and bright tanks are
+kept in queues too, so a controller waits for a tank rather than
+overfilling one.
+
+Synopsis:
+-----------
+
+from fattybrewing.container import controllers
+
+orders = [ (number, simulation.Recipe('pale ale')) for number in range(1, 11) ]
+finished = asyncio.run(controllers.run_orders(orders, mash_tuns, fermenters, packaging_lines,
+                                              holding_tanks, bright_tanks))
+
+"""
+
+import asyncio
+from datetime import timedelta
+
+from fattybrewing.container import ContentType, convert_amount, move_all
+from fattybrewing.container.bus import MessageBus, Message, MASH_TOPIC, FERMENT_TOPIC, PACKAGE_TOPIC, PACKAGED_TOPIC
+
+
+def tank_pool(tanks):
+    """Return a queue of free tanks"""
+    pool = asyncio.Queue()
+    for tank in tanks:
+        pool.put_nowait(tank)
+    return pool
+
+
+async def mash_controller(bus, mash_tun, holding_tanks, max_batch=1):
+    """Mash work orders from MASH_TOPIC in mash_tun, one after the other"""
+    while True:
+        for order in await bus.receive(MASH_TOPIC, max_batch):
+            recipe = order.recipe
+            temperature = (recipe.mash_temperature, 'C')
+            mash_tun.add_many([ ('water', (recipe.water, mash_tun.size.unit), temperature),
+                                ('malt', (recipe.malt, 'kg'), temperature),
+                                ('hops', (recipe.hops, 'kg'), temperature) ])
+            mash_tun.convert_to_wort()
+            tank = await holding_tanks.get()
+            move_all(mash_tun, tank)
+            # Dig out the used grains and hops
+            mash_tun.remove_all()
+            await bus.publish(order.forward(FERMENT_TOPIC, [tank]))
+
+
+async def ferment_controller(bus, fermenter, holding_tanks, bright_tanks, ferment_interval=12.0):
+    """Ferment orders from FERMENT_TOPIC in fermenter, one at a time"""
+    while True:
+        (order,) = await bus.receive(FERMENT_TOPIC)
+        for tank in order.holding_tanks:
+            move_all(tank, fermenter)
+            holding_tanks.put_nowait(tank)
+        fermenter.add_content('yeast', (order.recipe.yeast, 'kg'))
+        fermenter.heat_contents((order.recipe.ferment_temperature, 'C'))
+        hours = ferment_interval
+        while not fermenter.ferment_wort(timedelta(hours=ferment_interval)):
+            hours += ferment_interval
+            # Let the other controllers run between rounds
+            await asyncio.sleep(0)
+        beer = [ c for c in fermenter.contents if c.content_type == ContentType.Beer ][0]
+        volume = (beer.amount, beer.unit)
+        tank = await bright_tanks.get()
+        tank.add_all(fermenter.remove_content(beer.content, volume))
+        # Clean out the yeast, ready for the next order
+        fermenter.remove_all()
+        await bus.publish(order.forward(PACKAGE_TOPIC, [tank], volume=volume, hours=hours))
+
+
+async def package_controller(bus, line, bright_tanks, max_batch=4):
+    """Package the beer of orders from PACKAGE_TOPIC on a PackagingLine"""
+    while True:
+        for order in await bus.receive(PACKAGE_TOPIC, max_batch):
+            packages = 0
+            for tank in order.holding_tanks:
+                beer = [ c for c in tank.contents if c.content_type == ContentType.Beer ][0]
+                plan = tank.into_kegs(line.packages_for(float(convert_amount( (beer.amount, beer.unit), 'l'))))
+                packages += plan.filled_count
+                tank.remove_all()
+                bright_tanks.put_nowait(tank)
+            await bus.publish(order.forward(PACKAGED_TOPIC, packages=packages))
+
+
+async def run_orders(orders, mash_tuns, fermenters, packaging_lines, holding_tanks, bright_tanks, bus=None):
+    """Run orders, a list of (order number, Recipe), through the brewery
+    with one controller per vessel.
+    :return the PACKAGED_TOPIC messages, in the order finished
+    """
+    bus = bus or MessageBus()
+    holding = tank_pool(holding_tanks)
+    bright = tank_pool(bright_tanks)
+    tasks = [ asyncio.ensure_future(mash_controller(bus, mash_tun, holding)) for mash_tun in mash_tuns ]
+    tasks += [ asyncio.ensure_future(ferment_controller(bus, fermenter, holding, bright)) for fermenter in fermenters ]
+    tasks += [ asyncio.ensure_future(package_controller(bus, line, bright)) for line in packaging_lines ]
+    tasks.append(asyncio.ensure_future(bus.publish_many([ Message(MASH_TOPIC, number, recipe) for (number, recipe) in orders ])))
+    running = list(tasks)
+    finished = []
+    try:
+        while len(finished) < len(orders):
+            receiving = asyncio.ensure_future(bus.receive(PACKAGED_TOPIC, len(orders)))
+            tasks.append(receiving)
+            # Watch the controllers too, one failing must not leave us waiting for ever
+            (done, pending) = await asyncio.wait([receiving] + running, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task is not receiving:
+                    running.remove(task)
+                    task.result()
+            if receiving in done:
+                finished.extend(receiving.result())
+            else:
+                receiving.cancel()
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    return finished
@@ -0,0 +1,479 @@
+"""An embedded document database, in memory or in an append-only file
+
+EmbeddedDatabase answers the calls couchdb-python's mapping Documents,
+persistence and views make on a couchdb.client.Database: save, get,
+update (_bulk_docs), view, changes, info, and the dictionary methods.
+Simulations and tests can use it in place of a CouchDB server, and
+persistence.open_database picks one or the other from a location.
+
+It works like CouchDB where it matters to those callers:
+- every save gives the document a new _rev, and saving with a stale
+  _rev raises couchdb.http.ResourceConflict (or, from update, comes
+  back as a failed result)
+- documents are stored as JSON, so a loaded document is a copy and only
+  JSON values can be stored
+- views are indexed: each query first maps the documents changed since
+  the last one, then reads a key range of the sorted rows. Map
+  functions must be Python (language 'python', as for couchpy), and
+  reduce functions may be _count, _sum, _stats or Python
+- the changes feed has one entry per document, for its last change
+
+With a path, every change is appended to the file as a line of JSON and
+the file is read back when the database is opened again. A torn last
+line, from a crash part way through a write, is cut off. compact
+rewrites the file with only the current revisions.
+
+Synopsis:
+-----------
+
+from fattybrewing.container import embedded, views
+
+database = embedded.EmbeddedDatabase('fattybrewing', path='/var/lib/fattybrewing/containers.jsonl')
+views.install(database)
+fermenter.store(database)
+views.find_empty(database, 'fermenter', min_size=(60, 'l'))
+
+"""
+
+from bisect import bisect_left, bisect_right
+from types import FunctionType
+from uuid import uuid4
+import hashlib
+import json
+import logging
+import os
+import threading
+
+from couchdb.client import Document, Row
+from couchdb.http import ResourceConflict, ResourceNotFound
+
+LOGGER = logging.getLogger(__name__)
+
+
+def collation_key(value):
+    """Sort key for view keys, in CouchDB's collation order: null, false,
+    true, numbers, strings, arrays then objects
+    """
+    if value is None:
+        return (0,)
+    if value is False:
+        return (1,)
+    if value is True:
+        return (2,)
+    if isinstance(value, (int, float)):
+        return (3, value)
+    if isinstance(value, str):
+        return (4, value)
+    if isinstance(value, (list, tuple)):
+        return (5, tuple( collation_key(item) for item in value ))
+    return (6, tuple( (key, collation_key(item)) for (key, item) in value.items() ))
+
+
+def _compile(source):
+    """Return the last function defined by source, like couchpy does"""
+    namespace = {}
+    exec(source, namespace)
+    functions = [ value for value in namespace.values() if isinstance(value, FunctionType) ]
+    if not functions:
+        raise ValueError("No function defined in %r" % (source))
+    return functions[-1]
+
+
+def _stats(values):
+    return dict( sum = sum(values),
+                 count = len(values),
+                 min = min(values),
+                 max = max(values),
+                 sumsqr = sum( value * value for value in values ) )
+
+
+BUILTIN_REDUCE = {'_count': len,
+                  '_sum': sum,
+                  '_stats': _stats,
+                  }
+
+
+class ViewResults(object):
+    """The rows of a view query, as couchdb.client.Rows, or wrapped"""
+
+    def __init__(self, rows, total_rows=None, offset=None):
+        self.rows = rows
+        self.total_rows = total_rows
+        self.offset = offset
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, index):
+        return self.rows[index]
+
+
+class _ViewIndex(object):
+    """The sorted rows of one view, kept up to date with the database"""
+
+    def __init__(self, map_fun, reduce_fun):
+        self.map_fun = map_fun
+        self.reduce_fun = reduce_fun
+        self.seq = 0
+        # id -> its rows. A row is (collation key, id, position, key, value),
+        # the position in what the document emitted keeps rows with the
+        # same key and id from comparing values
+        self.by_id = {}
+        self.rows = []
+        # The collation key of each row, to bisect on
+        self.keys = []
+
+    def update(self, database):
+        changed = database._changed_since(self.seq)
+        if not changed:
+            return
+        rebuild = len(changed) * 8 > len(self.rows)
+        for (id, text) in changed:
+            old = self.by_id.pop(id, ())
+            new = []
+            if text is not None and not id.startswith('_design/'):
+                new = [ (collation_key(key), id, position, key, value)
+                        for (position, (key, value)) in enumerate(self.map_fun(json.loads(text)) or ()) ]
+                if new:
+                    self.by_id[id] = new
+            if rebuild:
+                continue
+            for row in old:
+                i = bisect_left(self.rows, row)
+                del self.rows[i]
+                del self.keys[i]
+            for row in new:
+                i = bisect_left(self.rows, row)
+                self.rows.insert(i, row)
+                self.keys.insert(i, row[0])
+        if rebuild:
+            self.rows = sorted( row for rows in self.by_id.values() for row in rows )
+            self.keys = [ row[0] for row in self.rows ]
+        self.seq = database.update_seq
+
+
+class EmbeddedDatabase(object):
+    """A document database in this process, in memory, or also in the
+    append-only file path if given
+    """
+
+    # The language views have to be written in, see views.install
+    view_language = 'python'
+
+    def __init__(self, name='fattybrewing', path=None, sync=False):
+        self.name = name
+        self.path = path
+        self.sync = sync
+        self.update_seq = 0
+        # id -> JSON text of the current revision
+        self._docs = {}
+        # id -> (seq, rev, deleted) of its last change, in seq order
+        self._changes = {}
+        # (design, name) -> _ViewIndex, made on the first query
+        self._views = {}
+        self._lock = threading.Condition(threading.RLock())
+        self._file = None
+        if path is not None:
+            self._replay()
+            self._file = open(path, 'a', encoding='utf-8')
+
+    def __repr__(self):
+        return "<%s %r>" % (type(self).__name__, self.name)
+
+    def __len__(self):
+        return len(self._docs)
+
+    def __contains__(self, id):
+        return id in self._docs
+
+    def __iter__(self):
+        return iter(sorted(self._docs))
+
+    def __getitem__(self, id):
+        document = self.get(id)
+        if document is None:
+            raise ResourceNotFound(('not_found', 'missing'))
+        return document
+
+    def __setitem__(self, id, content):
+        content['_id'] = id
+        self.save(content)
+
+    def __delitem__(self, id):
+        with self._lock:
+            if id not in self._docs:
+                raise ResourceNotFound(('not_found', 'missing'))
+            self._write(id, None)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def info(self):
+        return {'db_name': self.name, 'doc_count': len(self._docs), 'update_seq': self.update_seq}
+
+    def get(self, id, default=None, **options):
+        text = self._docs.get(id)
+        if text is None:
+            return default
+        return Document(json.loads(text))
+
+    def save(self, doc, **options):
+        """Store doc, setting its _id and _rev
+        :return (id, rev)
+        """
+        with self._lock:
+            (id, rev) = self._store(doc)
+        doc['_id'] = id
+        doc['_rev'] = rev
+        return (id, rev)
+
+    def update(self, documents, **options):
+        """Store many documents at once
+        :return a list of (success, id, rev or the error) in the order given
+        """
+        results = []
+        with self._lock:
+            for doc in documents:
+                try:
+                    (id, rev) = self._store(doc)
+                except ResourceConflict as error:
+                    results.append((False, doc.get('_id'), error))
+                    continue
+                if isinstance(doc, dict):
+                    doc.update({'_id': id, '_rev': rev})
+                results.append((True, id, rev))
+        return results
+
+    def delete(self, doc):
+        with self._lock:
+            if doc['_id'] not in self._docs:
+                raise ResourceNotFound(('not_found', 'missing'))
+            if self._changes[doc['_id']][1] != doc.get('_rev'):
+                raise ResourceConflict(('conflict', 'Document update conflict.'))
+            self._write(doc['_id'], None)
+
+    def changes(self, feed='normal', since=0, timeout=60000, **options):
+        """The changes feed as a dictionary of results and last_seq, waiting
+        up to timeout ms for a change if feed is 'longpoll'
+        """
+        if feed not in ('normal', 'longpoll'):
+            raise ValueError("Only the normal and longpoll changes feeds are supported, not %r" % (feed))
+        with self._lock:
+            since = self.update_seq if since == 'now' else int(since or 0)
+            if feed == 'longpoll' and self.update_seq <= since:
+                self._lock.wait(timeout / 1000.0)
+            results = []
+            for (id, (seq, rev, deleted)) in reversed(self._changes.items()):
+                if seq <= since:
+                    break
+                results.append(dict(seq=seq, id=id, changes=[{'rev': rev}], **({'deleted': True} if deleted else {})))
+            results.reverse()
+            return {'results': results, 'last_seq': self.update_seq}
+
+    def view(self, name, wrapper=None, **options):
+        """Query the view name ('design/view' or '_design/design/_view/view'),
+        with CouchDB's query options
+        :return ViewResults
+        """
+        if name == '_all_docs':
+            rows = [ Row(id=id, key=id, value={'rev': self._changes[id][1]}) for id in self ]
+            return ViewResults(rows, len(rows), 0)
+        parts = name.split('/')
+        if parts[0] == '_design':
+            parts = [parts[1], parts[3]]
+        with self._lock:
+            index = self._index(*parts)
+            index.update(self)
+            return self._query(index, wrapper, options)
+
+    def compact(self):
+        """Rewrite the file with the current revision of every document"""
+        if self.path is None:
+            return
+        with self._lock:
+            temporary = self.path + '.compact'
+            with open(temporary, 'w', encoding='utf-8') as output:
+                for id in sorted(self._docs):
+                    output.write(self._docs[id] + '\n')
+                output.flush()
+                os.fsync(output.fileno())
+            self._file.close()
+            os.replace(temporary, self.path)
+            self._file = open(self.path, 'a', encoding='utf-8')
+
+    def _store(self, doc):
+        """Check the revision of doc and write it, holding the lock
+        :return (id, new rev)
+        """
+        id = doc.get('_id') or uuid4().hex
+        rev = doc.get('_rev')
+        last = self._changes.get(id)
+        if id in self._docs:
+            if last[1] != rev:
+                raise ResourceConflict(('conflict', 'Document update conflict.'))
+        elif rev is not None and last is None:
+            raise ResourceConflict(('conflict', 'Document update conflict.'))
+        # A deleted document made again carries on from its last revision
+        generation = int(last[1].split('-')[0]) + 1 if last else 1
+        body = dict(doc)
+        body.pop('_rev', None)
+        body['_id'] = id
+        text = json.dumps(body, sort_keys=True)
+        body['_rev'] = '%s-%s' % (generation, hashlib.md5(text.encode('utf-8')).hexdigest())
+        self._write(id, json.dumps(body, sort_keys=True), body['_rev'])
+        return (id, body['_rev'])
+
+    def _write(self, id, text, rev=None):
+        """Make text the current revision rev of id, or delete id if text is
+        None, holding the lock
+        """
+        if text is None:
+            del self._docs[id]
+            rev = self._changes[id][1]
+            line = json.dumps({'_id': id, '_rev': rev, '_deleted': True})
+        else:
+            self._docs[id] = line = text
+        if id.startswith('_design/'):
+            self._drop_views(id)
+        self.update_seq += 1
+        # Moved to the end, so _changes stays in seq order
+        self._changes.pop(id, None)
+        self._changes[id] = (self.update_seq, rev, text is None)
+        if self._file is not None:
+            self._file.write(line + '\n')
+            self._file.flush()
+            if self.sync:
+                os.fsync(self._file.fileno())
+        self._lock.notify_all()
+
+    def _replay(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'rb') as log:
+            data = log.read()
+        lines = data.split(b'\n')
+        for (number, line) in enumerate(lines):
+            if not line:
+                continue
+            try:
+                line = line.decode('utf-8')
+                doc = json.loads(line)
+            except ValueError:
+                if number == len(lines) - 1:
+                    LOGGER.warning("Dropping the incomplete last line of %s", self.path)
+                    break
+                raise
+            self.update_seq += 1
+            if doc.get('_deleted'):
+                self._docs.pop(doc['_id'], None)
+            else:
+                self._docs[doc['_id']] = line
+            self._changes.pop(doc['_id'], None)
+            self._changes[doc['_id']] = (self.update_seq, doc['_rev'], bool(doc.get('_deleted')))
+        else:
+            if lines[-1]:
+                # Whole but for its newline, which the next write must not follow
+                with open(self.path, 'ab') as log:
+                    log.write(b'\n')
+            return
+        # Cut the torn line off, or the next write would be appended to it
+        with open(self.path, 'r+b') as log:
+            log.truncate(len(data) - len(lines[-1]))
+
+    def _drop_views(self, design_id):
+        design = design_id[len('_design/'):]
+        for key in [ key for key in self._views if key[0] == design ]:
+            del self._views[key]
+
+    def _changed_since(self, seq):
+        """Return (id, JSON text or None if deleted) of the documents changed after seq"""
+        changed = []
+        for (id, (change_seq, rev, deleted)) in reversed(self._changes.items()):
+            if change_seq <= seq:
+                break
+            changed.append((id, self._docs.get(id)))
+        changed.reverse()
+        return changed
+
+    def _index(self, design, name):
+        if (design, name) not in self._views:
+            text = self._docs.get('_design/' + design)
+            functions = json.loads(text).get('views', {}).get(name) if text else None
+            if functions is None:
+                raise ResourceNotFound(('not_found', 'missing_named_view'))
+            if json.loads(text).get('language', 'javascript') != 'python':
+                raise ValueError("The view %s/%s is not in Python, the only language an EmbeddedDatabase runs" % (design, name))
+            reduce_fun = functions.get('reduce')
+            if reduce_fun is not None and reduce_fun not in BUILTIN_REDUCE:
+                reduce_fun = _compile(reduce_fun)
+            self._views[(design, name)] = _ViewIndex(_compile(functions['map']), reduce_fun)
+        return self._views[(design, name)]
+
+    def _query(self, index, wrapper, options):
+        rows = index.rows
+        keys = index.keys
+        descending = options.get('descending', False)
+        startkey = options.get('startkey', options.get('start_key'))
+        endkey = options.get('endkey', options.get('end_key'))
+        if 'key' in options:
+            startkey = endkey = options['key']
+        if descending:
+            (startkey, endkey) = (endkey, startkey)
+        start = bisect_left(keys, collation_key(startkey)) if startkey is not None else 0
+        if endkey is None:
+            end = len(rows)
+        elif options.get('inclusive_end', True) or descending:
+            end = bisect_right(keys, collation_key(endkey))
+        else:
+            end = bisect_left(keys, collation_key(endkey))
+        selected = rows[start:end]
+        if descending:
+            selected = selected[::-1]
+        reduce_fun = index.reduce_fun
+        if reduce_fun is not None and options.get('reduce', True):
+            result = self._reduce(selected, reduce_fun, options)
+        else:
+            skip = options.get('skip', 0)
+            limit = options.get('limit')
+            selected = selected[skip:skip + limit if limit is not None else None]
+            result = []
+            for (order, id, position, key, value) in selected:
+                row = Row(id=id, key=key, value=value)
+                if options.get('include_docs'):
+                    row['doc'] = json.loads(self._docs[id])
+                result.append(row)
+        if wrapper is not None:
+            result = [ wrapper(row) for row in result ]
+        return ViewResults(result, len(rows), start)
+
+    def _reduce(self, rows, reduce_fun, options):
+        if options.get('group'):
+            group_level = None
+        else:
+            group_level = options.get('group_level', 0)
+        groups = []
+        for (order, id, position, key, value) in rows:
+            if group_level == 0:
+                group_key = None
+            elif group_level is not None and isinstance(key, list):
+                group_key = key[:group_level]
+            else:
+                group_key = key
+            if groups and groups[-1][0] == group_key:
+                groups[-1][1].append((key, id, value))
+            else:
+                groups.append((group_key, [(key, id, value)]))
+        result = []
+        for (group_key, grouped) in groups:
+            if isinstance(reduce_fun, str):
+                value = BUILTIN_REDUCE[reduce_fun]([ value for (key, id, value) in grouped ])
+            else:
+                value = reduce_fun([ [key, id] for (key, id, value) in grouped ],
+                                   [ value for (key, id, value) in grouped ], False)
+            result.append(Row(key=group_key, value=value))
+        return result
@@ -0,0 +1,439 @@
+"""Event log of container contents changes
+
+An EventLog records every change made to the contents of containers,
+additions, removals, heating and fermentation progress, as fixed width
+records in a memory mapped file, so the state of a container at any past
+moment can be worked out again: the latest snapshot of the container
+taken before that moment is loaded and the events after it are replayed
+on it. A container is snapshotted when it is first seen (or tracked),
+then every snapshot_every of its events, which bounds the replay.
+
+Content names, units and container ids are interned in a names file
+next to the log, the records hold their codes. Snapshots are the stored
+documents of the containers, one JSON line each.
+
+Changes are read from the container hooks, so only changes made through
+the container methods are logged: fermentation progress is logged for
+Fermenter.ferment_wort, not for fermentation.ferment_fleet called
+directly (the wort becoming beer is logged either way).
+
+Synopsis:
+-----------
+
+from fattybrewing import container
+from fattybrewing.container.events import EventLog
+
+log = EventLog('/var/lib/fattybrewing/contents.events', snapshot_every=100)
+log.attach()
+fermenter = container.Fermenter((60, 'l'))
+log.track(fermenter)
+fermenter.add_content('wort', (40, 'l'))
+then = datetime.now()
+fermenter.remove_content('wort', (10, 'l'))
+
+log.container_at(fermenter.id, then).total_filled()
+log.events(fermenter.id)
+log.close()
+
+"""
+
+from bisect import bisect_right
+from datetime import datetime
+import inspect
+import json
+import logging
+import math
+import os
+import threading
+from uuid import uuid4
+
+import numpy
+
+from fattybrewing.container import hooks, ContainerError, _content_columns
+from fattybrewing.container.persistence import wrap_container
+
+LOGGER = logging.getLogger("fattybrewing-container")
+
+MAGIC = b'FBEVENTS'
+VERSION = 1
+HEADER_DTYPE = numpy.dtype([('magic', 'S8'),
+                            ('version', numpy.uint32),
+                            ('record_size', numpy.uint32),
+                            ('count', numpy.uint64),
+                            ('reserved', 'V40'),
+                            ])
+FERMENTATION_FIELDS = ('sugar', 'ethanol', 'co2', 'biomass', 'hours')
+# One record per content lot changed. A call changing several lots
+# (add_many, remove_many) takes several records in a row, numbered by lot.
+# Names (content, content_type, unit, temp_unit) are codes in the names
+# table, -1 for none.
+EVENT_DTYPE = numpy.dtype([('time', 'datetime64[us]'),
+                           ('container', numpy.int32),
+                           ('kind', numpy.uint8),
+                           ('error', numpy.uint8),
+                           ('lot', numpy.uint16),
+                           ('lots', numpy.uint16),
+                           ('content', numpy.int32),
+                           ('content_type', numpy.int32),
+                           ('unit', numpy.int32),
+                           ('temp_unit', numpy.int32),
+                           ('amount', numpy.float64),
+                           ('degrees', numpy.float64),
+                           ('updated', 'datetime64[us]'),
+                           ('fermentation', numpy.float64, (len(FERMENTATION_FIELDS),)),
+                           ])
+
+# Record kind of each logged method
+KINDS = {'add_content': 1,
+         'add_many': 2,
+         'remove_content': 3,
+         'remove_many': 4,
+         'remove_all': 5,
+         'heat_contents': 6,
+         'ferment_wort': 7,
+         }
+KIND_NAMES = dict((kind, name) for (name, kind) in KINDS.items())
+LOGGED_OPERATIONS = ('add', 'remove', 'heat', 'ferment')
+# Operations whose own changes are logged, calls made from inside them are not
+_PRIMITIVE = ('add', 'remove', 'heat')
+
+
+class EventLog(object):
+    """Contents changes of containers, in a memory mapped file at path"""
+
+    def __init__(self, path, snapshot_every=100, clock=None, capacity=4096):
+        if snapshot_every < 1:
+            raise ValueError("snapshot_every must be at least 1")
+        self.path = path
+        self.snapshot_every = snapshot_every
+        self.clock = clock or datetime.now
+        self.attached = False
+        self._lock = threading.RLock()
+        self._replaying = threading.local()
+        self._load_names(path + '.names')
+        self._open_records(path, capacity)
+        self._load_snapshots(path + '.snapshots')
+
+    def _load_names(self, names_path):
+        self.names = []
+        self._codes = {}
+        if os.path.exists(names_path):
+            with open(names_path) as nfh:
+                for line in nfh:
+                    if line.endswith('\n'):
+                        name = json.loads(line)
+                        self._codes[name] = len(self.names)
+                        self.names.append(name)
+        self._names_file = open(names_path, 'a')
+
+    def _open_records(self, path, capacity):
+        if not os.path.exists(path):
+            with open(path, 'wb') as efh:
+                header = numpy.zeros(1, dtype=HEADER_DTYPE)
+                header['magic'] = MAGIC
+                header['version'] = VERSION
+                header['record_size'] = EVENT_DTYPE.itemsize
+                efh.write(header.tobytes())
+                efh.truncate(HEADER_DTYPE.itemsize + capacity * EVENT_DTYPE.itemsize)
+        self._header = numpy.memmap(path, dtype=HEADER_DTYPE, mode='r+', shape=(1,))
+        header = self._header[0]
+        if header['magic'] != MAGIC or header['record_size'] != EVENT_DTYPE.itemsize:
+            raise ContainerError("%s is not an event log of this version" % (path))
+        self._map_records()
+
+    def _map_records(self):
+        capacity = (os.path.getsize(self.path) - HEADER_DTYPE.itemsize) // EVENT_DTYPE.itemsize
+        self._records = numpy.memmap(self.path, dtype=EVENT_DTYPE, mode='r+',
+                                     offset=HEADER_DTYPE.itemsize, shape=(capacity,))
+
+    def _load_snapshots(self, snapshots_path):
+        # container id -> parallel lists of the times, sequence numbers and
+        # file offsets of its snapshots, in order
+        self._snapshots = {}
+        # container id -> calls logged since its last snapshot
+        self._since = {}
+        if os.path.exists(snapshots_path):
+            with open(snapshots_path, 'rb') as sfh:
+                offset = 0
+                for line in sfh:
+                    if line.endswith(b'\n'):
+                        self._index_snapshot(json.loads(line.decode('utf-8')), offset)
+                    offset += len(line)
+        records = self._records[:len(self)]
+        for (id, (times, seqs, offsets)) in self._snapshots.items():
+            since = records[seqs[-1]:]
+            self._since[id] = int(numpy.count_nonzero((since['container'] == self._codes[id]) & (since['lot'] == 0)))
+        self._snapshot_file = open(snapshots_path, 'ab')
+
+    def _index_snapshot(self, snapshot, offset):
+        (times, seqs, offsets) = self._snapshots.setdefault(snapshot['container'], ([], [], []))
+        times.append(numpy.datetime64(snapshot['time'], 'us'))
+        seqs.append(snapshot['seq'])
+        offsets.append(offset)
+
+    def __len__(self):
+        return int(self._header[0]['count'])
+
+    def code(self, name):
+        """Return the code of name in the names table, interning it if new"""
+        if name is None:
+            return -1
+        try:
+            return self._codes[name]
+        except KeyError:
+            self._codes[name] = len(self.names)
+            self.names.append(name)
+            self._names_file.write(json.dumps(name) + '\n')
+            self._names_file.flush()
+            return self._codes[name]
+
+    def attach(self):
+        """Start logging the changes made to any container"""
+        for operation in LOGGED_OPERATIONS:
+            hooks.subscribe(operation, self._record, arguments=True)
+        self.attached = True
+
+    def detach(self):
+        for operation in LOGGED_OPERATIONS:
+            hooks.unsubscribe(operation, self._record)
+        self.attached = False
+
+    def close(self):
+        if self.attached:
+            self.detach()
+        self.flush()
+        self._names_file.close()
+        self._snapshot_file.close()
+
+    def flush(self):
+        """Write the mapped records back to the file"""
+        self._records.flush()
+        self._header.flush()
+
+    def track(self, container):
+        """Snapshot container now, so its history starts before its next change
+        :return the id of the container, given one if it had none
+        """
+        with self._lock:
+            self._snapshot(container, self._id(container))
+        return container.id
+
+    def _id(self, container):
+        if container.id is None:
+            container._data['_id'] = uuid4().hex
+        return container.id
+
+    def _record(self, operation, target, elapsed, error, call):
+        if call.within in _PRIMITIVE or getattr(self._replaying, 'active', False):
+            return
+        # Failed calls that may have changed the contents (a partial fill) are
+        # logged to be replayed, other failures changed nothing
+        if error is not None and (operation == 'ferment' or not isinstance(error, ContainerError)):
+            return
+        rows = self._rows(target, call)
+        if rows is None:
+            return
+        with self._lock:
+            id = self._id(target)
+            rows['time'] = self._now()
+            rows['container'] = self.code(id)
+            rows['kind'] = KINDS[call.name]
+            rows['error'] = error is not None
+            rows['lot'] = numpy.arange(len(rows))
+            rows['lots'] = len(rows)
+            self._append(rows)
+            since = self._since.get(id, 0) + 1
+            if id not in self._snapshots or since >= self.snapshot_every:
+                self._snapshot(target, id)
+            else:
+                self._since[id] = since
+
+    def _now(self):
+        now = numpy.datetime64(self.clock(), 'us')
+        count = len(self)
+        # Keep the log in time order for searching, even if the clock steps back
+        if count and now < self._records[count - 1]['time']:
+            return self._records[count - 1]['time']
+        return now
+
+    def _rows(self, target, call):
+        """Return the records for a call, the fields besides the call's own
+        left to fill, or None if it changed nothing
+        """
+        args = call.args
+        kwargs = call.kwargs
+        if call.name == 'add_content':
+            bound = _bind(target.add_content, args, kwargs)
+            (names, amounts, units, degrees, temp_units) = _content_columns([ (bound['content'], bound['amount'], bound['temp']) ])
+            content_types = [ bound['content_type'] ]
+            updated = bound['updated_datetime']
+        elif call.name == 'add_many':
+            bound = _bind(target.add_many, args, kwargs)
+            (names, amounts, units, degrees, temp_units) = _content_columns(bound['content_list'])
+            content_types = [ None ] * len(names)
+            updated = bound['updated_datetime']
+        elif call.name == 'remove_content':
+            bound = _bind(target.remove_content, args, kwargs)
+            (names, amounts, units, degrees, temp_units) = _content_columns([ (bound['content'], bound['amount_tuple']) ])
+            content_types = [ None ]
+            updated = None
+        elif call.name == 'remove_many':
+            (names, amounts, units, degrees, temp_units) = _content_columns(_bind(target.remove_many, args, kwargs)['removals'])
+            content_types = [ None ] * len(names)
+            updated = None
+        else:
+            rows = numpy.zeros(1, dtype=EVENT_DTYPE)
+            for field in ('content', 'content_type', 'unit', 'temp_unit'):
+                rows[field] = -1
+            rows['amount'] = rows['degrees'] = numpy.nan
+            rows['updated'] = numpy.datetime64('NaT')
+            rows['fermentation'] = numpy.nan
+            if call.name == 'heat_contents':
+                temp_tuple = _bind(target.heat_contents, args, kwargs)['temp_tuple']
+                rows['degrees'] = float(temp_tuple[0])
+                rows['temp_unit'] = self.code(temp_tuple[1])
+            elif call.name == 'ferment_wort':
+                fermentation = target._data.get('fermentation') or {}
+                rows['fermentation'] = [ numpy.nan if fermentation.get(field) is None else fermentation[field]
+                                         for field in FERMENTATION_FIELDS ]
+            return rows
+        if not names:
+            return None
+        rows = numpy.zeros(len(names), dtype=EVENT_DTYPE)
+        rows['content'] = [ self.code(name) for name in names ]
+        rows['content_type'] = [ self.code(content_type) for content_type in content_types ]
+        rows['unit'] = [ self.code(unit) for unit in units ]
+        rows['temp_unit'] = [ self.code(unit) for unit in temp_units ]
+        rows['amount'] = [ float(amount) for amount in amounts ]
+        rows['degrees'] = [ float(degree) for degree in degrees ]
+        # Calls leaving the date to the container are dated when they were logged
+        rows['updated'] = numpy.datetime64(updated or self.clock(), 'us')
+        rows['fermentation'] = numpy.nan
+        return rows
+
+    def _append(self, rows):
+        count = len(self)
+        needed = count + len(rows)
+        if needed > len(self._records):
+            capacity = len(self._records)
+            while capacity < needed:
+                capacity *= 2
+            self._records.flush()
+            with open(self.path, 'r+b') as efh:
+                efh.truncate(HEADER_DTYPE.itemsize + capacity * EVENT_DTYPE.itemsize)
+            self._map_records()
+        self._records[count:needed] = rows
+        # The count is only moved on once the records are written
+        self._header[0]['count'] = needed
+
+    def _snapshot(self, container, id):
+        document = dict(container._document())
+        document.setdefault('container_type', container.container_type)
+        snapshot = {'container': id,
+                    'seq': len(self),
+                    'time': str(self._now()),
+                    'document': document}
+        self.code(id)
+        offset = self._snapshot_file.tell()
+        self._snapshot_file.write(json.dumps(snapshot, default=str).encode('utf-8') + b'\n')
+        self._snapshot_file.flush()
+        self._index_snapshot(snapshot, offset)
+        self._since[id] = 0
+
+    def _read_snapshot(self, offset):
+        with open(self.path + '.snapshots', 'rb') as sfh:
+            sfh.seek(offset)
+            return json.loads(sfh.readline().decode('utf-8'))
+
+    def events(self, id, start=None, end=None):
+        """Return the records logged for container id, optionally from start
+        up to end (datetimes). Codes of names are positions in self.names.
+        """
+        if id not in self._codes:
+            return numpy.zeros(0, dtype=EVENT_DTYPE)
+        records = self._records[:len(self)]
+        (first, last) = self._time_range(records, start, end)
+        records = records[first:last]
+        return numpy.array(records[records['container'] == self._codes[id]])
+
+    def _time_range(self, records, start, end):
+        times = records['time']
+        first = 0 if start is None else int(numpy.searchsorted(times, numpy.datetime64(start, 'us'), side='left'))
+        last = len(times) if end is None else int(numpy.searchsorted(times, numpy.datetime64(end, 'us'), side='right'))
+        return (first, last)
+
+    def container_at(self, id, when=None):
+        """Return container id as it was at when (a datetime, default now):
+        a new Container, loaded from its latest snapshot before when with the
+        events logged after the snapshot replayed on it.
+        :return the Container, or None if its history starts after when
+        """
+        if id not in self._snapshots:
+            return None
+        when = numpy.datetime64(when or self.clock(), 'us')
+        (times, seqs, offsets) = self._snapshots[id]
+        position = bisect_right(times, when) - 1
+        if position < 0:
+            return None
+        container = wrap_container(self._read_snapshot(offsets[position])['document'])
+        records = self._records[:len(self)]
+        last = self._time_range(records, None, when)[1]
+        records = records[seqs[position]:max(last, seqs[position])]
+        records = numpy.array(records[records['container'] == self._codes[id]])
+        self._replaying.active = True
+        try:
+            start = 0
+            while start < len(records):
+                lots = int(records[start]['lots'])
+                self._replay(container, records[start:start + lots])
+                start += lots
+        finally:
+            self._replaying.active = False
+        return container
+
+    def _replay(self, container, rows):
+        name = self.names.__getitem__
+        kind = KIND_NAMES[int(rows[0]['kind'])]
+        lots = [ (name(row['content']),
+                  (float(row['amount']), name(row['unit'])),
+                  (float(row['degrees']), name(row['temp_unit'])))
+                 for row in rows ] if rows[0]['content'] >= 0 else []
+        try:
+            if kind == 'add_content':
+                content_type = rows[0]['content_type']
+                container.add_content(lots[0][0], lots[0][1], lots[0][2],
+                                      name(content_type) if content_type >= 0 else None,
+                                      rows[0]['updated'].astype(datetime))
+            elif kind == 'add_many':
+                container.add_many(lots, rows[0]['updated'].astype(datetime))
+            elif kind == 'remove_content':
+                container.remove_content(lots[0][0], lots[0][1])
+            elif kind == 'remove_many':
+                container.remove_many([ lot[:2] for lot in lots ])
+            elif kind == 'remove_all':
+                container.remove_all()
+            elif kind == 'heat_contents':
+                container.heat_contents((float(rows[0]['degrees']), name(rows[0]['temp_unit'])))
+            elif kind == 'ferment_wort':
+                container._data['fermentation'] = dict( (field, None if math.isnan(value) else value)
+                                                        for (field, value) in zip(FERMENTATION_FIELDS, rows[0]['fermentation'].tolist()) )
+        except ContainerError:
+            if not rows[0]['error']:
+                raise
+
+
+def _bind(method, args, kwargs):
+    """Return the arguments of a call of method, defaults included, by name"""
+    bound = _signature(method).bind(*args, **kwargs)
+    bound.apply_defaults()
+    return bound.arguments
+
+
+# function -> its inspect.Signature
+_SIGNATURES = {}
+
+def _signature(method):
+    function = method.__func__
+    if function not in _SIGNATURES:
+        _SIGNATURES[function] = inspect.signature(method)
+    return _SIGNATURES[function]
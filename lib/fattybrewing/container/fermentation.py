@@ -0,0 +1,240 @@
+"""Fermentation kinetics for fermenters
+
+The state of a fermenting wort is four concentrations in g/l: fermentable
+sugar, ethanol, CO2 given off and yeast biomass. Yeast grows on sugar
+(Monod kinetics) and is held back by the ethanol it makes. The growth
+rate depends on temperature following the cardinal temperature model of
+Rosso et al. Sugar used goes to ethanol and CO2 in fixed yields.
+
+Every function works on arrays, one entry per fermenter, so a whole fleet
+advances with one call. Integration is either fixed step (classic
+Runge-Kutta) or adaptive (Heun-Euler pairs, each fermenter with its own
+step size).
+
+Synopsis:
+-----------
+
+from fattybrewing.container import fermentation
+
+fermentation.ferment_fleet(fermenters, timedelta(hours=6))
+
+"""
+
+import numpy
+
+from fattybrewing.container import ContentType, FermentationError, convert_amount
+from fattybrewing.container.temperature import convert_temp
+
+
+class KineticParameters(object):
+    """Constants of the fermentation model. Times are in hours,
+    concentrations in g/l and temperatures in C.
+    """
+
+    def __init__(self, **overrides):
+        self.mu_opt = 0.05           # yeast growth rate at the optimal temperature, 1/h
+        self.t_min = 2.0             # no growth at or below, C
+        self.t_opt = 32.0            # fastest growth, C
+        self.t_max = 40.0            # no growth at or above, C
+        self.sugar_half = 5.0        # Monod half saturation constant, g/l
+        self.ethanol_max = 100.0     # ethanol stopping all growth, g/l
+        self.yield_biomass = 0.04    # g yeast grown per g sugar
+        self.maintenance = 0.02      # g sugar per g yeast per hour, not spent on growth
+        self.yield_ethanol = 0.46    # g ethanol per g sugar
+        self.yield_co2 = 0.44        # g CO2 per g sugar
+        self.initial_sugar = 90.0    # fermentable sugar of fresh wort, g/l
+        self.default_pitch = 1.0     # yeast when the fermenter holds none, g/l
+        self.finished_sugar = 1.0    # wort is beer once sugar is below, g/l
+        for (name, value) in overrides.items():
+            if not hasattr(self, name):
+                raise AttributeError("Unknown kinetic parameter %s" % (name))
+            setattr(self, name, value)
+
+    def growth_factor(self, temperatures):
+        """Return the fraction of mu_opt reached at each temperature (C)"""
+        t = numpy.asarray(temperatures, dtype=numpy.float64)
+        (t_min, t_opt, t_max) = (self.t_min, self.t_opt, self.t_max)
+        numerator = (t - t_max) * (t - t_min) ** 2
+        denominator = (t_opt - t_min) * ((t_opt - t_min) * (t - t_opt) - (t_opt - t_max) * (t_opt + t_min - 2 * t))
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            factor = numerator / denominator
+        return numpy.where((t > t_min) & (t < t_max), factor, 0.0)
+
+
+DEFAULT_PARAMETERS = KineticParameters()
+
+
+class FermentationState(object):
+    """Concentrations (g/l) for a fleet of fermenting worts, one entry each"""
+
+    FIELDS = ('sugar', 'ethanol', 'co2', 'biomass')
+
+    def __init__(self, sugar, ethanol, co2, biomass):
+        self.values = numpy.array([sugar, ethanol, co2, biomass], dtype=numpy.float64).reshape(4, -1)
+
+    def __len__(self):
+        return self.values.shape[1]
+
+    def __getattr__(self, name):
+        if name in FermentationState.FIELDS:
+            return self.values[FermentationState.FIELDS.index(name)]
+        raise AttributeError(name)
+
+    def abv(self):
+        """Return the alcohol by volume, percent"""
+        # Ethanol weighs 789 g/l
+        return self.ethanol / 7.89
+
+
+def rates(values, growth, parameters=DEFAULT_PARAMETERS):
+    """Return the time derivatives of state values (4 x n) per hour.
+    growth is mu_opt times the temperature growth factor, per fermenter.
+    """
+    sugar = numpy.maximum(values[0], 0)
+    ethanol = values[1]
+    biomass = numpy.maximum(values[3], 0)
+    inhibition = numpy.clip(1 - ethanol / parameters.ethanol_max, 0, 1)
+    mu = growth * sugar / (parameters.sugar_half + sugar) * inhibition
+    uptake = (mu / parameters.yield_biomass + parameters.maintenance * sugar / (parameters.sugar_half + sugar)) * biomass
+    return numpy.array([-uptake,
+                        parameters.yield_ethanol * uptake,
+                        parameters.yield_co2 * uptake,
+                        mu * biomass])
+
+
+def advance(state, temperatures, hours, mode='fixed', step=1.0, rtol=1e-4, atol=1e-6, parameters=DEFAULT_PARAMETERS):
+    """Advance every fermenter in state by the given hours, in place.
+
+    :param temperatures - wort temperature of each fermenter, C
+    :param mode - 'fixed' for Runge-Kutta steps of step hours, 'adaptive' for
+    error controlled steps starting at step hours
+    :return state
+    """
+    temperatures = numpy.broadcast_to(numpy.asarray(temperatures, dtype=numpy.float64), (len(state),))
+    growth = parameters.mu_opt * parameters.growth_factor(temperatures)
+    if hours <= 0 or not len(state):
+        return state
+    if mode == 'fixed':
+        _advance_fixed(state, growth, hours, step, parameters)
+    elif mode == 'adaptive':
+        _advance_adaptive(state, growth, hours, step, rtol, atol, parameters)
+    else:
+        raise ValueError("Unknown integration mode %s" % (mode))
+    numpy.maximum(state.values, 0, out=state.values)
+    return state
+
+
+def _advance_fixed(state, growth, hours, step, parameters):
+    steps = max(int(numpy.ceil(hours / step)), 1)
+    dt = hours / steps
+    y = state.values
+    for i in range(steps):
+        k1 = rates(y, growth, parameters)
+        k2 = rates(y + dt / 2 * k1, growth, parameters)
+        k3 = rates(y + dt / 2 * k2, growth, parameters)
+        k4 = rates(y + dt * k3, growth, parameters)
+        y = y + dt / 6 * (k1 + 2 * k2 + 2 * k3 + k4)
+    state.values[:] = y
+
+
+def _advance_adaptive(state, growth, hours, step, rtol, atol, parameters):
+    y = state.values
+    n = y.shape[1]
+    elapsed = numpy.zeros(n)
+    dt = numpy.full(n, float(step))
+    active = numpy.ones(n, dtype=bool)
+    while active.any():
+        dt = numpy.minimum(dt, hours - elapsed)
+        k1 = rates(y, growth, parameters)
+        euler = y + dt * k1
+        k2 = rates(euler, growth, parameters)
+        heun = y + dt / 2 * (k1 + k2)
+        scale = atol + rtol * numpy.abs(heun)
+        error = numpy.max(numpy.abs(heun - euler) / scale, axis=0)
+        accept = active & (error <= 1)
+        y = numpy.where(accept, heun, y)
+        elapsed = numpy.where(accept, elapsed + dt, elapsed)
+        with numpy.errstate(divide='ignore'):
+            dt = dt * numpy.clip(0.9 / numpy.sqrt(error), 0.2, 5.0)
+        active = elapsed < hours * (1 - 1e-12)
+    state.values[:] = y
+
+
+def _wort(lots):
+    worts = [ lot for lot in lots if lot['content_type'] == ContentType.Wort ]
+    if not worts:
+        raise FermentationError("No wort found in the fermenter, unable to ferment!")
+    return worts[0]
+
+
+def fermenter_state(fermenters, parameters=DEFAULT_PARAMETERS):
+    """Return the FermentationState and wort temperatures (C) of fermenters.
+    Fermenters that have not started begin with fresh wort and the yeast
+    they hold.
+    """
+    initial = []
+    temperatures = []
+    for fermenter in fermenters:
+        lots = fermenter._lots()
+        wort = _wort(lots)
+        temperature = wort['temperature']
+        temperatures.append(float(convert_temp( (float(temperature['degrees']), temperature['unit']), 'C')))
+        progress = fermenter.fermentation
+        if progress.sugar is not None:
+            initial.append((progress.sugar, progress.ethanol, progress.co2, progress.biomass))
+            continue
+        litres = float(convert_amount( (float(wort['amount']), wort['unit']), 'l'))
+        yeast = sum( float(convert_amount( (float(lot['amount']), lot['unit']), 'kg')) * 1000
+                     for lot in lots if lot['content_type'] == ContentType.Yeast )
+        pitch = yeast / litres if yeast and litres else parameters.default_pitch
+        initial.append((parameters.initial_sugar, 0.0, 0.0, pitch))
+    columns = list(zip(*initial)) or [(), (), (), ()]
+    return (FermentationState(*columns), numpy.array(temperatures))
+
+
+def ferment_fleet(fermenters, timedelta, mode='fixed', step=1.0, parameters=DEFAULT_PARAMETERS):
+    """Ferment the wort of every fermenter for timedelta, integrating all of
+    them together. Wort that has used up its sugar becomes beer.
+    :return a dictionary of fermenter -> list of the removed wort contents
+    """
+    fermenters = list(fermenters)
+    (state, temperatures) = fermenter_state(fermenters, parameters)
+    advance(state, temperatures, timedelta.total_seconds() / 3600.0, mode, step, parameters=parameters)
+
+    replaced = {}
+    for (i, fermenter) in enumerate(fermenters):
+        previous_hours = fermenter.fermentation.hours or 0
+        fermenter.fermentation = dict( sugar = float(state.sugar[i]),
+                                       ethanol = float(state.ethanol[i]),
+                                       co2 = float(state.co2[i]),
+                                       biomass = float(state.biomass[i]),
+                                       hours = previous_hours + timedelta.total_seconds() / 3600.0 )
+        replaced[fermenter] = []
+        if state.sugar[i] < parameters.finished_sugar:
+            replaced[fermenter] = fermenter._wort_to_beer()
+    return replaced
+
+
+def ferment_hours(temperatures, pitches, interval=12.0, max_hours=24 * 60.0, step=1.0, parameters=DEFAULT_PARAMETERS):
+    """Return the hours until fresh wort becomes beer, for arrays of
+    temperatures (C) and yeast pitches (g/l), checking every interval
+    hours as a Brewery does. Worts not done within max_hours give inf.
+    """
+    (temperatures, pitches) = numpy.broadcast_arrays(numpy.asarray(temperatures, dtype=numpy.float64),
+                                                     numpy.asarray(pitches, dtype=numpy.float64))
+    shape = temperatures.shape
+    temperatures = temperatures.ravel()
+    n = len(temperatures)
+    state = FermentationState(numpy.full(n, parameters.initial_sugar), numpy.zeros(n), numpy.zeros(n), pitches.ravel())
+    hours = numpy.full(n, numpy.inf)
+    active = numpy.arange(n)
+    elapsed = 0.0
+    while len(active) and elapsed < max_hours:
+        elapsed += interval
+        subset = FermentationState(*state.values[:, active])
+        advance(subset, temperatures[active], interval, step=step, parameters=parameters)
+        state.values[:, active] = subset.values
+        done = subset.sugar < parameters.finished_sugar
+        hours[active[done]] = elapsed
+        active = active[~done]
+    return hours.reshape(shape)
@@ -0,0 +1,179 @@
+"""Instrumentation hooks for container operations
+
+Subscribers are told about every add, remove, heat, mash, ferment,
+package and transfer operation: which operation, on what, how long it
+took and any exception it raised. Subscribers asking for the arguments
+are also given a Call: the method called, its arguments and the
+operation already running on the same container, if any (mashing
+removes and adds contents from inside the mash). While an operation has
+no subscribers its methods are the plain, unwrapped functions, so
+unobserved simulations pay nothing for the hooks.
+
+Synopsis:
+-----------
+
+from fattybrewing.container import hooks
+
+stats = hooks.OperationStats()
+stats.attach()
+# ... run the simulation ...
+stats.detach()
+stats.counts['add'], stats.percentile('add', 99)
+
+"""
+
+from collections import namedtuple
+from time import perf_counter_ns
+import threading
+
+import numpy
+
+OPERATIONS = ('add', 'remove', 'heat', 'mash', 'ferment', 'package', 'transfer')
+
+# operation -> list of (owner, attribute name) running that operation
+_TARGETS = dict((operation, []) for operation in OPERATIONS)
+# (owner, attribute name) -> the original function
+_ORIGINALS = {}
+# operation -> list of (callback, whether it wants the arguments)
+_SUBSCRIBERS = dict((operation, []) for operation in OPERATIONS)
+# id(container) -> the operation running on it, in each thread
+_RUNNING = threading.local()
+
+# A call to an operation: the method name, the arguments after the target
+# and the operation on the same target it was called from, or None
+Call = namedtuple('Call', ['name', 'args', 'kwargs', 'within'])
+
+
+def register(operation, owner, name):
+    """Declare that owner.name (a class method or module function) runs operation
+    """
+    _TARGETS[operation].append((owner, name))
+    _ORIGINALS[(owner, name)] = owner.__dict__[name]
+    if _SUBSCRIBERS[operation]:
+        _wrap(operation, owner, name)
+
+
+def subscribe(operation, callback, arguments=False):
+    """Call callback(operation, target, elapsed_ns, error) after every
+    operation. target is the container (or first argument), error is the
+    exception raised or None. With arguments, call
+    callback(operation, target, elapsed_ns, error, call) instead, call
+    being the Call made.
+    """
+    if operation not in _SUBSCRIBERS:
+        raise ValueError("Unknown operation %s, must be one of %s" % (operation, OPERATIONS))
+    _SUBSCRIBERS[operation].append((callback, arguments))
+    if len(_SUBSCRIBERS[operation]) == 1:
+        for (owner, name) in _TARGETS[operation]:
+            _wrap(operation, owner, name)
+
+
+def unsubscribe(operation, callback):
+    """Stop calling callback, and unwrap the operation once nobody listens
+    :throw ValueError if callback is not subscribed to operation
+    """
+    subscribers = _SUBSCRIBERS[operation]
+    subscribed = [ subscriber for subscriber in subscribers if subscriber[0] == callback ]
+    if not subscribed:
+        raise ValueError("%r is not subscribed to %s" % (callback, operation))
+    subscribers.remove(subscribed[0])
+    if not _SUBSCRIBERS[operation]:
+        for (owner, name) in _TARGETS[operation]:
+            setattr(owner, name, _ORIGINALS[(owner, name)])
+
+
+def _wrap(operation, owner, name):
+    function = _ORIGINALS[(owner, name)]
+    subscribers = _SUBSCRIBERS[operation]
+    # Only methods run on their first argument, module functions such as
+    # move_all work on several containers
+    method = isinstance(owner, type)
+
+    def timed(*args, **kwargs):
+        target = args[0] if args else None
+        running = _running()
+        within = running.get(id(target))
+        if method:
+            running[id(target)] = operation
+        start = perf_counter_ns()
+        error = None
+        try:
+            return function(*args, **kwargs)
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            elapsed = perf_counter_ns() - start
+            if method:
+                if within is None:
+                    del running[id(target)]
+                else:
+                    running[id(target)] = within
+            for (callback, arguments) in subscribers:
+                if arguments:
+                    callback(operation, target, elapsed, error, Call(name, args[1:], kwargs, within))
+                else:
+                    callback(operation, target, elapsed, error)
+
+    timed.__name__ = function.__name__
+    timed.__doc__ = function.__doc__
+    timed.__wrapped__ = function
+    setattr(owner, name, timed)
+
+
+def _running():
+    if not hasattr(_RUNNING, 'targets'):
+        _RUNNING.targets = {}
+    return _RUNNING.targets
+
+
+class OperationStats(object):
+    """Counters and latency histograms per operation
+
+    Latencies go into power of two buckets of nanoseconds: bucket i holds
+    operations taking from 2**(i-1) up to 2**i ns.
+    """
+
+    BUCKETS = 48
+
+    def __init__(self, operations=OPERATIONS):
+        self.operations = tuple(operations)
+        self.counts = dict((operation, 0) for operation in self.operations)
+        self.errors = dict((operation, 0) for operation in self.operations)
+        self.total_ns = dict((operation, 0) for operation in self.operations)
+        self.histograms = dict((operation, numpy.zeros(self.BUCKETS, dtype=numpy.int64)) for operation in self.operations)
+
+    def __call__(self, operation, target, elapsed, error):
+        self.counts[operation] += 1
+        self.total_ns[operation] += elapsed
+        if error is not None:
+            self.errors[operation] += 1
+        self.histograms[operation][min(elapsed.bit_length(), self.BUCKETS - 1)] += 1
+
+    def attach(self):
+        for operation in self.operations:
+            subscribe(operation, self)
+
+    def detach(self):
+        for operation in self.operations:
+            unsubscribe(operation, self)
+
+    def percentile(self, operation, q):
+        """Return an upper bound in ns on the q-th percentile latency of operation,
+        or None if it never ran
+        """
+        histogram = self.histograms[operation]
+        count = histogram.sum()
+        if not count:
+            return None
+        bucket = int(numpy.searchsorted(numpy.cumsum(histogram), count * q / 100.0))
+        return 2 ** bucket
+
+    def summary(self):
+        """Return a dictionary of operation -> (count, errors, mean ns, p50 ns, p99 ns)"""
+        return dict( (operation, (self.counts[operation],
+                                  self.errors[operation],
+                                  self.total_ns[operation] / self.counts[operation],
+                                  self.percentile(operation, 50),
+                                  self.percentile(operation, 99)))
+                     for operation in self.operations if self.counts[operation] )
@@ -0,0 +1,258 @@
+"""Feeding sensor readings from the plant into the simulated vessels
+
+Readings come in as packed little endian records of READING_DTYPE (time
+in seconds, sensor number, value), many to a datagram on a local UDP or
+Unix socket, or back to back in a replay file recorded from the plant.
+An Ingest parses a whole buffer of them at once with numpy, keeps the
+temperature and level readings in SensorStores, and on every tick brings
+each vessel up to date in one go: one heat_contents call with the mean
+of the latest readings of its temperature sensors, however many samples
+came in. Levels (the volume measured in the vessel, in the unit of its
+size) are kept per vessel, the contents are left to the simulation.
+
+Readings for unknown sensors, of no value, in broken datagrams or beyond
+the pending buffer are dropped; readings for a tick already applied, or
+older than their sensor's latest, are late. Both are counted.
+
+Synopsis:
+-----------
+
+from fattybrewing.container import ingest
+
+feed = ingest.Ingest()
+top = feed.sensor(mash_tun, 'top')
+level = feed.sensor(mash_tun, 'level', ingest.LEVEL)
+
+source = ingest.DatagramSource(('127.0.0.1', 9750))
+feed.feed_datagrams(source.receive())
+feed.advance(now)
+feed.counts['dropped'], feed.counts['late'], feed.level(mash_tun)
+
+# Recorded plant data at 600 times real time, a tick a sample second
+ingest.replay(feed, 'plant.readings', speed=600.0, tick=1.0)
+
+"""
+
+import logging
+import os
+import socket
+import time
+
+import numpy
+
+from fattybrewing.container.sensors import SensorStore
+
+LOGGER = logging.getLogger("fattybrewing-container")
+
+READING_DTYPE = numpy.dtype([('time', '<f8'),
+                             ('sensor', '<u4'),
+                             ('value', '<f4'),
+                             ])
+TEMPERATURE = 0
+LEVEL = 1
+# Largest UDP payload, and so the most a datagram can hold
+MAX_DATAGRAM = 65507
+
+
+def encode(times, sensors, values):
+    """Return the bytes of readings given as parallel sequences"""
+    readings = numpy.zeros(len(times), dtype=READING_DTYPE)
+    readings['time'] = times
+    readings['sensor'] = sensors
+    readings['value'] = values
+    return readings.tobytes()
+
+
+def write_replay(path, times, sensors, values):
+    """Write a replay file of readings, sorted by time"""
+    order = numpy.argsort(numpy.asarray(times, dtype=numpy.float64), kind='stable')
+    with open(path, 'wb') as rfh:
+        rfh.write(encode(numpy.asarray(times)[order], numpy.asarray(sensors)[order], numpy.asarray(values)[order]))
+
+
+class Ingest(object):
+    """Readings waiting to be applied to vessels, and the counters
+
+    Sensor numbers are given by sensor(), the readings sent must use them.
+    At most capacity readings wait for their tick, more are dropped.
+    """
+
+    def __init__(self, capacity=1 << 20, temperatures=None, levels=None):
+        self.temperatures = temperatures or SensorStore()
+        self.levels = levels or SensorStore()
+        self.vessels = []
+        self.applied_until = -numpy.inf
+        self.counts = dict(received=0, applied=0, dropped=0, late=0, updates=0)
+        self._stores = (self.temperatures, self.levels)
+        self._vessel_numbers = {}
+        # sensor number -> kind, number in the store of its kind, vessel number
+        self._kind = numpy.zeros(0, dtype=numpy.int8)
+        self._store_number = numpy.zeros(0, dtype=numpy.int64)
+        self._vessel = numpy.zeros(0, dtype=numpy.int64)
+        self._level = numpy.zeros(0)
+        self._pending = numpy.zeros(capacity, dtype=READING_DTYPE)
+        self._waiting = 0
+
+    def sensor(self, vessel, location, kind=TEMPERATURE):
+        """Return the number of the sensor at location on vessel (a Container)"""
+        if id(vessel) not in self._vessel_numbers:
+            self._vessel_numbers[id(vessel)] = len(self.vessels)
+            self.vessels.append(vessel)
+            self._level = numpy.r_[self._level, numpy.nan]
+        key = vessel.id or id(vessel)
+        self._kind = numpy.r_[self._kind, kind]
+        self._store_number = numpy.r_[self._store_number, self._stores[kind].sensor(key, location)]
+        self._vessel = numpy.r_[self._vessel, self._vessel_numbers[id(vessel)]]
+        return len(self._kind) - 1
+
+    def level(self, vessel):
+        """Return the latest level measured in vessel, nan if none"""
+        return float(self._level[self._vessel_numbers[id(vessel)]])
+
+    @property
+    def pending(self):
+        return self._waiting
+
+    def feed(self, data):
+        """Take readings, as bytes or an array of READING_DTYPE
+        :return the number kept to be applied
+        """
+        if isinstance(data, numpy.ndarray):
+            readings = data
+        else:
+            whole = len(data) - len(data) % READING_DTYPE.itemsize
+            if whole != len(data):
+                self.counts['dropped'] += 1
+                LOGGER.warning("Dropped %s bytes of a broken reading", len(data) - whole)
+            readings = numpy.frombuffer(data, dtype=READING_DTYPE, count=whole // READING_DTYPE.itemsize)
+        self.counts['received'] += len(readings)
+        good = (readings['sensor'] < len(self._kind)) & ~numpy.isnan(readings['value']) & ~numpy.isnan(readings['time'])
+        on_time = readings['time'] >= self.applied_until
+        self.counts['dropped'] += int(len(readings) - numpy.count_nonzero(good))
+        self.counts['late'] += int(numpy.count_nonzero(good & ~on_time))
+        readings = readings[good & on_time]
+        room = len(self._pending) - self._waiting
+        if len(readings) > room:
+            self.counts['dropped'] += len(readings) - room
+            readings = readings[:room]
+        self._pending[self._waiting:self._waiting + len(readings)] = readings
+        self._waiting += len(readings)
+        return len(readings)
+
+    def feed_datagrams(self, datagrams):
+        """Take the readings of many datagrams, dropping the broken ones whole"""
+        kept = []
+        for datagram in datagrams:
+            if len(datagram) % READING_DTYPE.itemsize:
+                self.counts['dropped'] += 1
+            else:
+                kept.append(datagram)
+        return self.feed(b''.join(kept))
+
+    def advance(self, until):
+        """Apply the readings from before until (a tick) to the vessels:
+        record them, and heat every vessel with new temperatures once
+        :return the vessels updated
+        """
+        pending = self._pending[:self._waiting]
+        due = pending['time'] < until
+        readings = pending[due]
+        left = pending[~due]
+        self._pending[:len(left)] = left
+        self._waiting = len(left)
+        self.applied_until = max(self.applied_until, until)
+        if not len(readings):
+            return []
+        sensors = readings['sensor'].astype(numpy.int64)
+        kinds = self._kind[sensors]
+        late = sum(store.late for store in self._stores)
+        updated = []
+        for (kind, store) in enumerate(self._stores):
+            mine = kinds == kind
+            if not mine.any():
+                continue
+            self.counts['applied'] += store.record_many(self._store_number[sensors[mine]],
+                                                        readings['time'][mine], readings['value'][mine])
+            (vessels, values) = self._coalesce(sensors[mine], readings['time'][mine], readings['value'][mine])
+            if kind == LEVEL:
+                self._level[vessels] = values
+                continue
+            for (vessel, degrees) in zip(vessels.tolist(), values.tolist()):
+                self.vessels[vessel].heat_contents((degrees, 'C'))
+                updated.append(self.vessels[vessel])
+        self.counts['updates'] += len(updated)
+        self.counts['late'] += sum(store.late for store in self._stores) - late
+        return updated
+
+    def _coalesce(self, sensors, times, values):
+        """Return the vessels read and, for each, the mean of the latest
+        readings of its sensors
+        """
+        order = numpy.lexsort((times, sensors))
+        sensors = sensors[order]
+        latest = numpy.r_[sensors[1:] != sensors[:-1], True]
+        vessels = self._vessel[sensors[latest]]
+        counts = numpy.bincount(vessels)
+        totals = numpy.bincount(vessels, weights=values[order][latest])
+        read = numpy.flatnonzero(counts)
+        return (read, totals[read] / counts[read])
+
+
+class DatagramSource(object):
+    """A bound local datagram socket readings are sent to: a Unix socket
+    if address is a path, UDP if it is (host, port)
+    """
+
+    def __init__(self, address):
+        if isinstance(address, str):
+            self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            if os.path.exists(address):
+                os.unlink(address)
+        else:
+            self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind(address)
+        self.socket.setblocking(False)
+        self.address = self.socket.getsockname()
+
+    def receive(self, max_datagrams=4096):
+        """Return the datagrams waiting, at most max_datagrams, without blocking"""
+        datagrams = []
+        while len(datagrams) < max_datagrams:
+            try:
+                datagrams.append(self.socket.recv(MAX_DATAGRAM))
+            except BlockingIOError:
+                break
+        return datagrams
+
+    def close(self):
+        self.socket.close()
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            os.unlink(self.address)
+
+
+def replay(ingest, path, speed=None, tick=1.0, start=None, clock=time.monotonic, sleep=time.sleep):
+    """Feed the readings of a replay file through ingest, a tick (seconds
+    of sample time) at a time. speed is how many times real time to go,
+    None to go as fast as possible.
+    :return the number of ticks
+    """
+    readings = numpy.memmap(path, dtype=READING_DTYPE, mode='r') if os.path.getsize(path) else numpy.zeros(0, dtype=READING_DTYPE)
+    if not len(readings):
+        return 0
+    times = readings['time']
+    now = origin = times[0] if start is None else start
+    began = clock()
+    first = 0
+    ticks = 0
+    while first < len(readings):
+        now += tick
+        if speed:
+            wait = began + (now - origin) / speed - clock()
+            if wait > 0:
+                sleep(wait)
+        last = int(numpy.searchsorted(times, now, side='left'))
+        ingest.feed(numpy.array(readings[first:last]))
+        ingest.advance(now)
+        first = last
+        ticks += 1
+    return ticks
@@ -0,0 +1,254 @@
+"""Columnar content ledger for containers holding many lots
+
+A ContentLedger keeps the contents of one container in parallel numpy
+arrays instead of a list of couchdb mappings, about 32 bytes per lot.
+The couchdb shape of the contents (a list of dictionaries, as stored in
+Container.contents) is only produced or read at the persistence boundary,
+by to_contents() and from_contents().
+
+Synopsis:
+-----------
+
+from fattybrewing import container
+
+tank = container.Storage((50000, 'l'))
+tank.use_ledger()
+tank.add_content('water', (10, 'l'))
+tank.ledger.totals_by_content_type('l')
+
+"""
+
+from datetime import datetime
+
+import numpy
+
+from fattybrewing.container import UNITS, TEMP_UNITS, VOLUME_UNITS, WEIGHT_UNITS, ContainerError
+
+# Volume units that fill nothing in a container sized by weight
+_VOLUME_ONLY = numpy.array([ unit in VOLUME_UNITS for unit in UNITS.units ])
+_TEMP_CODES = dict((unit, code) for (code, unit) in enumerate(TEMP_UNITS))
+
+
+class ContentLedger(object):
+    """Parallel typed arrays holding the content lots of one container
+
+    Content names and content types are interned into per-ledger tables,
+    the arrays hold their codes. Units are coded as in UNITS, temperature
+    units by their position in TEMP_UNITS.
+    """
+
+    COLUMNS = (('amount', numpy.float64),
+               ('unit', numpy.int8),
+               ('content', numpy.int32),
+               ('content_type', numpy.int16),
+               ('degrees', numpy.float64),
+               ('temp_unit', numpy.int8),
+               ('updated', 'datetime64[us]'),
+               )
+
+    def __init__(self, capacity=16):
+        self.size = 0
+        self.names = []
+        self.name_codes = {}
+        self.lower_codes = {}
+        self.content_types = [None]
+        self.content_type_codes = {None: 0}
+        self.empty = 0
+        for (column, dtype) in self.COLUMNS:
+            setattr(self, column, numpy.zeros(capacity, dtype=dtype))
+
+    def __len__(self):
+        return self.size
+
+    def _reserve(self, count):
+        """Make room for count more lots"""
+        needed = self.size + count
+        capacity = len(self.amount)
+        if needed <= capacity:
+            return
+        while capacity < needed:
+            capacity *= 2
+        for (column, dtype) in self.COLUMNS:
+            grown = numpy.zeros(capacity, dtype=dtype)
+            grown[:self.size] = getattr(self, column)[:self.size]
+            setattr(self, column, grown)
+
+    def name_code(self, content):
+        """Return the code of a content name, interning it if new"""
+        try:
+            return self.name_codes[content]
+        except KeyError:
+            code = len(self.names)
+            self.names.append(content)
+            self.name_codes[content] = code
+            self.lower_codes.setdefault(content.lower(), []).append(code)
+            return code
+
+    def content_type_code(self, content_type):
+        """Return the code of a content type, interning it if new"""
+        try:
+            return self.content_type_codes[content_type]
+        except KeyError:
+            code = len(self.content_types)
+            self.content_types.append(content_type)
+            self.content_type_codes[content_type] = code
+            return code
+
+    def append(self, content, amount, unit, degrees, temp_unit, content_type=None, updated_datetime=None):
+        """Add one lot"""
+        self._reserve(1)
+        i = self.size
+        self.amount[i] = amount
+        self.unit[i] = UNITS.code(unit)
+        self.content[i] = self.name_code(content)
+        self.content_type[i] = self.content_type_code(content_type)
+        self.degrees[i] = degrees
+        self.temp_unit[i] = _TEMP_CODES[temp_unit.upper()]
+        self.updated[i] = updated_datetime or datetime.now()
+        self.size += 1
+
+    def extend(self, contents, amounts, units, degrees, temp_units, content_types, updated_datetime=None):
+        """Add many lots at once. Every argument but updated_datetime is a
+        sequence with one entry per lot.
+        """
+        count = len(amounts)
+        self._reserve(count)
+        (start, stop) = (self.size, self.size + count)
+        (names, inverse) = numpy.unique(numpy.asarray(contents, dtype=object).astype(str), return_inverse=True)
+        self.content[start:stop] = numpy.array([ self.name_code(name) for name in names.tolist() ], dtype=numpy.int32)[inverse]
+        self.content_type[start:stop] = [ self.content_type_code(content_type) for content_type in content_types ]
+        (names, inverse) = numpy.unique(numpy.asarray(units, dtype=str), return_inverse=True)
+        self.unit[start:stop] = numpy.array([ UNITS.code(unit) for unit in names.tolist() ], dtype=numpy.int8)[inverse]
+        (names, inverse) = numpy.unique(numpy.char.upper(numpy.asarray(temp_units, dtype=str)), return_inverse=True)
+        self.temp_unit[start:stop] = numpy.array([ _TEMP_CODES[unit] for unit in names.tolist() ], dtype=numpy.int8)[inverse]
+        self.amount[start:stop] = amounts
+        self.degrees[start:stop] = degrees
+        self.updated[start:stop] = updated_datetime or datetime.now()
+        self.size = stop
+
+    def holds(self, content):
+        """Return whether any lot of content (any case) is left"""
+        codes = self.lower_codes.get(content.lower(), ())
+        n = self.size
+        return bool((numpy.isin(self.content[:n], codes) & (self.amount[:n] > 0)).any())
+
+    def live(self):
+        """Return the positions of the lots that still hold something"""
+        return numpy.flatnonzero(self.amount[:self.size] > 0)
+
+    def remove(self, content, amount, unit):
+        """Remove amount (of unit) of content, from its lots in the order they
+        were added
+        :return a list of tuples of the removed contents (content, amount, temperature)
+        """
+        codes = self.lower_codes.get(content.lower(), ())
+        n = self.size
+        positions = numpy.flatnonzero(numpy.isin(self.content[:n], codes) & (self.amount[:n] > 0))
+        if not positions.size:
+            raise ContainerError("Unable to remove the specify contents %s. The container is not currently filled with any" % (content))
+        target = UNITS.code(unit)
+        lot_units = self.unit[positions]
+        lot_amounts = self.amount[positions]
+        # Everything below is measured in the unit asked for
+        available = lot_amounts * UNITS.matrix[lot_units, target]
+        before = numpy.cumsum(available) - available
+        taking = numpy.clip(float(amount) - before, 0, available)
+        touched = taking > 0
+        positions = positions[touched]
+        emptied = taking[touched] >= available[touched]
+        taken = numpy.where(emptied, lot_amounts[touched], taking[touched] * UNITS.matrix[target, lot_units[touched]])
+        self.amount[positions] = numpy.where(emptied, 0, lot_amounts[touched] - taken)
+        self.empty += int(emptied.sum())
+
+        removed = [ (self.names[self.content[i]],
+                     {"amount": float(taken_amount),
+                      "unit": UNITS.units[self.unit[i]]},
+                     {"degrees": float(self.degrees[i]),
+                      "unit": TEMP_UNITS[self.temp_unit[i]]})
+                    for (i, taken_amount) in zip(positions.tolist(), taken.tolist()) ]
+        if self.empty * 2 > self.size:
+            self.compact()
+        return removed
+
+    def remove_all(self):
+        """Empty the ledger
+        :return a list of tuples of the removed contents (content, amount, temperature)
+        """
+        removed = [ (self.names[self.content[i]],
+                     {"amount": float(self.amount[i]),
+                      "unit": UNITS.units[self.unit[i]]},
+                     {"degrees": float(self.degrees[i]),
+                      "unit": TEMP_UNITS[self.temp_unit[i]]})
+                    for i in self.live().tolist() ]
+        self.size = 0
+        self.empty = 0
+        return removed
+
+    def heat(self, degrees, temp_unit):
+        """Set every lot to the given temperature"""
+        self.degrees[:self.size] = degrees
+        self.temp_unit[:self.size] = _TEMP_CODES[temp_unit.upper()]
+
+    def compact(self):
+        """Drop the emptied lots"""
+        keep = self.live()
+        for (column, dtype) in self.COLUMNS:
+            values = getattr(self, column)
+            values[:len(keep)] = values[keep]
+        self.size = len(keep)
+        self.empty = 0
+
+    def converted(self, target_unit):
+        """Return the amount of every lot in target_unit, as an array"""
+        n = self.size
+        return self.amount[:n] * UNITS.matrix[self.unit[:n], UNITS.code(target_unit)]
+
+    def total_filled(self, target_unit):
+        """Return how much the lots fill of a container sized in target_unit.
+        Volume lots fill nothing in a container sized by weight, as in
+        Container.total_filled
+        """
+        converted = self.converted(target_unit)
+        if target_unit in WEIGHT_UNITS:
+            converted = numpy.where(_VOLUME_ONLY[self.unit[:self.size]], 0, converted)
+        return float(converted.sum())
+
+    def totals_by_content_type(self, target_unit):
+        """Return a dictionary of content type to total amount in target_unit
+        """
+        totals = numpy.bincount(self.content_type[:self.size],
+                                weights=self.converted(target_unit),
+                                minlength=len(self.content_types))
+        return dict( (content_type, float(total)) for (content_type, total) in zip(self.content_types, totals) if total )
+
+    def to_contents(self):
+        """Return the lots in the shape stored in Container.contents
+        """
+        positions = self.live()
+        stamps = numpy.datetime_as_string(self.updated[positions], unit='us')
+        return [ {'amount': repr(float(self.amount[i])),
+                  'unit': UNITS.units[self.unit[i]],
+                  'content': self.names[self.content[i]],
+                  'updated_datetime': stamp + 'Z',
+                  'temperature': {'degrees': repr(float(self.degrees[i])),
+                                  'unit': TEMP_UNITS[self.temp_unit[i]]},
+                  'content_type': self.content_types[self.content_type[i]]}
+                 for (i, stamp) in zip(positions.tolist(), stamps.tolist()) ]
+
+    @classmethod
+    def from_contents(cls, lots):
+        """Build a ledger from lots in the shape stored in Container.contents
+        """
+        ledger = cls(max(len(lots), 16))
+        n = len(lots)
+        for (i, lot) in enumerate(lots):
+            ledger.content[i] = ledger.name_code(lot['content'])
+            ledger.content_type[i] = ledger.content_type_code(lot.get('content_type'))
+            ledger.unit[i] = UNITS.code(lot['unit'])
+            temperature = lot.get('temperature') or {'degrees': 23, 'unit': 'C'}
+            ledger.temp_unit[i] = _TEMP_CODES[temperature['unit'].upper()]
+        ledger.amount[:n] = [ float(lot['amount']) for lot in lots ]
+        ledger.degrees[:n] = [ float((lot.get('temperature') or {}).get('degrees', 23)) for lot in lots ]
+        ledger.updated[:n] = [ lot['updated_datetime'].rstrip('Z') for lot in lots ]
+        ledger.size = n
+        return ledger
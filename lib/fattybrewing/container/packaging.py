@@ -0,0 +1,71 @@
+"""Packaging plans for putting beer into kegs and bottles
+
+plan_packaging works out, in one pass over an array of package
+capacities, how much beer goes into each package. Packages are filled
+in the order given, each to capacity, the last one used possibly only
+in part. Container.into_kegs carries the plan out.
+
+Synopsis:
+-----------
+
+from fattybrewing.container import packaging
+
+plan = packaging.plan_packaging(2000, [0.33] * 6000)
+plan.filled_count, plan.remainder, plan.shortfall
+
+"""
+
+import math
+
+import numpy
+
+# Remainders smaller than this fraction of the volume are float rounding
+# of an exact fit, not beer left over
+TOLERANCE = 1e-9
+
+
+class PackagingPlan(object):
+    """How a volume of beer is shared out over packages
+
+    fills - amount going into each package, in the order given
+    filled - positions of the packages getting any, packages with no room are skipped
+    packaged - total amount going into packages
+    remainder - amount left over once every package is full
+    shortfall - number of extra packages, the size of the last one, needed for the remainder
+    headspace - capacity left in the packages used
+    """
+
+    def __init__(self, fills, capacities, volume):
+        self.fills = fills
+        self.packaged = float(fills.sum())
+        self.remainder = max(float(volume) - self.packaged, 0.0)
+        if self.remainder <= TOLERANCE * float(volume):
+            self.remainder = 0.0
+        self.filled = numpy.flatnonzero(fills)
+        self.filled_count = len(self.filled)
+        self.headspace = float(capacities[self.filled].sum()) - self.packaged
+        if self.remainder and len(capacities) and capacities[-1] > 0:
+            self.shortfall = int(math.ceil(self.remainder / float(capacities[-1]) - 1e-9))
+        else:
+            self.shortfall = 0 if not self.remainder else None
+
+    def __repr__(self):
+        return "<PackagingPlan %s packages, %s packaged, %s remaining, %s short>" % (
+            self.filled_count, self.packaged, self.remainder, self.shortfall)
+
+
+def plan_packaging(volume, capacities):
+    """Plan putting volume of beer into packages of the given capacities,
+    all in one unit.
+    :return a PackagingPlan
+    """
+    capacities = numpy.maximum(numpy.asarray(capacities, dtype=numpy.float64), 0)
+    before = numpy.cumsum(capacities) - capacities
+    fills = numpy.clip(float(volume) - before, 0, capacities)
+    # Rounding in the running total must not leave a package a hair short
+    # of full, or start one with a hair of beer
+    tolerance = TOLERANCE * float(volume)
+    full = (fills > 0) & (capacities - fills <= tolerance)
+    fills[full] = capacities[full]
+    fills[fills <= tolerance] = 0
+    return PackagingPlan(fills, capacities, volume)
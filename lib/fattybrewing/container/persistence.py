@@ -0,0 +1,150 @@
+"""Storing many containers in CouchDB at once
+
+A ContainerStore buffers the containers that have changed and writes
+them with _bulk_docs, batch_size documents to a request, instead of one
+request per Container.store. Containers without an id get one before
+they are sent, so a failed flush can be retried without making
+duplicates. Documents CouchDB refuses, usually because the container was
+changed by someone else since it was loaded (a revision conflict), come
+back from flush as Conflicts; the others are stored.
+
+Synopsis:
+-----------
+
+from fattybrewing.container import persistence
+
+store = persistence.ContainerStore(couchdb.Server(url)['fattybrewing'], batch_size=500)
+for fermenter in fermenters:
+    store.add(fermenter)
+for conflict in store.flush():
+    LOGGER.warning("Not stored: %s", conflict)
+
+fermenter = persistence.load_container(store.database, fermenters[0].id)
+
+# A CouchDB database, or one kept in this process (see embedded)
+database = persistence.open_database('http://localhost:5984/', 'fattybrewing')
+database = persistence.open_database('/var/lib/fattybrewing', 'fattybrewing')
+database = persistence.open_database(':memory:', 'fattybrewing')
+
+"""
+
+import logging
+import os
+from uuid import uuid4
+
+import couchdb
+from couchdb.http import ResourceConflict
+
+from fattybrewing.container import Container, MashTun, Fermenter, Storage, Keg, Bottle
+from fattybrewing.container.embedded import EmbeddedDatabase
+
+LOGGER = logging.getLogger(__name__)
+
+# container_type -> the class of the stored container
+CONTAINER_CLASSES = {'mash_tun': MashTun,
+                     'fermenter': Fermenter,
+                     'container': Storage,
+                     'keg': Keg,
+                     'bottle': Bottle,
+                     }
+
+
+def open_database(location, name):
+    """Open the database name, creating it if there is none
+    :param location: the URL of a CouchDB server, ':memory:' for an
+    EmbeddedDatabase in memory only, or a directory to keep an
+    EmbeddedDatabase in, as the file name + '.jsonl'
+    """
+    if location.startswith(('http://', 'https://')):
+        server = couchdb.Server(location)
+        return server[name] if name in server else server.create(name)
+    if location == ':memory:':
+        return EmbeddedDatabase(name)
+    return EmbeddedDatabase(name, path=os.path.join(location, name + '.jsonl'))
+
+
+def wrap_container(data):
+    """Return the Container of the right class for a stored document"""
+    return CONTAINER_CLASSES.get(data.get('container_type'), Container).wrap(data)
+
+
+def load_container(database, id):
+    """Load a container of any type from database
+    :return the Container, or None if there is no document id
+    """
+    data = database.get(id)
+    if data is None:
+        return None
+    return wrap_container(data)
+
+
+class Conflict(object):
+    """A container CouchDB did not store: its id and the error given"""
+
+    def __init__(self, container, id, error):
+        self.container = container
+        self.id = id
+        self.error = error
+
+    @property
+    def revision_conflict(self):
+        return isinstance(self.error, ResourceConflict)
+
+    def __repr__(self):
+        return "<Conflict %s: %s>" % (self.id, self.error)
+
+
+class ContainerStore(object):
+    """Containers waiting to be stored in database, written in batches"""
+
+    def __init__(self, database, batch_size=500):
+        if batch_size < 1:
+            raise ValueError("batch_size must be at least 1")
+        self.database = database
+        self.batch_size = batch_size
+        self.requests = 0
+        # id(container) -> container, in the order first added
+        self._dirty = {}
+
+    def __len__(self):
+        return len(self._dirty)
+
+    def add(self, container):
+        """Mark container as changed, to be stored by the next flush"""
+        self._dirty[id(container)] = container
+
+    def add_many(self, containers):
+        for container in containers:
+            self.add(container)
+
+    def flush(self):
+        """Store every changed container, batch_size to a request. If a
+        request fails, the containers not yet sent stay to be flushed again.
+        :return a list of Conflicts for the containers not stored
+        """
+        containers = list(self._dirty.values())
+        conflicts = []
+        for start in range(0, len(containers), self.batch_size):
+            batch = containers[start:start + self.batch_size]
+            conflicts.extend(self._store_batch(batch))
+            for container in batch:
+                del self._dirty[id(container)]
+        if conflicts:
+            LOGGER.warning("%s of %s containers not stored", len(conflicts), len(containers))
+        return conflicts
+
+    def _store_batch(self, containers):
+        documents = []
+        for container in containers:
+            document = container._document()
+            if '_id' not in document:
+                document['_id'] = container._data['_id'] = uuid4().hex
+            documents.append(document)
+        self.requests += 1
+        conflicts = []
+        for (container, (success, id, rev_or_error)) in zip(containers, self.database.update(documents)):
+            if success:
+                container._data['_rev'] = rev_or_error
+            else:
+                conflicts.append(Conflict(container, id, rev_or_error))
+        return conflicts
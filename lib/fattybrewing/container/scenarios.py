@@ -0,0 +1,141 @@
+"""Running many brewery scenarios across processes
+
+A Scenario describes one brewery (vessel sizes, packaging lines, recipes
+and how often orders come in). run_scenarios shares scenarios out over a
+process pool, each worker builds and simulates its breweries (see
+simulation.Brewery) and sends back a ScenarioResult: a few numbers and an
+array of lead times rather than the container documents. The results
+are merged into one summary.
+
+Synopsis:
+-----------
+
+from fattybrewing.container import scenarios
+
+sweep = [ scenarios.Scenario('fermenters %s' % n, fermenters=[(1100, 'l')] * n, orders=500)
+          for n in range(4, 12) ]
+summary = scenarios.run_scenarios(sweep)
+summary['scenarios']['fermenters 8']['completed'], summary['lead_time_p95']
+
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+import os
+import random
+
+import numpy
+
+from fattybrewing.container import MashTun, Fermenter
+from fattybrewing.container.simulation import Brewery, PackagingLine, Recipe
+
+
+class Scenario(object):
+    """One brewery and its orders
+
+    mash_tuns, fermenters - size tuples, one per vessel
+    packaging_lines - (package size tuple, rate l/hour), one per line
+    recipes - recipes ordered, picked at random for each order
+    mix - how often each recipe is ordered, default all alike
+    order_interval - mean hours between orders, arriving at random (Poisson)
+    or, if arrivals is 'fixed', every order_interval hours
+    hours - time to simulate, default until every order is done
+    transfer_rate - l/hour moving wort into the fermenters
+    """
+
+    def __init__(self, name, mash_tuns=((1300, 'l'),), fermenters=((1100, 'l'),) * 8,
+                 packaging_lines=(((50, 'l'), 500),), recipes=None, order_interval=24.0, orders=100,
+                 arrivals='poisson', hours=None, seed=0, mix=None, transfer_rate=2000.0):
+        self.name = name
+        self.mash_tuns = list(mash_tuns)
+        self.fermenters = list(fermenters)
+        self.packaging_lines = list(packaging_lines)
+        self.recipes = list(recipes or [Recipe('pale ale')])
+        self.mix = list(mix) if mix is not None else None
+        self.order_interval = order_interval
+        self.orders = orders
+        self.arrivals = arrivals
+        self.hours = hours
+        self.seed = seed
+        self.transfer_rate = transfer_rate
+
+    def build(self):
+        """Return a Brewery with the scenario's vessels and orders submitted"""
+        brewery = Brewery([ MashTun(size) for size in self.mash_tuns ],
+                          [ Fermenter(size) for size in self.fermenters ],
+                          [ PackagingLine(size, rate) for (size, rate) in self.packaging_lines ],
+                          transfer_rate=self.transfer_rate)
+        rng = random.Random(self.seed)
+        arrival = 0.0
+        for i in range(self.orders):
+            if self.mix is None:
+                recipe = rng.choice(self.recipes)
+            else:
+                recipe = rng.choices(self.recipes, self.mix)[0]
+            brewery.submit(recipe, at=arrival)
+            if self.arrivals == 'fixed':
+                arrival += self.order_interval
+            else:
+                arrival += rng.expovariate(1.0 / self.order_interval)
+        return brewery
+
+
+class ScenarioResult(object):
+    """What comes back from simulating a scenario
+
+    summary - Brewery.summary() of the scenario
+    lead_times - hours from order to packaged of each completed order, float32
+    """
+
+    __slots__ = ('name', 'summary', 'lead_times')
+
+    def __init__(self, name, summary, lead_times):
+        self.name = name
+        self.summary = summary
+        self.lead_times = lead_times
+
+    def __getstate__(self):
+        return (self.name, self.summary, self.lead_times)
+
+    def __setstate__(self, state):
+        (self.name, self.summary, self.lead_times) = state
+
+
+def run_scenario(scenario):
+    """Simulate one scenario
+    :return a ScenarioResult
+    """
+    brewery = scenario.build()
+    brewery.run(scenario.hours)
+    lead_times = numpy.array([ order.packaged - order.arrived for order in brewery.completed ], dtype=numpy.float32)
+    return ScenarioResult(scenario.name, brewery.summary(), lead_times)
+
+
+def merge_results(results):
+    """Merge ScenarioResults into one summary: totals over all scenarios,
+    lead time percentiles over every completed order, and the summary of
+    each scenario by name
+    """
+    results = list(results)
+    lead_times = numpy.concatenate([ result.lead_times for result in results ] or [numpy.zeros(0, dtype=numpy.float32)])
+    summary = dict( scenarios = dict( (result.name, result.summary) for result in results ),
+                    orders = sum( result.summary['orders'] for result in results ),
+                    completed = sum( result.summary['completed'] for result in results ),
+                    litres = sum( result.summary['litres'] for result in results ),
+                    packages = sum( result.summary['packages'] for result in results ) )
+    for q in (50, 95, 99):
+        summary['lead_time_p%s' % (q)] = float(numpy.percentile(lead_times, q)) if len(lead_times) else None
+    return summary
+
+
+def run_scenarios(scenarios, workers=None, chunksize=1):
+    """Simulate scenarios, workers processes at a time (default one per
+    core, 0 to run them all in this process)
+    :return the merged summary, see merge_results
+    """
+    scenarios = list(scenarios)
+    if workers is None:
+        workers = min(os.cpu_count() or 1, len(scenarios))
+    if workers <= 1 or len(scenarios) <= 1:
+        return merge_results(map(run_scenario, scenarios))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return merge_results(pool.map(run_scenario, scenarios, chunksize=chunksize))
@@ -0,0 +1,256 @@
+"""Temperature sensor readings of vessels
+
+The mash tuns and fermenters of the README have temperature readings
+taken at several locations (and heat-control jackets with their own
+temperature), sampled far more often than the contents change. A
+SensorStore keeps them in ring buffers of fixed size, as typed arrays
+with one row per sensor, at three resolutions: the raw readings, and
+minute and hour buckets holding the lowest, highest and mean reading.
+Old readings fall out of each ring, so memory stays bounded however
+long the simulation runs, while the coarser rings reach further back.
+
+Times are seconds on any clock (time.time(), or simulation hours times
+3600). Each sensor's readings must come in time order, older ones are
+counted in late and dropped.
+
+Synopsis:
+-----------
+
+from fattybrewing.container.sensors import SensorStore
+
+store = SensorStore(raw_capacity=3600)
+top = store.sensor(mash_tun.id, 'top')
+jacket = store.sensor(mash_tun.id, 'jacket')
+store.record(top, 0.0, 66.5)
+store.record_many([top, jacket], [1.0, 1.0], [66.7, 70.1])
+
+store.current_temperature_readings(mash_tun.id)   # [('top', 66.7), ('jacket', 70.1)]
+(low, high, mean) = store.stats([top, jacket], 0.0, 3600.0)
+(times, lows, highs, means) = store.window(top, 0.0, 86400.0, 'minute')
+
+"""
+
+import numpy
+
+# Name and bucket width in seconds of each resolution, finest first
+RESOLUTIONS = (('raw', 0), ('minute', 60), ('hour', 3600))
+
+
+class _Ring(object):
+    """Ring buffers of one resolution, a row of capacity slots per sensor
+
+    Slot written % capacity takes a sensor's next bucket, written being
+    how many it had so far. Raw rings keep one reading a slot, the others
+    the start time, lowest, highest, sum and count of a bucket.
+    """
+
+    def __init__(self, width, capacity, sensors):
+        self.width = width
+        self.capacity = capacity
+        self.columns = (('time', numpy.float64, numpy.nan),) + \
+            ((('value', numpy.float32, numpy.nan),) if not width else
+             (('low', numpy.float32, numpy.nan),
+              ('high', numpy.float32, numpy.nan),
+              ('total', numpy.float64, 0),
+              ('count', numpy.uint32, 0)))
+        self.written = numpy.zeros(sensors, dtype=numpy.int64)
+        for (column, dtype, empty) in self.columns:
+            setattr(self, column, numpy.full((sensors, capacity), empty, dtype=dtype))
+
+    @property
+    def nbytes(self):
+        return self.written.nbytes + sum(getattr(self, column).nbytes for (column, dtype, empty) in self.columns)
+
+    def grow(self, sensors):
+        """Make rows for sensors sensors"""
+        count = len(self.written)
+        self.written = numpy.concatenate([self.written, numpy.zeros(sensors - count, dtype=numpy.int64)])
+        for (column, dtype, empty) in self.columns:
+            grown = numpy.full((sensors, self.capacity), empty, dtype=dtype)
+            grown[:count] = getattr(self, column)
+            setattr(self, column, grown)
+
+    def _slots(self, sensors):
+        """Return the ring slots for new buckets of sensors (sorted), and
+        which of them to keep: only the last capacity of a sensor survive
+        """
+        starts = numpy.flatnonzero(numpy.r_[True, sensors[1:] != sensors[:-1]])
+        sizes = numpy.diff(numpy.r_[starts, len(sensors)])
+        rank = numpy.arange(len(sensors)) - numpy.repeat(starts, sizes)
+        keep = rank >= numpy.repeat(sizes, sizes) - self.capacity
+        slots = (self.written[sensors] + rank) % self.capacity
+        self.written[sensors[starts]] += sizes
+        return (slots[keep], keep)
+
+    def append(self, sensors, times, values):
+        """Add readings, sorted by sensor then time and none older than the
+        sensor's latest
+        """
+        if not self.width:
+            (slots, keep) = self._slots(sensors)
+            self.time[sensors[keep], slots] = times[keep]
+            self.value[sensors[keep], slots] = values[keep]
+            return
+        buckets = numpy.floor(times / self.width) * self.width
+        starts = numpy.flatnonzero(numpy.r_[True, (sensors[1:] != sensors[:-1]) | (buckets[1:] != buckets[:-1])])
+        sensors = sensors[starts]
+        buckets = buckets[starts]
+        low = numpy.minimum.reduceat(values, starts)
+        high = numpy.maximum.reduceat(values, starts)
+        total = numpy.add.reduceat(values.astype(numpy.float64), starts)
+        count = numpy.diff(numpy.r_[starts, len(values)])
+        # A sensor's first bucket may be the one its last readings went into
+        last = (self.written[sensors] - 1) % self.capacity
+        merge = (self.written[sensors] > 0) & (self.time[sensors, last] == buckets)
+        (ms, ml) = (sensors[merge], last[merge])
+        self.low[ms, ml] = numpy.minimum(self.low[ms, ml], low[merge])
+        self.high[ms, ml] = numpy.maximum(self.high[ms, ml], high[merge])
+        self.total[ms, ml] += total[merge]
+        self.count[ms, ml] += count[merge].astype(numpy.uint32)
+        new = ~merge
+        if not new.any():
+            return
+        (slots, keep) = self._slots(sensors[new])
+        rows = sensors[new][keep]
+        self.time[rows, slots] = buckets[new][keep]
+        self.low[rows, slots] = low[new][keep]
+        self.high[rows, slots] = high[new][keep]
+        self.total[rows, slots] = total[new][keep]
+        self.count[rows, slots] = count[new][keep]
+
+    def oldest(self, sensors):
+        """Return the time from which the ring holds everything of sensors,
+        -inf for those it never dropped anything of
+        """
+        written = self.written[sensors]
+        oldest = self.time[sensors, written % self.capacity]
+        return numpy.where(written > self.capacity, oldest, -numpy.inf)
+
+    def masked(self, sensors, start, end):
+        """Return a mask of the buckets of sensors from start up to end"""
+        times = self.time[sensors]
+        with numpy.errstate(invalid='ignore'):
+            return (times >= start) & (times < end)
+
+
+class SensorStore(object):
+    """Temperature readings of many sensors, each in fixed size rings
+
+    A sensor is a location on a vessel (a container id or name), such as
+    'top', 'bottom' or 'jacket', and is known by the number sensor() gives.
+    raw_capacity readings are kept per sensor, minute_capacity minute
+    buckets and hour_capacity hour buckets.
+    """
+
+    def __init__(self, raw_capacity=3600, minute_capacity=1440, hour_capacity=720, sensors=16):
+        self.keys = []
+        self.numbers = {}
+        self.late = 0
+        self.last = numpy.full(sensors, -numpy.inf)
+        self.rings = dict( (name, _Ring(width, capacity, sensors))
+                           for ((name, width), capacity) in zip(RESOLUTIONS, (raw_capacity, minute_capacity, hour_capacity)) )
+
+    def __len__(self):
+        return len(self.keys)
+
+    @property
+    def nbytes(self):
+        """Memory taken by the readings"""
+        return self.last.nbytes + sum(ring.nbytes for ring in self.rings.values())
+
+    def sensor(self, vessel, location):
+        """Return the number of the sensor at location on vessel, adding it if new"""
+        key = (vessel, location)
+        try:
+            return self.numbers[key]
+        except KeyError:
+            pass
+        number = self.numbers[key] = len(self.keys)
+        self.keys.append(key)
+        if number == len(self.last):
+            capacity = max(2 * len(self.last), 1)
+            self.last = numpy.concatenate([self.last, numpy.full(capacity - number, -numpy.inf)])
+            for ring in self.rings.values():
+                ring.grow(capacity)
+        return number
+
+    def record(self, sensor, time, degrees):
+        self.record_many([sensor], [time], [degrees])
+
+    def record_many(self, sensors, times, degrees):
+        """Record a batch of readings, given as parallel sequences
+        :return the number recorded, the others were late
+        """
+        sensors = numpy.asarray(sensors, dtype=numpy.int64)
+        times = numpy.asarray(times, dtype=numpy.float64)
+        degrees = numpy.asarray(degrees, dtype=numpy.float32)
+        if not len(sensors):
+            return 0
+        order = numpy.lexsort((times, sensors))
+        (sensors, times, degrees) = (sensors[order], times[order], degrees[order])
+        on_time = times >= self.last[sensors]
+        if not on_time.all():
+            self.late += int(len(on_time) - numpy.count_nonzero(on_time))
+            (sensors, times, degrees) = (sensors[on_time], times[on_time], degrees[on_time])
+            if not len(sensors):
+                return 0
+        for ring in self.rings.values():
+            ring.append(sensors, times, degrees)
+        # Sorted by time within each sensor, so the last reading of each is the latest
+        ends = numpy.r_[sensors[1:] != sensors[:-1], True]
+        self.last[sensors[ends]] = times[ends]
+        return len(sensors)
+
+    def latest(self, sensors):
+        """Return the latest reading of each of sensors, nan for those without"""
+        ring = self.rings['raw']
+        sensors = numpy.asarray(sensors, dtype=numpy.int64)
+        return ring.value[sensors, (ring.written[sensors] - 1) % ring.capacity]
+
+    def current_temperature_readings(self, vessel):
+        """Return (location, degrees) of the latest reading of every sensor on vessel"""
+        sensors = [ number for (number, key) in enumerate(self.keys) if key[0] == vessel ]
+        return [ (self.keys[sensor][1], float(degrees)) for (sensor, degrees) in zip(sensors, self.latest(sensors))
+                 if not numpy.isnan(degrees) ]
+
+    def resolution(self, sensors, start):
+        """Return the finest resolution still holding every reading of sensors since start"""
+        sensors = numpy.asarray(sensors, dtype=numpy.int64)
+        for (name, width) in RESOLUTIONS:
+            if (self.rings[name].oldest(sensors) <= start).all():
+                return name
+        return RESOLUTIONS[-1][0]
+
+    def window(self, sensor, start, end, resolution=None):
+        """Return the readings of sensor from start up to end, in time order:
+        (times, degrees) at raw resolution, otherwise (bucket start times,
+        lowest, highest, mean) of the buckets starting in the window
+        """
+        ring = self.rings[resolution or self.resolution([sensor], start)]
+        mask = ring.masked([sensor], start, end)[0]
+        order = numpy.argsort(ring.time[sensor][mask], kind='stable')
+        if not ring.width:
+            return (ring.time[sensor][mask][order], ring.value[sensor][mask][order])
+        count = ring.count[sensor][mask][order]
+        return (ring.time[sensor][mask][order], ring.low[sensor][mask][order], ring.high[sensor][mask][order],
+                ring.total[sensor][mask][order] / count)
+
+    def stats(self, sensors, start, end, resolution=None):
+        """Return the lowest, highest and mean readings of each of sensors
+        from start up to end, as arrays, nan for sensors without any. At
+        minute or hour resolution whole buckets starting in the window count.
+        """
+        sensors = numpy.asarray(sensors, dtype=numpy.int64)
+        ring = self.rings[resolution or self.resolution(sensors, start)]
+        mask = ring.masked(sensors, start, end)
+        if ring.width:
+            (low, high, total, count) = (ring.low[sensors], ring.high[sensors], ring.total[sensors], ring.count[sensors])
+        else:
+            low = high = ring.value[sensors]
+            (total, count) = (low.astype(numpy.float64), numpy.ones(low.shape, dtype=numpy.uint32))
+        counts = numpy.where(mask, count, 0).sum(axis=1)
+        found = counts > 0
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            return (numpy.where(found, numpy.where(mask, low, numpy.inf).min(axis=1), numpy.nan),
+                    numpy.where(found, numpy.where(mask, high, -numpy.inf).max(axis=1), numpy.nan),
+                    numpy.where(mask, total, 0).sum(axis=1) / numpy.where(found, counts, numpy.nan))
@@ -0,0 +1,336 @@
+"""Discrete event simulation of the mash -> ferment -> package pipeline
+
+A Scheduler keeps pending events on a heap ordered by simulated time and
+jumps from one to the next, so nothing waits on the wall clock. A
+Brewery drives MashTun, Fermenter and keg or bottle containers through
+the scheduler: orders queue for a mash tun, the wort is transferred into
+a free fermenter, fermented, and packaged on a packaging line, each step
+an event. A batch that cannot go on (too much for its mash tun or
+fermenter, or beer left over once packaged) is recorded as failed, its
+vessels emptied and freed, and the other orders carry on.
+
+Fermenters are looked at in rounds every ferment_interval hours, and
+every fermenter fermenting at that time advances in one
+fermentation.ferment_fleet call, the batched form of
+Fermenter.ferment_wort.
+
+Times are in hours from the start of the simulation.
+
+Synopsis:
+-----------
+
+from fattybrewing.container import simulation
+
+brewery = simulation.Brewery([MashTun((1200, 'l'))], [Fermenter((1100, 'l')) for i in range(8)],
+                             [simulation.PackagingLine((50, 'l'), 500)])
+for week in range(52):
+    brewery.submit(simulation.Recipe('pale ale'), at=week * 168)
+brewery.run()
+brewery.summary(), brewery.failed
+
+"""
+
+from collections import deque
+from datetime import timedelta
+import heapq
+import itertools
+import logging
+import math
+
+from fattybrewing.container import Keg, ContentType, ContainerError, PackagingError, convert_amount, move_all
+from fattybrewing.container.fermentation import DEFAULT_PARAMETERS, ferment_fleet
+
+LOGGER = logging.getLogger("fattybrewing-container")
+
+
+class Scheduler(object):
+    """A heap of events, each a callback run at a simulated time"""
+
+    def __init__(self):
+        self.now = 0.0
+        self._queue = []
+        self._sequence = itertools.count()
+
+    def __len__(self):
+        return len(self._queue)
+
+    def schedule(self, delay, callback, *args):
+        """Run callback(*args) delay hours from now
+        :return the event, for cancel
+        """
+        return self.schedule_at(self.now + max(delay, 0), callback, *args)
+
+    def schedule_at(self, time, callback, *args):
+        # [time, sequence, callback, args], events at the same time run in the order scheduled
+        event = [time, next(self._sequence), callback, args]
+        heapq.heappush(self._queue, event)
+        return event
+
+    def cancel(self, event):
+        """Stop an event from running, it is dropped when it comes up"""
+        event[2] = None
+
+    def step(self):
+        """Run the next event
+        :return False once there are no events left
+        """
+        while self._queue:
+            (time, sequence, callback, args) = heapq.heappop(self._queue)
+            if callback is None:
+                continue
+            self.now = time
+            callback(*args)
+            return True
+        return False
+
+    def run(self, until=None):
+        """Run events in time order until there are none left, or until the next is after until
+        :return the number of events run
+        """
+        count = 0
+        queue = self._queue
+        while queue:
+            if until is not None and queue[0][0] > until:
+                self.now = until
+                break
+            if self.step():
+                count += 1
+        return count
+
+
+class Recipe(object):
+    """What goes into one batch: amounts in l and kg, temperatures in C"""
+
+    def __init__(self, name, water=1000, malt=200, hops=2, yeast=0.5, mash_temperature=67,
+                 mash_hours=1.5, ferment_temperature=20):
+        self.name = name
+        self.water = water
+        self.malt = malt
+        self.hops = hops
+        self.yeast = yeast
+        self.mash_temperature = mash_temperature
+        self.mash_hours = mash_hours
+        self.ferment_temperature = ferment_temperature
+
+
+class BatchOrder(object):
+    """An order for a recipe and the times (hours) it went through each step"""
+
+    def __init__(self, number, recipe, arrived):
+        self.number = number
+        self.recipe = recipe
+        self.arrived = arrived
+        self.mashed = None
+        self.fermenting = None
+        self.fermented = None
+        self.packaged = None
+        self.volume = None      # litres of beer packaged
+        self.packages = 0
+        self.failed = None      # the error the batch was given up on
+
+    def __repr__(self):
+        return "<BatchOrder %s %s>" % (self.number, self.recipe.name)
+
+
+class PackagingLine(object):
+    """Fills packages of package_size (a size tuple) at rate l/hour.
+    README: PACKAGER - type bottle/keg, output volume hourly rate
+    """
+
+    def __init__(self, package_size, rate, package=Keg):
+        self.package_size = package_size
+        self.rate = rate
+        self.package = package
+
+    def packages_for(self, litres):
+        """Return enough empty packages for litres of beer"""
+        size = float(convert_amount(self.package_size, 'l'))
+        return [ self.package(self.package_size) for i in range(int(math.ceil(litres / size - 1e-9))) ]
+
+
+class Brewery(object):
+    """Mash tuns, fermenters and packaging lines working through orders
+
+    transfer_rate - l/hour moving wort from a mash tun into a fermenter
+    ferment_interval - hours between rounds of the fermenters
+    """
+
+    def __init__(self, mash_tuns, fermenters, packaging_lines, transfer_rate=2000.0,
+                 ferment_interval=12.0, parameters=DEFAULT_PARAMETERS, scheduler=None):
+        self.scheduler = scheduler or Scheduler()
+        self.mash_tuns = list(mash_tuns)
+        self.fermenters = list(fermenters)
+        self.packaging_lines = list(packaging_lines)
+        self.transfer_rate = transfer_rate
+        self.ferment_interval = ferment_interval
+        self.parameters = parameters
+        self.orders = []
+        self.completed = []
+        self.failed = []
+        # vessel -> hours it was in use, and when its current use started
+        self.busy_hours = dict( (vessel, 0.0) for vessel in self.mash_tuns + self.fermenters + self.packaging_lines )
+        self._in_use = {}
+        self._free_mash_tuns = deque(self.mash_tuns)
+        self._free_fermenters = deque(self.fermenters)
+        self._free_lines = deque(self.packaging_lines)
+        self._mash_queue = deque()
+        self._wort_queue = deque()
+        self._package_queue = deque()
+        self._fermenting = {}
+        self._ferment_round = None
+
+    @property
+    def now(self):
+        return self.scheduler.now
+
+    def submit(self, recipe, at=None):
+        """Place an order for recipe, arriving at hours (default now)
+        :return the BatchOrder
+        """
+        order = BatchOrder(len(self.orders) + 1, recipe, self.now if at is None else at)
+        self.orders.append(order)
+        self.scheduler.schedule_at(order.arrived, self._arrive, order)
+        return order
+
+    def run(self, until=None):
+        return self.scheduler.run(until)
+
+    def _acquire(self, free):
+        vessel = free.popleft()
+        self._in_use[vessel] = self.now
+        return vessel
+
+    def _release(self, vessel, free):
+        self.busy_hours[vessel] += self.now - self._in_use.pop(vessel)
+        free.append(vessel)
+
+    def _arrive(self, order):
+        self._mash_queue.append(order)
+        self._start_mash()
+
+    def _start_mash(self):
+        while self._mash_queue and self._free_mash_tuns:
+            order = self._mash_queue.popleft()
+            mash_tun = self._acquire(self._free_mash_tuns)
+            recipe = order.recipe
+            temperature = (recipe.mash_temperature, 'C')
+            try:
+                mash_tun.add_many([ ('water', (recipe.water, mash_tun.size.unit), temperature),
+                                    ('malt', (recipe.malt, 'kg'), temperature),
+                                    ('hops', (recipe.hops, 'kg'), temperature) ])
+            except ContainerError as e:
+                mash_tun.remove_all()
+                self._release(mash_tun, self._free_mash_tuns)
+                self._fail(order, e)
+                continue
+            self.scheduler.schedule(recipe.mash_hours, self._mash_done, mash_tun, order)
+
+    def _mash_done(self, mash_tun, order):
+        mash_tun.convert_to_wort()
+        order.mashed = self.now
+        self._wort_queue.append((mash_tun, order))
+        self._start_ferment()
+
+    def _start_ferment(self):
+        while self._wort_queue and self._free_fermenters:
+            (mash_tun, order) = self._wort_queue.popleft()
+            fermenter = self._acquire(self._free_fermenters)
+            wort = [ c for c in mash_tun.contents if c.content_type == ContentType.Wort ][0]
+            litres = float(convert_amount( (wort.amount, wort.unit), 'l'))
+            self.scheduler.schedule(litres / self.transfer_rate, self._filled, mash_tun, fermenter, order)
+
+    def _filled(self, mash_tun, fermenter, order):
+        try:
+            move_all(mash_tun, fermenter)
+            fermenter.add_content('yeast', (order.recipe.yeast, 'kg'))
+        except ContainerError as e:
+            # Whatever made it into the fermenter is drained away with the rest
+            for vessel in (mash_tun, fermenter):
+                vessel.remove_all()
+            self._release(mash_tun, self._free_mash_tuns)
+            self._release(fermenter, self._free_fermenters)
+            self._fail(order, e)
+            self._start_mash()
+            self._start_ferment()
+            return
+        # Dig out the used grains and hops
+        mash_tun.remove_all()
+        self._release(mash_tun, self._free_mash_tuns)
+        fermenter.heat_contents((order.recipe.ferment_temperature, 'C'))
+        order.fermenting = self.now
+        self._fermenting[fermenter] = order
+        if self._ferment_round is None:
+            self._ferment_round = self.scheduler.schedule(self.ferment_interval, self._ferment)
+        self._start_mash()
+
+    def _ferment(self):
+        replaced = ferment_fleet(list(self._fermenting), timedelta(hours=self.ferment_interval),
+                                 parameters=self.parameters)
+        for (fermenter, removed) in replaced.items():
+            if removed:
+                order = self._fermenting.pop(fermenter)
+                order.fermented = self.now
+                self._package_queue.append((fermenter, order))
+        if self._fermenting:
+            self._ferment_round = self.scheduler.schedule(self.ferment_interval, self._ferment)
+        else:
+            self._ferment_round = None
+        self._start_package()
+
+    def _start_package(self):
+        while self._package_queue and self._free_lines:
+            (fermenter, order) = self._package_queue.popleft()
+            line = self._acquire(self._free_lines)
+            beer = [ c for c in fermenter.contents if c.content_type == ContentType.Beer ][0]
+            litres = float(convert_amount( (beer.amount, beer.unit), 'l'))
+            self.scheduler.schedule(litres / line.rate, self._packaged, line, fermenter, order, litres)
+
+    def _packaged(self, line, fermenter, order, litres):
+        packages = line.packages_for(litres)
+        try:
+            plan = fermenter.into_kegs(packages)
+        except (ContainerError, PackagingError) as e:
+            plan = None
+            self._fail(order, e)
+        # Clean out the yeast, ready for the next batch
+        fermenter.remove_all()
+        self._release(line, self._free_lines)
+        self._release(fermenter, self._free_fermenters)
+        if plan is not None:
+            order.packaged = self.now
+            order.volume = litres
+            order.packages = plan.filled_count
+            self.completed.append(order)
+        self._start_package()
+        self._start_ferment()
+
+    def _fail(self, order, error):
+        LOGGER.error("Batch %s of %s failed at %s hours: %s", order.number, order.recipe.name, self.now, error)
+        order.failed = error
+        self.failed.append(order)
+
+    def utilization(self, vessels):
+        """Return the fraction of the time so far vessels were in use, on average"""
+        vessels = list(vessels)
+        if not vessels or not self.now:
+            return 0.0
+        busy = sum( self.busy_hours[vessel] + (self.now - self._in_use[vessel] if vessel in self._in_use else 0)
+                    for vessel in vessels )
+        return busy / (len(vessels) * self.now)
+
+    def summary(self):
+        """Return a dictionary of completed and failed orders, litres and packages,
+        mean lead time (hours from order to packaged), and utilization of
+        each kind of vessel
+        """
+        completed = self.completed
+        return dict( orders = len(self.orders),
+                     completed = len(completed),
+                     failed = len(self.failed),
+                     litres = sum( order.volume for order in completed ),
+                     packages = sum( order.packages for order in completed ),
+                     lead_time = sum( order.packaged - order.arrived for order in completed ) / len(completed) if completed else None,
+                     mash_tun_utilization = self.utilization(self.mash_tuns),
+                     fermenter_utilization = self.utilization(self.fermenters),
+                     packaging_utilization = self.utilization(self.packaging_lines),
+                     hours = self.now )
@@ -0,0 +1,186 @@
+"""Monte Carlo sweeps over brewery configurations
+
+A SweepSpace gives ranges for vessel sizes, transfer and packaging rates,
+the fermenting temperature and how often orders come in. sample draws
+any number of configurations, and evaluate works out the steady state
+of every one of them at once, as arrays:
+
+- each recipe is scaled down to fit the mash tun and the fermenter
+- fermentation times come from fermentation.ferment_hours
+- a batch keeps a mash tun busy while mashing and transferring, a
+  fermenter from the transfer until it is packaged, and a packaging line
+  while packaging
+- throughput is the order rate, or the capacity of the slowest stage if
+  that is less; utilization is the busy time of each stage at that rate
+  (time spent waiting on the next stage is not counted)
+
+scenario turns a single draw back into a scenarios.Scenario, with the
+vessels built through set_size, to check it with the event simulation.
+
+Synopsis:
+-----------
+
+from fattybrewing.container import sweep
+
+space = sweep.SweepSpace(fermenters=(6, 12), fermenter_size=(800, 1600))
+report = sweep.sweep(space, draws=100000)
+report['throughput'][50], report['utilization']['fermenter'][95], report['bottleneck']
+
+"""
+
+import numpy
+
+from fattybrewing.container.fermentation import DEFAULT_PARAMETERS, ferment_hours
+from fattybrewing.container.scenarios import Scenario
+from fattybrewing.container.simulation import Recipe
+
+STAGES = ('mash_tun', 'fermenter', 'packaging')
+# Share of a vessel left empty when a recipe is scaled to fill it, so
+# float rounding of the scaled amounts never overflows it
+HEADROOM = 1e-9
+
+# One drawn configuration, sizes and rates in l and l/hour, times in hours
+SWEEP_DTYPE = numpy.dtype([('mash_tuns', numpy.int32),
+                           ('fermenters', numpy.int32),
+                           ('packaging_lines', numpy.int32),
+                           ('mash_tun_size', numpy.float64),
+                           ('fermenter_size', numpy.float64),
+                           ('transfer_rate', numpy.float64),
+                           ('line_rate', numpy.float64),
+                           ('ferment_temperature', numpy.float64),
+                           ('order_interval', numpy.float64)])
+
+
+class SweepSpace(object):
+    """Where configurations are drawn from. Each field of SWEEP_DTYPE is
+    either fixed (a number) or drawn uniformly from a (low, high) range,
+    counts of vessels from low to high inclusive.
+
+    recipes - the recipes ordered, their share of the orders drawn for
+    each configuration (Dirichlet with mix_concentration), unless mix is given
+    """
+
+    def __init__(self, recipes=None, mix=None, mix_concentration=1.0, package_size=(50, 'l'),
+                 ferment_interval=12.0, mash_tuns=1, fermenters=8, packaging_lines=1,
+                 mash_tun_size=(1000.0, 2000.0), fermenter_size=(800.0, 1600.0), transfer_rate=(1000.0, 3000.0),
+                 line_rate=(300.0, 800.0), ferment_temperature=(14.0, 24.0), order_interval=(12.0, 48.0)):
+        self.recipes = list(recipes or [Recipe('pale ale')])
+        self.mix = numpy.asarray(mix, dtype=numpy.float64) / numpy.sum(mix) if mix is not None else None
+        self.mix_concentration = mix_concentration
+        self.package_size = package_size
+        self.ferment_interval = ferment_interval
+        self.ranges = dict( mash_tuns = mash_tuns,
+                            fermenters = fermenters,
+                            packaging_lines = packaging_lines,
+                            mash_tun_size = mash_tun_size,
+                            fermenter_size = fermenter_size,
+                            transfer_rate = transfer_rate,
+                            line_rate = line_rate,
+                            ferment_temperature = ferment_temperature,
+                            order_interval = order_interval )
+
+    def recipe_columns(self):
+        """Return arrays over the recipes: water, malt + hops, yeast and mash hours"""
+        return (numpy.array([ recipe.water for recipe in self.recipes ], dtype=numpy.float64),
+                numpy.array([ recipe.malt + recipe.hops for recipe in self.recipes ], dtype=numpy.float64),
+                numpy.array([ recipe.yeast for recipe in self.recipes ], dtype=numpy.float64),
+                numpy.array([ recipe.mash_hours for recipe in self.recipes ], dtype=numpy.float64))
+
+
+def sample(space, draws, seed=None):
+    """Draw configurations from space
+    :return (an array of SWEEP_DTYPE, the recipe mix of each, draws x recipes)
+    """
+    rng = numpy.random.default_rng(seed)
+    configurations = numpy.zeros(draws, dtype=SWEEP_DTYPE)
+    for name in SWEEP_DTYPE.names:
+        spec = space.ranges[name]
+        if not isinstance(spec, (tuple, list)):
+            configurations[name] = spec
+        elif SWEEP_DTYPE[name].kind == 'i':
+            configurations[name] = rng.integers(spec[0], spec[1], size=draws, endpoint=True)
+        else:
+            configurations[name] = rng.uniform(spec[0], spec[1], size=draws)
+    if space.mix is not None:
+        mix = numpy.broadcast_to(space.mix, (draws, len(space.recipes)))
+    else:
+        mix = rng.dirichlet(numpy.full(len(space.recipes), space.mix_concentration), size=draws)
+    return (configurations, mix)
+
+
+def batch_volumes(space, configurations):
+    """Return the litres of wort per batch, draws x recipes, each recipe
+    scaled down to fit the mash tun and the fermenter (the wort and the
+    yeast pitched into it, a kg taking a l)
+    """
+    (water, solids, yeast, mash_hours) = space.recipe_columns()
+    mash_fit = configurations['mash_tun_size'][:, numpy.newaxis] * (1 - HEADROOM) / (water + solids)
+    fermenter_fit = configurations['fermenter_size'][:, numpy.newaxis] * (1 - HEADROOM) / (water + yeast)
+    return water * numpy.minimum(numpy.minimum(mash_fit, fermenter_fit), 1.0)
+
+
+def evaluate(space, configurations, mix, step=3.0, parameters=DEFAULT_PARAMETERS):
+    """Work out the steady state of every configuration
+    :return a dictionary of arrays over the draws: throughput (l/week),
+    busy (hours per batch) and utilization of each stage, and bottleneck
+    (the position in STAGES of the slowest stage)
+    """
+    (water, solids, yeast, mash_hours) = space.recipe_columns()
+    volumes = batch_volumes(space, configurations)
+    pitches = yeast * 1000 / water
+    fermenting = ferment_hours(configurations['ferment_temperature'][:, numpy.newaxis], pitches,
+                               space.ferment_interval, step=step, parameters=parameters)
+    transfer = volumes / configurations['transfer_rate'][:, numpy.newaxis]
+    packaging = volumes / configurations['line_rate'][:, numpy.newaxis]
+
+    busy = numpy.stack([ (mix * (mash_hours + transfer)).sum(axis=1),
+                         (mix * (transfer + fermenting + packaging)).sum(axis=1),
+                         (mix * packaging).sum(axis=1) ], axis=1)
+    vessels = numpy.stack([ configurations['mash_tuns'], configurations['fermenters'],
+                            configurations['packaging_lines'] ], axis=1).astype(numpy.float64)
+    with numpy.errstate(divide='ignore'):
+        capacity = vessels / busy
+    batches = numpy.minimum(1.0 / configurations['order_interval'], capacity.min(axis=1))
+    with numpy.errstate(invalid='ignore'):
+        utilization = numpy.nan_to_num(batches[:, numpy.newaxis] * busy / vessels, nan=1.0)
+    return dict( throughput = batches * (mix * volumes).sum(axis=1) * 168,
+                 busy = busy,
+                 utilization = utilization,
+                 bottleneck = capacity.argmin(axis=1) )
+
+
+def sweep(space, draws=10000, seed=None, percentiles=(5, 50, 95), step=3.0):
+    """Draw and evaluate configurations
+    :return a report: percentiles of throughput (l/week) and of each stage's
+    utilization, and the share of draws each stage is the bottleneck in
+    """
+    (configurations, mix) = sample(space, draws, seed)
+    result = evaluate(space, configurations, mix, step)
+    counts = numpy.bincount(result['bottleneck'], minlength=len(STAGES))
+    return dict( draws = draws,
+                 throughput = dict(zip(percentiles, numpy.percentile(result['throughput'], percentiles).tolist())),
+                 utilization = dict( (stage, dict(zip(percentiles, numpy.percentile(result['utilization'][:, i], percentiles).tolist())))
+                                     for (i, stage) in enumerate(STAGES) ),
+                 bottleneck = dict(zip(STAGES, (counts / float(draws)).tolist())) )
+
+
+def scenario(space, configurations, mix, i, orders=100, seed=0):
+    """Return draw i as a scenarios.Scenario, recipes scaled to fit as in evaluate"""
+    configuration = configurations[i]
+    volumes = batch_volumes(space, configurations[i:i + 1])[0]
+    recipes = []
+    for (recipe, volume) in zip(space.recipes, volumes):
+        scale = volume / recipe.water
+        recipes.append(Recipe(recipe.name, recipe.water * scale, recipe.malt * scale, recipe.hops * scale,
+                              recipe.yeast * scale, recipe.mash_temperature, recipe.mash_hours,
+                              float(configuration['ferment_temperature'])))
+    return Scenario('draw %s' % (i),
+                    mash_tuns = [(float(configuration['mash_tun_size']), 'l')] * int(configuration['mash_tuns']),
+                    fermenters = [(float(configuration['fermenter_size']), 'l')] * int(configuration['fermenters']),
+                    packaging_lines = [(space.package_size, float(configuration['line_rate']))] * int(configuration['packaging_lines']),
+                    recipes = recipes,
+                    mix = mix[i].tolist(),
+                    order_interval = float(configuration['order_interval']),
+                    orders = orders,
+                    transfer_rate = float(configuration['transfer_rate']),
+                    seed = seed)
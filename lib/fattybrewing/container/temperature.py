@@ -0,0 +1,160 @@
+"""Temperature conversion and thermal mixing for containers
+
+Temperatures are (degrees, unit) with unit one of TEMP_UNITS. Mixing
+works out the temperature contents settle at when put together: the
+average of their temperatures weighted by mass times specific heat
+capacity. All of it is vectorized, so one call handles every lot of
+many mash tuns.
+
+Synopsis:
+-----------
+
+from fattybrewing.container import temperature
+
+temperature.convert_temp((70, 'C'), 'F')
+temperature.mix_temperatures([20, 5], [75, 20], [4186, 1700])
+temperature.mash_temperatures(mash_tuns, 'C')
+
+"""
+
+from decimal import Decimal
+
+import numpy
+
+from fattybrewing.container import TEMP_UNITS, UNITS, ContainerError, ContentType, WORT_INGREDIENTS
+
+# kelvin = degrees * _SCALE[unit] + _OFFSET[unit]
+_SCALE = {'C': 1.0, 'K': 1.0, 'F': 5.0 / 9.0}
+_OFFSET = {'C': 273.15, 'K': 0.0, 'F': 273.15 - 32 * 5.0 / 9.0}
+_DECIMAL_SCALE = {'C': Decimal(1), 'K': Decimal(1), 'F': Decimal(5) / Decimal(9)}
+_DECIMAL_OFFSET = {'C': Decimal('273.15'), 'K': Decimal(0), 'F': Decimal('273.15') - 32 * Decimal(5) / Decimal(9)}
+_CODES = dict((unit, code) for (code, unit) in enumerate(TEMP_UNITS))
+_SCALES = numpy.array([ _SCALE[unit] for unit in TEMP_UNITS ])
+_OFFSETS = numpy.array([ _OFFSET[unit] for unit in TEMP_UNITS ])
+
+# Specific heat capacity by content type, J/(kg K). Contents of an
+# unknown type are taken to be water.
+HEAT_CAPACITIES = {ContentType.Water: 4186.0,
+                   ContentType.Wort: 4000.0,
+                   ContentType.Beer: 4000.0,
+                   ContentType.Malt: 1700.0,
+                   ContentType.Hops: 1700.0,
+                   ContentType.Yeast: 3700.0,
+                   }
+DEFAULT_HEAT_CAPACITY = HEAT_CAPACITIES[ContentType.Water]
+
+
+def _unit(unit):
+    try:
+        return unit.upper() if unit.upper() in _CODES else None
+    except AttributeError:
+        return None
+
+
+def convert_temp(temp, target_unit):
+    """Convert a temperature into target_unit, returning the degrees.
+    :param temp - (degrees, unit) or {"degrees": degrees, "unit": unit}
+    Decimal degrees stay Decimal.
+    """
+    if "unit" in temp:
+        (degrees, unit) = (temp["degrees"], temp["unit"])
+    else:
+        (degrees, unit) = temp
+    (source, target) = (_unit(unit), _unit(target_unit))
+    if source is None or target is None:
+        raise ContainerError("Unable to convert temperature from %s into %s" % (unit, target_unit))
+    if source == target:
+        return degrees
+    if isinstance(degrees, Decimal):
+        kelvin = degrees * _DECIMAL_SCALE[source] + _DECIMAL_OFFSET[source]
+        return (kelvin - _DECIMAL_OFFSET[target]) / _DECIMAL_SCALE[target]
+    kelvin = degrees * _SCALE[source] + _OFFSET[source]
+    return (kelvin - _OFFSET[target]) / _SCALE[target]
+
+
+def convert_temps(degrees, units, target_unit):
+    """Convert an array of temperatures into target_unit in one pass.
+    :param units - one unit for all, a sequence of units or an array of
+    TEMP_UNITS positions
+    :return a float64 numpy array
+    """
+    degrees = numpy.asarray(degrees, dtype=numpy.float64)
+    target = _unit(target_unit)
+    if target is None:
+        raise ContainerError("Unable to convert temperature into %s" % (target_unit))
+    if isinstance(units, str):
+        codes = _CODES.get(_unit(units))
+        if codes is None:
+            raise ContainerError("Unable to convert temperature from %s" % (units))
+    else:
+        units = numpy.asarray(units)
+        if units.dtype.kind in 'iu':
+            codes = units
+        else:
+            (names, inverse) = numpy.unique(units, return_inverse=True)
+            if any(_unit(name) is None for name in names.tolist()):
+                raise ContainerError("Unable to convert temperatures from %s" % (names.tolist(),))
+            codes = numpy.array([ _CODES[_unit(name)] for name in names.tolist() ], dtype=numpy.intp)[inverse]
+    kelvin = degrees * _SCALES[codes] + _OFFSETS[codes]
+    return (kelvin - _OFFSET[target]) / _SCALE[target]
+
+
+def heat_capacities(content_types):
+    """Return the specific heat capacities of a sequence of content types"""
+    return numpy.array([ HEAT_CAPACITIES.get(content_type, DEFAULT_HEAT_CAPACITY) for content_type in content_types ],
+                       dtype=numpy.float64)
+
+
+def mix_temperatures(masses, degrees, capacities=None, axis=-1):
+    """Return the temperature lots settle at when mixed, all in one unit.
+
+    Arrays are reduced along axis, so rows of a 2-d array can each be the
+    lots of one container (pad with zero masses). Rows with no mass give nan.
+    :param masses - lot masses (any one unit)
+    :param degrees - lot temperatures (any one unit)
+    :param capacities - specific heat capacities, default all the same
+    """
+    weights = numpy.asarray(masses, dtype=numpy.float64)
+    if capacities is not None:
+        weights = weights * numpy.asarray(capacities, dtype=numpy.float64)
+    total = weights.sum(axis=axis)
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        return (weights * numpy.asarray(degrees, dtype=numpy.float64)).sum(axis=axis) / total
+
+
+def _mash_lots(container, temp_unit):
+    """Return masses (kg), temperatures (temp_unit) and heat capacities of
+    the wort ingredients in a container
+    """
+    ingredients = set(WORT_INGREDIENTS['liquid'] + WORT_INGREDIENTS['solid'])
+    ledger = container.ledger
+    if ledger is not None:
+        positions = ledger.live()
+        names = numpy.array(ledger.names, dtype=object)[ledger.content[positions]]
+        positions = positions[numpy.isin(names.astype(str), list(ingredients))]
+        kilograms = ledger.amount[positions] * UNITS.matrix[ledger.unit[positions], UNITS.code('kg')]
+        degrees = convert_temps(ledger.degrees[positions], ledger.temp_unit[positions], temp_unit)
+        types = [ ledger.content_types[code] for code in ledger.content_type[positions].tolist() ]
+        return (kilograms, degrees, heat_capacities(types))
+    lots = [ lot for lot in container._data['contents'] if lot['content'] in ingredients and float(lot['amount']) ]
+    kilograms = UNITS.convert_many([ float(lot['amount']) for lot in lots ], [ lot['unit'] for lot in lots ], 'kg')
+    degrees = convert_temps([ float(lot['temperature']['degrees']) for lot in lots ],
+                            [ lot['temperature']['unit'] for lot in lots ], temp_unit)
+    return (kilograms, degrees, heat_capacities([ lot['content_type'] for lot in lots ]))
+
+
+def mash_temperatures(containers, temp_unit='C'):
+    """Return the temperature the wort ingredients of each container settle
+    at, as one array, mixing all containers in a single call.
+    Containers without any wort ingredients give nan.
+    """
+    lots = [ _mash_lots(container, temp_unit) for container in containers ]
+    width = max([ len(kilograms) for (kilograms, degrees, capacities) in lots ] + [1])
+    masses = numpy.zeros((len(lots), width))
+    degrees = numpy.zeros((len(lots), width))
+    capacities = numpy.zeros((len(lots), width))
+    for (row, (lot_masses, lot_degrees, lot_capacities)) in enumerate(lots):
+        masses[row, :len(lot_masses)] = lot_masses
+        degrees[row, :len(lot_degrees)] = lot_degrees
+        capacities[row, :len(lot_capacities)] = lot_capacities
+    return mix_temperatures(masses, degrees, capacities)
@@ -0,0 +1,189 @@
+"""Rate limited transfers of contents between containers
+
+A Transfer streams the contents of one container into another through a
+valve, a time slice at a time. Each slice draws every content in
+proportion, so the mix in the destination is the mix in the source.
+Rubbish (RUBBISH_CONTENTS) does not flow and stays behind.
+
+A TransferEngine advances many transfers together. Rates, remaining
+volumes and destination room are arrays, and each slice is applied to
+the containers as one remove_many and one add_many.
+
+Synopsis:
+-----------
+
+from fattybrewing.container import transfer
+
+valve = transfer.Valve(2.5, 'cm')
+engine = transfer.TransferEngine()
+engine.add(transfer.Transfer(mash_tun, fermenter, valve=valve))
+for (now, moved) in engine.run(timedelta(minutes=1)):
+    pass
+
+"""
+
+from datetime import datetime, timedelta
+from decimal import Decimal
+import math
+
+import numpy
+
+from fattybrewing.container import ContainerError, RUBBISH_CONTENTS, convert_amount
+
+VALVE_OPENINGS = {'open': 1.0, 'partial': 0.5, 'closed': 0.0}
+
+
+class Valve(object):
+    """A valve between two containers: status (open/closed/partial) and diameter
+
+    The flow rate is the opening area times the flow velocity through it.
+    """
+
+    def __init__(self, diameter=1.0, diameter_unit='cm', status='open', velocity=1.0):
+        if status not in VALVE_OPENINGS:
+            raise ContainerError("Valve status must be one of %s" % (sorted(VALVE_OPENINGS)))
+        if diameter_unit not in ('cm', 'm', 'mm'):
+            raise ContainerError("Unable to use the valve diameter unit %s" % (diameter_unit))
+        self.diameter = diameter
+        self.diameter_unit = diameter_unit
+        self.status = status
+        self.velocity = velocity   # m/s
+
+    def flow_rate(self):
+        """Return the flow rate through the valve, l/hour"""
+        metres = self.diameter * {'cm': 0.01, 'm': 1.0, 'mm': 0.001}[self.diameter_unit]
+        area = math.pi * (metres / 2) ** 2
+        return area * self.velocity * VALVE_OPENINGS[self.status] * 1000 * 3600
+
+
+class Transfer(object):
+    """Moving the contents of source into destination at rate l/hour,
+    or at the flow rate of valve.
+    """
+
+    def __init__(self, source, destination, rate=None, valve=None, start=None):
+        if rate is None:
+            if valve is None:
+                raise ContainerError("A transfer needs a rate or a valve")
+            rate = valve.flow_rate()
+        self.source = source
+        self.destination = destination
+        self.rate = float(rate)
+        self.start = start or datetime.now()
+        self.elapsed = timedelta(0)
+        self.blocked = False
+        # content -> [amount left to move, unit], added up over the lots of the source
+        self.remaining = {}
+        self.garbage = []
+        for content in source.contents:
+            if not content.amount:
+                continue
+            if content.content.lower() in RUBBISH_CONTENTS:
+                self.garbage.append(content.content)
+                continue
+            if content.content in self.remaining:
+                left = self.remaining[content.content]
+                left[0] += convert_amount( (content.amount, content.unit), left[1])
+            else:
+                self.remaining[content.content] = [content.amount, content.unit]
+        self.remaining_litres = sum( float(convert_amount( (amount, unit), 'l')) for (amount, unit) in self.remaining.values() )
+        self.moved_litres = 0.0
+
+    @property
+    def done(self):
+        return self.blocked or not self.remaining
+
+    def room_litres(self):
+        """Return how much more the destination takes, in litres"""
+        destination = self.destination
+        room = destination.size.amount - destination.total_filled()[0]
+        return max(float(convert_amount( (room, destination.size.unit), 'l')), 0.0)
+
+    def move(self, litres, when=None):
+        """Move one slice of litres (all of it if at least remaining_litres),
+        no more than the destination takes. Filling the destination shuts
+        the valve.
+        :return the litres moved
+        """
+        litres = float(litres)
+        if self.done or litres <= 0:
+            return 0.0
+        room = self.room_litres()
+        if litres > room and room < self.remaining_litres * (1 - 1e-12):
+            litres = room
+            self.blocked = True
+            if litres <= 0:
+                return 0.0
+        if litres >= self.remaining_litres * (1 - 1e-12):
+            fraction = None
+            litres = self.remaining_litres
+        else:
+            fraction = Decimal(repr(litres / self.remaining_litres))
+        slice_amounts = []
+        for (content, left) in self.remaining.items():
+            amount = left[0] if fraction is None else left[0] * fraction
+            slice_amounts.append( (content, (amount, left[1])) )
+            left[0] -= amount
+        if fraction is None:
+            self.remaining = {}
+        removed = self.source.remove_many(slice_amounts)
+        self.remaining_litres -= litres
+        try:
+            self.destination.add_many(removed, when)
+        except ContainerError:
+            # Overflowed by rounding, only what went in was moved
+            self.blocked = True
+            litres = room
+        self.moved_litres += litres
+        return litres
+
+    def stream(self, step=timedelta(minutes=1)):
+        """Move the contents a time slice at a time.
+        Yields (elapsed time, litres moved in the slice) until done.
+        """
+        engine = TransferEngine(self.start + self.elapsed)
+        engine.add(self)
+        for (now, moved) in engine.run(step):
+            yield (self.elapsed, float(moved[0]))
+
+
+class TransferEngine(object):
+    """Advances many transfers a time slice at a time"""
+
+    def __init__(self, start=None):
+        self.now = start or datetime.now()
+        self.transfers = []
+
+    def add(self, transfer):
+        self.transfers.append(transfer)
+        return transfer
+
+    def active(self):
+        return [ t for t in self.transfers if not t.done ]
+
+    def tick(self, step):
+        """Advance every unfinished transfer by step (a timedelta)
+        :return an array of the litres each unfinished transfer moved
+        """
+        transfers = self.active()
+        hours = step.total_seconds() / 3600.0
+        rates = numpy.array([ t.rate for t in transfers ], dtype=numpy.float64)
+        remaining = numpy.array([ t.remaining_litres for t in transfers ], dtype=numpy.float64)
+        room = numpy.array([ t.room_litres() for t in transfers ], dtype=numpy.float64)
+        litres = numpy.minimum(numpy.minimum(rates * hours, remaining), room)
+        self.now += step
+        moved = numpy.zeros(len(transfers))
+        for (i, transfer) in enumerate(transfers):
+            if litres[i] > 0:
+                # Another transfer into the same destination may have used the room
+                moved[i] = transfer.move(min(litres[i], transfer.room_litres()), self.now)
+            elif remaining[i] > 0 and (room[i] <= 0 or rates[i] <= 0):
+                transfer.blocked = True
+            transfer.elapsed += step
+        return moved
+
+    def run(self, step):
+        """Tick until every transfer is done, yielding (time, litres moved) each tick"""
+        while self.active():
+            moved = self.tick(step)
+            yield (self.now, moved)
@@ -0,0 +1,204 @@
+"""CouchDB design documents and indexed queries for containers
+
+The containers design document holds the views below. CouchDB keeps
+them as indexes, so a query reads a key range of a view instead of
+every document in the database. Sizes and volumes are in litres, worked
+out from UNIT_SIZES (weights as the same volume of water).
+
+- by_type: key container_type, value the size; reduce counts
+- by_state: key [container_type, state, size], state one of 'empty',
+  'partial' or 'full'; reduce counts
+- by_content_type: one row per content type in a container (lots with
+  nothing left are not counted), key [content_type, container_type] and
+  value the volume of it; reduce sums, so grouped on the content type it
+  gives the total volume of each content type
+
+install creates the design document, or brings it up to date, and is
+safe to call every time the database is opened. The map functions are
+written in javascript, for CouchDB, and in Python, for an
+embedded.EmbeddedDatabase (or a CouchDB running couchpy). The query
+functions return Containers of the right class (see
+persistence.wrap_container).
+
+Synopsis:
+-----------
+
+from fattybrewing.container import views
+
+views.install(database)
+fermenter = views.find_empty(database, 'fermenter', min_size=(60, 'l'))
+kegs_of_beer = views.containers_holding(database, 'beer', container_type='keg')
+views.volume_by_content_type(database)['beer']
+
+"""
+
+import json
+import logging
+
+from couchdb.design import ViewDefinition
+
+from fattybrewing.container import UNIT_SIZES, convert_amount
+from fattybrewing.container.persistence import wrap_container
+
+LOGGER = logging.getLogger(__name__)
+
+DESIGN = 'containers'
+STATES = ('empty', 'partial', 'full')
+
+# Put at the start of every map function: only containers are mapped, and
+# the size and volume of each lot are found in litres
+_MAP_PREAMBLE = {'javascript': """function(doc) {
+  if (!doc.container_type || !doc.size) return;
+  var UNIT_SIZES = %s;
+  function litres(amount) {
+    return parseFloat(amount.amount) * (UNIT_SIZES[amount.unit] || UNIT_SIZES[(amount.unit || '').toLowerCase()] || 0);
+  }
+  var size = litres(doc.size);
+  var lots = doc.contents || [];
+""" % (json.dumps(UNIT_SIZES, sort_keys=True)),
+                 'python': """def map(doc):
+    if not doc.get('container_type') or not doc.get('size'):
+        return
+    UNIT_SIZES = %s
+    def litres(amount):
+        unit = amount.get('unit') or ''
+        return float(amount['amount']) * UNIT_SIZES.get(unit, UNIT_SIZES.get(unit.lower(), 0))
+    size = litres(doc['size'])
+    lots = doc.get('contents') or []
+""" % (json.dumps(UNIT_SIZES, sort_keys=True)),
+                 }
+_MAP_END = {'javascript': "}\n", 'python': ""}
+
+# name -> (the rest of the map function in each language, the reduce function)
+_VIEW_CODE = {
+    'by_type': ({'javascript': """
+  emit(doc.container_type, size);
+""", 'python': """
+    yield doc['container_type'], size
+"""}, '_count'),
+    'by_state': ({'javascript': """
+  var filled = 0;
+  for (var i = 0; i < lots.length; i++) {
+    filled += parseFloat(lots[i].amount);
+  }
+  var state = doc.full ? 'full' : (filled > 0 ? 'partial' : 'empty');
+  emit([doc.container_type, state, size], null);
+""", 'python': """
+    filled = sum(float(lot['amount']) for lot in lots)
+    state = 'full' if doc.get('full') else ('partial' if filled > 0 else 'empty')
+    yield [doc['container_type'], state, size], None
+"""}, '_count'),
+    'by_content_type': ({'javascript': """
+  var volumes = {};
+  for (var i = 0; i < lots.length; i++) {
+    var volume = litres(lots[i]);
+    if (volume > 0) {
+      var content_type = lots[i].content_type || lots[i].content;
+      volumes[content_type] = (volumes[content_type] || 0) + volume;
+    }
+  }
+  for (var content_type in volumes) {
+    emit([content_type, doc.container_type], volumes[content_type]);
+  }
+""", 'python': """
+    volumes = {}
+    for lot in lots:
+        volume = litres(lot)
+        if volume > 0:
+            content_type = lot.get('content_type') or lot['content']
+            volumes[content_type] = volumes.get(content_type, 0) + volume
+    for (content_type, volume) in volumes.items():
+        yield [content_type, doc['container_type']], volume
+"""}, '_sum'),
+    }
+
+
+def view_definitions(language='javascript'):
+    """Return the ViewDefinitions of the design document, with the map
+    functions in language, 'javascript' or 'python'
+    """
+    return tuple( ViewDefinition(DESIGN, name, _MAP_PREAMBLE[language] + code[language] + _MAP_END[language],
+                                 reduce_fun=reduce_fun, language=language)
+                  for (name, (code, reduce_fun)) in sorted(_VIEW_CODE.items()) )
+
+
+VIEWS = view_definitions('javascript')
+PYTHON_VIEWS = view_definitions('python')
+(BY_CONTENT_TYPE, BY_STATE, BY_TYPE) = VIEWS
+
+
+def install(database, language=None):
+    """Create or update the containers design document in database. The
+    views are in javascript, unless language or the database's
+    view_language (see embedded.EmbeddedDatabase) says otherwise.
+    :return whether it had to be written
+    """
+    language = language or getattr(database, 'view_language', 'javascript')
+    results = ViewDefinition.sync_many(database, view_definitions(language), remove_missing=True)
+    for (success, id, rev_or_error) in results:
+        if not success:
+            raise rev_or_error
+        LOGGER.info("Stored the design document %s, revision %s", id, rev_or_error)
+    return bool(results)
+
+
+def _containers(view, database, **options):
+    return [ wrap_container(row.doc) for row in view(database, include_docs=True, reduce=False, **options) ]
+
+
+def _litres(size):
+    """size is a number of litres or an (amount, unit) tuple"""
+    if isinstance(size, tuple):
+        return float(convert_amount(size, 'l'))
+    return float(size)
+
+
+def containers_of_type(database, container_type):
+    """Return the containers of container_type, e.g. 'fermenter'"""
+    return _containers(BY_TYPE, database, key=container_type)
+
+
+def containers_in_state(database, container_type, state, min_size=None, max_size=None, limit=None):
+    """Return the containers of container_type in state (one of STATES),
+    smallest first, optionally only those with a size from min_size to
+    max_size (litres, or (amount, unit) tuples)
+    """
+    if state not in STATES:
+        raise ValueError("state must be one of %s, not %r" % (", ".join(STATES), state))
+    startkey = [container_type, state] + ([_litres(min_size)] if min_size is not None else [])
+    endkey = [container_type, state, _litres(max_size) if max_size is not None else {}]
+    options = dict(startkey=startkey, endkey=endkey)
+    if limit is not None:
+        options['limit'] = limit
+    return _containers(BY_STATE, database, **options)
+
+
+def find_empty(database, container_type, min_size=None):
+    """Return the smallest empty container of container_type at least
+    min_size big, or None if there is none
+    """
+    found = containers_in_state(database, container_type, 'empty', min_size=min_size, limit=1)
+    return found[0] if found else None
+
+
+def containers_holding(database, content_type, container_type=None):
+    """Return the containers with some of content_type in them, of any type
+    or only container_type
+    """
+    if container_type is not None:
+        return _containers(BY_CONTENT_TYPE, database, key=[content_type, container_type])
+    return _containers(BY_CONTENT_TYPE, database, startkey=[content_type], endkey=[content_type, {}])
+
+
+def volume_by_content_type(database):
+    """Return the litres of each content type over all the containers"""
+    return dict( (row.key[0], row.value) for row in BY_CONTENT_TYPE(database, group_level=1) )
+
+
+def count_by_state(database, container_type):
+    """Return the number of containers of container_type in each state"""
+    counts = dict.fromkeys(STATES, 0)
+    rows = BY_STATE(database, startkey=[container_type], endkey=[container_type, {}], group_level=2)
+    for row in rows:
+        counts[row.key[1]] = row.value
+    return counts
@@ -2,7 +2,9 @@ import unittest
 
 import container
 import os
+import shutil
 import sqlite3
+import tempfile
 
 class TestContainerMethods(unittest.TestCase):
     
@@ -333,6 +335,164 @@ class TestLiquidReservoirMethods(unittest.TestCase):
         dbconn.close()
 
 
+def make_database(dbfile):
+    """Make dbfile as install.py does, with the schema and the migrations"""
+    install_dir=os.path.join(os.path.dirname(os.path.realpath(__file__)),"..","install")
+    sql_files=[os.path.join(install_dir,"fattybrewery-schema.sql")]
+    sql_files+=sorted(os.path.join(install_dir,"migrations",f) for f in os.listdir(os.path.join(install_dir,"migrations")))
+    dbconn=sqlite3.connect(dbfile)
+    for sql_file in sql_files:
+        with open(sql_file) as sfh:
+            dbconn.executescript(sfh.read())
+    dbconn.close()
+
+
+class TestStoreMany(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir=tempfile.mkdtemp()
+        self.dbfile=os.path.join(self.tmpdir,"fattybrew-test.db3")
+        make_database(self.dbfile)
+
+    def test_store_many(self):
+        vessels=[]
+        for i in range(10000):
+            vessel_class=(container.Fermenter,container.MashTun,container.LiquidReservoir,container.BrewContainer)[i%4]
+            vessels.append(vessel_class(name="vessel {0}".format(i),total_volume=100))
+        vessels[0].store(self.dbfile)
+        container.store_many(vessels,self.dbfile)
+
+        self.assertEqual(len(set(v.bcid for v in vessels)),10000)
+        dbconn=container.connections.connect(self.dbfile)
+        self.assertEqual(dbconn.execute("""PRAGMA journal_mode""").fetchone()[0],"wal")
+        c=dbconn.execute("""SELECT containers.id,name FROM containers JOIN fermenters ON fermenters.container=containers.id ORDER BY containers.id""")
+        self.assertEqual([(r["id"],r["name"]) for r in c],[(v.bcid,v.name) for v in vessels[::4]])
+        for table in ("mash_tuns","liquid_reservoirs"):
+            self.assertEqual(dbconn.execute("""SELECT count(*) FROM {0}""".format(table)).fetchone()[0],2500)
+
+        vessels[5].current_volume=40
+        container.store_many(vessels[5:6],self.dbfile)
+        c=dbconn.execute("""SELECT current_volume FROM containers WHERE id=?""",(vessels[5].bcid,))
+        self.assertEqual(c.fetchone()[0],40)
+
+    def test_rolled_back(self):
+        vessels=[container.Fermenter(name="same name"),container.Fermenter(name="same name")]
+        self.assertRaises(sqlite3.IntegrityError,container.store_many,vessels,self.dbfile)
+        dbconn=container.connections.connect(self.dbfile)
+        self.assertEqual(dbconn.execute("""SELECT count(*) FROM fermenters""").fetchone()[0],0)
+
+    def tearDown(self):
+        container.connections.close(self.dbfile)
+        shutil.rmtree(self.tmpdir)
+
+
+class TestSearch(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir=tempfile.mkdtemp()
+        self.dbfile=os.path.join(self.tmpdir,"fattybrew-test.db3")
+        make_database(self.dbfile)
+        vessels=[]
+        for i in range(2000):
+            vessel_class=(container.Fermenter,container.MashTun,container.LiquidReservoir)[i%3]
+            vessels.append(vessel_class(name="{0} {1}".format(vessel_class.__name__.lower(),i),total_volume=50+i%10*10,current_temperature=15+i%5,clean=(i%2 == 0)))
+        vessels.append(container.BrewContainer(name="100%_tank"))
+        container.store_many(vessels,self.dbfile)
+
+    def test_exact(self):
+        found=container.find_container("fermenter 300",self.dbfile)
+        self.assertTrue(isinstance(found,container.Fermenter))
+        self.assertEqual((found.name,found.total_volume,found.current_temperature,found.clean),("fermenter 300",50,15,True))
+        self.assertTrue(container.find_container("fermenter 301",self.dbfile) is None)
+        self.assertEqual(container.find_container("100%_tank",self.dbfile).name,"100%_tank")
+
+    def test_prefix_and_substring(self):
+        found=container.search_containers("MashTun 100",dbfile=self.dbfile)
+        self.assertEqual([c.name for c in found],["mashtun 100","mashtun 1000","mashtun 1003","mashtun 1006","mashtun 1009"])
+        self.assertTrue(all(isinstance(c,container.MashTun) for c in found))
+        found=container.search_containers("n 19",match="substring",min_volume=130,clean=True,dbfile=self.dbfile)
+        self.assertEqual([c.name for c in found],["mashtun 1918","mashtun 1948","mashtun 1978"])
+        self.assertEqual([c.name for c in container.search_containers("0%_",match="substring",dbfile=self.dbfile)],["100%_tank"])
+        self.assertEqual(len(container.search_containers("fermenter",max_temperature=15,limit=5,dbfile=self.dbfile)),5)
+
+    def test_fuzzy(self):
+        found=container.search_containers("fermentr 42",match="fuzzy",limit=3,dbfile=self.dbfile)
+        self.assertEqual(found[0].name,"fermenter 42")
+        self.assertEqual(container.search_containers("xyzzy",match="fuzzy",dbfile=self.dbfile),[])
+
+    def test_renamed(self):
+        vessel=container.find_container("fermenter 42",self.dbfile)
+        vessel.name="bright tank 1"
+        vessel.store(self.dbfile)
+        self.assertEqual([c.bcid for c in container.search_containers("bright",dbfile=self.dbfile)],[vessel.bcid])
+        self.assertTrue(container.find_container("fermenter 42",self.dbfile) is None)
+        self.assertEqual([c.name for c in container.search_containers("fermenter 42",dbfile=self.dbfile)],["fermenter 420","fermenter 423","fermenter 426","fermenter 429"])
+
+    def test_lookups_use_indexes(self):
+        dbconn=sqlite3.connect(self.dbfile)
+        for (condition,parameter) in (("exact","fermenter 300"),("pattern","fermenter 30%")):
+            sql=container.SELECT_CONTAINERS_SQL+" WHERE "+container.NAME_CONDITIONS[condition]
+            plan=[ r[3] for r in dbconn.execute("EXPLAIN QUERY PLAN "+sql,(parameter,)) ]
+            self.assertFalse([ step for step in plan if step.split()[:2] == ["SCAN","containers"] ],plan)
+            self.assertTrue([ step for step in plan if step.startswith("SEARCH containers USING") ],plan)
+            if condition == "pattern":
+                ## The LIKE is handed to the trigram index rather than checked row by row
+                self.assertTrue([ step for step in plan if step.startswith("SCAN containers_search VIRTUAL TABLE INDEX") and ":L" in step ],plan)
+        dbconn.close()
+
+    def tearDown(self):
+        container.connections.close(self.dbfile)
+        shutil.rmtree(self.tmpdir)
+
+
+class TestEquipmentData(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir=tempfile.mkdtemp()
+        self.dbfile=os.path.join(self.tmpdir,"fattybrew-test.db3")
+        make_database(self.dbfile)
+        self.vessels=[container.Fermenter(name="fermenter {0}".format(i)) for i in range(1200)]
+        container.store_many(self.vessels,self.dbfile)
+        dbconn=sqlite3.connect(self.dbfile)
+        dbconn.execute("""INSERT INTO valves (id,valve_name,valve_status) VALUES (1,'fermenter 0 in','open'),(2,'fermenter 0 out','closed')""")
+        dbconn.execute("""INSERT INTO containers_valves_join (container,valve,cont_valve_relationship) VALUES (?,1,'into_container'),(?,2,'out_of_container')""",(self.vessels[0].bcid,self.vessels[0].bcid))
+        dbconn.commit()
+        dbconn.close()
+
+    def test_identity(self):
+        with container.EquipmentData(self.dbfile) as equipment:
+            ids=[v.bcid for v in self.vessels]
+            loaded=equipment.get_many(ids)
+            self.assertEqual([v.name for v in loaded],[v.name for v in self.vessels])
+            self.assertTrue(all(isinstance(v,container.Fermenter) for v in loaded))
+            self.assertTrue(equipment.get(ids[5]) is loaded[5])
+            self.assertTrue(equipment.find("fermenter 5",match="exact")[0] is loaded[5])
+            self.assertEqual([v["name"] for v in loaded[0].valves],["fermenter 0 in","fermenter 0 out"])
+            self.assertEqual(loaded[0].valves[1]["relationship"],"out_of_container")
+            self.assertEqual(loaded[1].valves,[])
+            self.assertTrue(equipment.get(-1) is None)
+
+    def test_commit_changed(self):
+        with container.EquipmentData(self.dbfile) as equipment:
+            loaded=equipment.find("fermenter 1")
+            self.assertEqual(equipment.dirty(),[])
+            loaded[0].clean=True
+            new=container.MashTun(name="new mash tun")
+            equipment.add(new)
+            self.assertEqual(equipment.commit(),2)
+            self.assertTrue(new.bcid in equipment)
+            self.assertEqual(equipment.dirty(),[])
+            self.assertEqual(equipment.commit(),0)
+
+        with container.EquipmentData(self.dbfile) as equipment:
+            self.assertTrue(equipment.get(loaded[0].bcid).clean)
+            self.assertTrue(isinstance(equipment.find("new mash tun",match="exact")[0],container.MashTun))
+
+    def tearDown(self):
+        container.connections.close(self.dbfile)
+        shutil.rmtree(self.tmpdir)
+
+
 if __name__=='__main__':
     unittest.main()
 
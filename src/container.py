@@ -6,6 +6,9 @@ import sqlite3
 import os
 import re
 import datetime
+import contextlib
+import difflib
+import threading
 
 class OverflowError(Exception):
     def __init__(self,message,errors):
@@ -19,6 +22,9 @@ class BrewContainer:
     """ A class for handling brew containers
 
 """
+    ## Table of the rows that make a container one of the subtypes
+    subtype_table=None
+
     def __init__(self,name='',total_volume=1,total_volume_units='unit-volume',current_volume=0,current_volume_units='unit-volume',target_temperature=1,target_temperature_units='unit-temperature',current_temperature=1,current_temperature_units="unit-temperature",clean=False,id=None):
         self.total_volume=total_volume
         self.total_volume_units=total_volume_units
@@ -35,6 +41,7 @@ class BrewContainer:
             "liquids": {},
             "solids": {}
             }
+        self.valves=[] ## Valves into and out of the container, see EquipmentData
 
     def add_ingredient(self,amount,units,ingredient,fill_time=None):
         """ Adds a SOLID ingredient into the container. Does NOT consider volume """
@@ -101,198 +108,350 @@ class BrewContainer:
     def store(self,dbfile=None):
         """Store the container into the given database"""
 
-        if not os.path.isdir(os.path.dirname(dbfile)):
-            raise OSError("Unable to save DB to file '{0}'".format(dbfile))
-            
-        if not os.path.isfile(dbfile):
-           raise OSError("Unable to save DB to file '{0}'".format(dbfile)) 
-        
+        with connections.transaction(dbfile) as dbconn:
+            self._store(dbconn)
 
-        dbconn=sqlite3.connect(dbfile)
-        dbconn.row_factory=sqlite3.Row
-        ### Check if value is already stored
-
-        ## Ifthe ID exists, assume it exists. Otherwise, assume a new record should be inserted
+    def _store(self,dbconn):
+        ## If the ID exists, assume it exists. Otherwise, assume a new record should be inserted
         if not self.bcid:
-
-            c=dbconn.execute("""INSERT INTO containers (name,total_volume,total_volume_units,current_volume,current_volume_units,target_temperature,target_temperature_units,current_temperature,current_temperature_units,clean) VALUES (?,?,?,?,?,?,?,?,?,?)""",(self.name,self.total_volume,self.total_volume_units,self.current_volume,self.current_volume_units,self.target_temperature,self.target_temperature_units,self.current_temperature,self.current_temperature_units,self.clean))
-            c=dbconn.execute("""SELECT max(id) FROM containers""")
-            self.bcid=c.fetchone()[0]
-
+            c=dbconn.execute(INSERT_CONTAINER_SQL,self._row())
+            self.bcid=c.lastrowid
+            if self.subtype_table:
+                dbconn.execute(INSERT_SUBTYPE_SQL[self.subtype_table],(self.bcid,))
         else:
-            c=dbconn.execute("""UPDATE containers SET name=?,total_volume=?,total_volume_units=?,current_volume=?,current_volume_units=?,target_temperature=?,target_temperature_units=?,current_temperature=?,current_temperature_units=?,clean WHERE id = ?""",(self.name,self.total_volume,self.total_volume_units,self.current_volume,self.current_volume_units,self.target_temperature,self.target_temperature_units,self.current_temperature,self.current_temperature_units,self.clean,self,bcid))
+            dbconn.execute(UPDATE_CONTAINER_SQL,self._row()+(self.bcid,))
 
-            
-
-    
-        dbconn.commit()
-        dbconn.close()
+    def _row(self):
+        return (self.name,self.total_volume,self.total_volume_units,self.current_volume,self.current_volume_units,self.target_temperature,self.target_temperature_units,self.current_temperature,self.current_temperature_units,self.clean)
 
 
 class Fermenter(BrewContainer):
-    
-    def store(self,dbfile):
-        dbconn=sqlite3.connect(dbfile)
-
-        dbconn.row_factory=sqlite3.Row
-        ### Check if value is already stored
-
-        ## Ifthe ID exists, assume it exists. Otherwise, assume a new record should be inserted
-        if not self.bcid:
-
-            c=dbconn.execute("""INSERT INTO containers (name,total_volume,total_volume_units,current_volume,current_volume_units,target_temperature,target_temperature_units,current_temperature,current_temperature_units,clean) VALUES (?,?,?,?,?,?,?,?,?,?)""",(self.name,self.total_volume,self.total_volume_units,self.current_volume,self.current_volume_units,self.target_temperature,self.target_temperature_units,self.current_temperature,self.current_temperature_units,self.clean))
-            c=dbconn.execute("""SELECT max(id) FROM containers""")
-            rowid=c.fetchone()[0]
-            self.bcid=rowid
-            c=dbconn.execute("""INSERT INTO fermenters (container) VALUES (?)""",(rowid,))            
-
-        else:
-            c=dbconn.execute("""UPDATE containers SET name=?,total_volume=?,total_volume_units=?,current_volume=?,current_volume_units=?,target_temperature=?,target_temperature_units=?,current_temperature=?,current_temperature_units=?,clean WHERE id = ?""",(self.name,self.total_volume,self.total_volume_units,self.current_volume,self.current_volume_units,self.target_temperature,self.target_temperature_units,self.current_temperature,self.current_temperature_units,self.clean,self,bcid))
-    
-        dbconn.commit()
-        dbconn.close()
+    subtype_table="fermenters"
 
 
 class MashTun(BrewContainer):
-    def store(self,dbfile):
-        dbconn=sqlite3.connect(dbfile)
-
-        dbconn.row_factory=sqlite3.Row
-        ### Check if value is already stored
-
-        ## Ifthe ID exists, assume it exists. Otherwise, assume a new record should be inserted
-        if not self.bcid:
-
-            c=dbconn.execute("""INSERT INTO containers (name,total_volume,total_volume_units,current_volume,current_volume_units,target_temperature,target_temperature_units,current_temperature,current_temperature_units,clean) VALUES (?,?,?,?,?,?,?,?,?,?)""",(self.name,self.total_volume,self.total_volume_units,self.current_volume,self.current_volume_units,self.target_temperature,self.target_temperature_units,self.current_temperature,self.current_temperature_units,self.clean))
-            c=dbconn.execute("""SELECT max(id) FROM containers""")
-            rowid=c.fetchone()[0]
-            self.bcid=rowid
-            c=dbconn.execute("""INSERT INTO mash_tuns (container) VALUES (?)""",(rowid,))
-
-            
-
-        else:
-            c=dbconn.execute("""UPDATE containers SET name=?,total_volume=?,total_volume_units=?,current_volume=?,current_volume_units=?,target_temperature=?,target_temperature_units=?,current_temperature=?,current_temperature_units=?,clean WHERE id = ?""",(self.name,self.total_volume,self.total_volume_units,self.current_volume,self.current_volume_units,self.target_temperature,self.target_temperature_units,self.current_temperature,self.current_temperature_units,self.clean,self,bcid))
-
-        dbconn.commit()
-        dbconn.close()
-
-
+    subtype_table="mash_tuns"
 
 
 class LiquidReservoir(BrewContainer):
-    def store(self,dbfile):
-        dbconn=sqlite3.connect(dbfile)
-
-        dbconn.row_factory=sqlite3.Row
-        ### Check if value is already stored
-
-        ## Ifthe ID exists, assume it exists. Otherwise, assume a new record should be inserted
-        if not self.bcid:
-
-            c=dbconn.execute("""INSERT INTO containers (name,total_volume,total_volume_units,current_volume,current_volume_units,target_temperature,target_temperature_units,current_temperature,current_temperature_units,clean) VALUES (?,?,?,?,?,?,?,?,?,?)""",(self.name,self.total_volume,self.total_volume_units,self.current_volume,self.current_volume_units,self.target_temperature,self.target_temperature_units,self.current_temperature,self.current_temperature_units,self.clean))
-            c=dbconn.execute("""SELECT max(id) FROM containers""")
-            rowid=c.fetchone()[0]
-            self.bcid=rowid
-            c=dbconn.execute("""INSERT INTO liquid_reservoirs (container) VALUES (?)""",(self.bcid,))
-
-            
-
-        else:
-            c=dbconn.execute("""UPDATE containers SET name=?,total_volume=?,total_volume_units=?,current_volume=?,current_volume_units=?,target_temperature=?,target_temperature_units=?,current_temperature=?,current_temperature_units=?,clean WHERE id = ?""",(self.name,self.total_volume,self.total_volume_units,self.current_volume,self.current_volume_units,self.target_temperature,self.target_temperature_units,self.current_temperature,self.current_temperature_units,self.clean,self,bcid))
-    
-        dbconn.commit()
-        dbconn.close()
-
-
-class MashTun(BrewContainer):
-    def store(self,dbfile):
-        dbconn=sqlite3.connect(dbfile)
-        dbconn.row_factory=sqlite3.Row
-        ### Check if value is already stored
-
-        ## Ifthe ID exists, assume it exists. Otherwise, assume a new record should be inserted
-        if not self.bcid:
-            #print("Inserting a mash tun container with name {0}".format(self.name))
-            c=dbconn.execute("""INSERT INTO containers (name,total_volume,total_volume_units,current_volume,current_volume_units,target_temperature,target_temperature_units,current_temperature,current_temperature_units,clean) VALUES (?,?,?,?,?,?,?,?,?,?)""",(self.name,self.total_volume,self.total_volume_units,self.current_volume,self.current_volume_units,self.target_temperature,self.target_temperature_units,self.current_temperature,self.current_temperature_units,self.clean))
-            if not c.rowcount:
-                raise Exception("unable to insert a new row")
-            
-            c=dbconn.execute("""SELECT max(id) FROM containers""")
-            rowid=c.fetchone()[0]
-            self.bcid=rowid
-            #print("Inserting a real mash tun for id",rowid)
-            c=dbconn.execute("""INSERT INTO mash_tuns (container) VALUES (?)""",(self.bcid,))
-            
-            
-
-        else:
-            c=dbconn.execute("""UPDATE containers SET name=?,total_volume=?,total_volume_units=?,current_volume=?,current_volume_units=?,target_temperature=?,target_temperature_units=?,current_temperature=?,current_temperature_units=?,clean WHERE id = ?""",(self.name,self.total_volume,self.total_volume_units,self.current_volume,self.current_volume_units,self.target_temperature,self.target_temperature_units,self.current_temperature,self.current_temperature_units,self.clean,self,bcid))
-
-        dbconn.commit()
-        dbconn.close()
+    subtype_table="liquid_reservoirs"
+
+
+CONTAINER_COLUMNS="name,total_volume,total_volume_units,current_volume,current_volume_units,target_temperature,target_temperature_units,current_temperature,current_temperature_units,clean"
+INSERT_CONTAINER_SQL="""INSERT INTO containers ({0}) VALUES (?,?,?,?,?,?,?,?,?,?)""".format(CONTAINER_COLUMNS)
+INSERT_CONTAINER_WITH_ID_SQL="""INSERT INTO containers (id,{0}) VALUES (?,?,?,?,?,?,?,?,?,?,?)""".format(CONTAINER_COLUMNS)
+UPDATE_CONTAINER_SQL="""UPDATE containers SET {0} WHERE id = ?""".format(",".join("{0}=?".format(column) for column in CONTAINER_COLUMNS.split(",")))
+INSERT_SUBTYPE_SQL=dict((table,"""INSERT INTO {0} (container) VALUES (?)""".format(table)) for table in ("fermenters","mash_tuns","liquid_reservoirs"))
+
+
+class ConnectionManager:
+    """Shared sqlite3 connections, one per database file and thread.
+
+    Connections are opened once, in WAL mode with synchronous=NORMAL, so a
+    commit does not wait on a full fsync, and keep up to cached_statements
+    prepared statements (sqlite3 looks them up by the SQL text, so the
+    module's statements are kept in the *_SQL constants). They are in
+    autocommit mode: use transaction() to group statements.
+    """
+    def __init__(self,cached_statements=256,busy_timeout=20000):
+        self.cached_statements=cached_statements
+        self.busy_timeout=busy_timeout
+        self._local=threading.local()
+
+    def connect(self,dbfile=None):
+        """Return this thread's connection to dbfile, opening it if needed"""
+        open_connections=self._connections()
+        if dbfile not in open_connections:
+            dbconn=sqlite3.connect(self._path(dbfile),isolation_level=None,cached_statements=self.cached_statements)
+            dbconn.row_factory=sqlite3.Row
+            dbconn.execute("PRAGMA journal_mode=WAL")
+            dbconn.execute("PRAGMA synchronous=NORMAL")
+            dbconn.execute("PRAGMA busy_timeout={0}".format(int(self.busy_timeout)))
+            open_connections[dbfile]=dbconn
+        return open_connections[dbfile]
+
+    @contextlib.contextmanager
+    def transaction(self,dbfile=None):
+        """Run the statements of the with block in one write transaction,
+        committed at the end of the block or rolled back on an exception"""
+        dbconn=self.connect(dbfile)
+        dbconn.execute("BEGIN IMMEDIATE")
+        try:
+            yield dbconn
+        except BaseException:
+            dbconn.execute("ROLLBACK")
+            raise
+        dbconn.execute("COMMIT")
+
+    def close(self,dbfile=None):
+        """Close this thread's connection to dbfile, or all of them"""
+        open_connections=self._connections()
+        for key in ([dbfile] if dbfile else list(open_connections)):
+            dbconn=open_connections.pop(key,None)
+            if dbconn is not None:
+                dbconn.close()
+
+    def _connections(self):
+        if not hasattr(self._local,"connections"):
+            self._local.connections={}
+        return self._local.connections
+
+    def _path(self,dbfile):
+        if not dbfile:
+            dbfile=os.path.join(os.environ["FATTYBREWHOME"],"var","fattybrew.db")
+        if not os.path.isfile(dbfile):
+            raise OSError("Unable to save DB to file '{0}'".format(dbfile))
+        return dbfile
+
+
+connections=ConnectionManager()
+
+
+def store_many(containers,dbfile=None):
+    """Store many containers in one transaction. New containers are given
+    ids together, then inserted with their mash_tuns, fermenters or
+    liquid_reservoirs rows by executemany; stored ones are updated."""
+
+    new=[c for c in containers if not c.bcid]
+    stored=[c for c in containers if c.bcid]
+    with connections.transaction(dbfile) as dbconn:
+        if new:
+            ## The write lock is held from BEGIN IMMEDIATE, so the ids after max(id) stay free
+            first_id=dbconn.execute("""SELECT coalesce(max(id),0)+1 FROM containers""").fetchone()[0]
+            dbconn.executemany(INSERT_CONTAINER_WITH_ID_SQL,((first_id+i,)+c._row() for (i,c) in enumerate(new)))
+            for (i,c) in enumerate(new):
+                c.bcid=first_id+i
+            for table in INSERT_SUBTYPE_SQL:
+                dbconn.executemany(INSERT_SUBTYPE_SQL[table],((c.bcid,) for c in new if c.subtype_table == table))
+        if stored:
+            dbconn.executemany(UPDATE_CONTAINER_SQL,(c._row()+(c.bcid,) for c in stored))
+
+
+SELECT_CONTAINERS_SQL="""SELECT containers.id,{0},
+EXISTS (SELECT 1 FROM fermenters WHERE fermenters.container=containers.id) AS fermenter,
+EXISTS (SELECT 1 FROM mash_tuns WHERE mash_tuns.container=containers.id) AS mash_tun,
+EXISTS (SELECT 1 FROM liquid_reservoirs WHERE liquid_reservoirs.container=containers.id) AS liquid_reservoir
+FROM containers""".format(CONTAINER_COLUMNS)
+## Name lookups: an exact name through the UNIQUE index on containers.name,
+## patterns and trigram matches through the containers_search FTS5 index
+## (install/migrations/002-container-search.sql)
+NAME_CONDITIONS={"exact": """containers.name = ?""",
+                 "pattern": """containers.id IN (SELECT rowid FROM containers_search WHERE containers_search.name LIKE ?)""",
+                 "escaped": """containers.id IN (SELECT rowid FROM containers_search WHERE containers_search.name LIKE ? ESCAPE '\\')""",
+                 "fuzzy": """containers.id IN (SELECT rowid FROM containers_search WHERE containers_search MATCH ? ORDER BY rank LIMIT ?)""",
+                 }
+MATCH_TYPES=("exact","prefix","substring","fuzzy")
+## Trigram matches looked at for each fuzzy result wanted
+FUZZY_CANDIDATES=20
+
+
+def search_containers(name=None,match="prefix",min_volume=None,max_volume=None,min_temperature=None,max_temperature=None,clean=None,limit=None,cutoff=0.6,dbfile=None):
+    """Return the containers matching all of the given conditions, as
+    BrewContainer, Fermenter, MashTun or LiquidReservoir objects.
+
+    name is looked up by match: "exact", "prefix", "substring" (both case
+    insensitive) or "fuzzy", for names within cutoff of it (difflib's
+    ratio), best match first. Otherwise containers come in name order.
+    min_volume and max_volume bound total_volume, min_temperature and
+    max_temperature current_temperature, in the units they are stored in.
+    clean, if given, is True or False.
+    """
+    return hydrate(_find_rows(name,match,min_volume,max_volume,min_temperature,max_temperature,clean,limit,cutoff,dbfile))
+
+
+def _find_rows(name,match,min_volume,max_volume,min_temperature,max_temperature,clean,limit,cutoff,dbfile):
+    """Return the rows of SELECT_CONTAINERS_SQL for search_containers"""
+    if match not in MATCH_TYPES:
+        raise ValueError("match must be one of {0}, not {1!r}".format(", ".join(MATCH_TYPES),match))
+    conditions=[]
+    parameters=[]
+    if name is not None and match == "fuzzy":
+        trigrams=set(name.lower()[i:i+3] for i in range(len(name)-2))
+        if not trigrams:
+            return []
+        conditions.append(NAME_CONDITIONS["fuzzy"])
+        parameters.extend([" OR ".join('"{0}"'.format(t.replace('"','""')) for t in sorted(trigrams)),FUZZY_CANDIDATES*(limit or 10)])
+    elif name is not None and match == "exact":
+        conditions.append(NAME_CONDITIONS["exact"])
+        parameters.append(name)
+    elif name is not None:
+        wildcards=("%" in name or "_" in name or "\\" in name)
+        pattern=re.sub(r"([%_\\])",r"\\\1",name) if wildcards else name
+        pattern=pattern+"%" if match == "prefix" else "%"+pattern+"%"
+        conditions.append(NAME_CONDITIONS["escaped" if wildcards else "pattern"])
+        parameters.append(pattern)
+    for (condition,value) in (("total_volume >= ?",min_volume),("total_volume <= ?",max_volume),
+                              ("current_temperature >= ?",min_temperature),("current_temperature <= ?",max_temperature)):
+        if value is not None:
+            conditions.append(condition)
+            parameters.append(value)
+    if clean is not None:
+        conditions.append("clean = ?")
+        parameters.append(1 if clean else 0)
+
+    sql=SELECT_CONTAINERS_SQL
+    if conditions:
+        sql+=" WHERE "+" AND ".join(conditions)
+    if match != "fuzzy" or name is None:
+        sql+=" ORDER BY containers.name"
+        if limit is not None:
+            sql+=" LIMIT ?"
+            parameters.append(limit)
+    rows=connections.connect(dbfile).execute(sql,parameters).fetchall()
+    if match == "fuzzy" and name is not None:
+        scored=[(difflib.SequenceMatcher(None,name.lower(),r["name"].lower()).ratio(),r) for r in rows]
+        rows=[r for (score,r) in sorted(scored,key=lambda scored_row: -scored_row[0]) if score >= cutoff][:limit]
+    return rows
+
+
+def hydrate(rows):
+    """Return containers of the right class for rows of SELECT_CONTAINERS_SQL"""
+    return [_hydrate_row(r) for r in rows]
+
+
+def _hydrate_row(r):
+    if r["fermenter"]:
+        container_class=Fermenter
+    elif r["mash_tun"]:
+        container_class=MashTun
+    elif r["liquid_reservoir"]:
+        container_class=LiquidReservoir
+    else:
+        container_class=BrewContainer
+    return container_class(name=r["name"],total_volume=r["total_volume"],total_volume_units=r["total_volume_units"],
+                           current_volume=r["current_volume"],current_volume_units=r["current_volume_units"],
+                           target_temperature=r["target_temperature"],target_temperature_units=r["target_temperature_units"],
+                           current_temperature=r["current_temperature"],current_temperature_units=r["current_temperature_units"],
+                           clean=bool(r["clean"]),id=r["id"])
+
+
+def find_container(name,dbfile=None):
+    """ Return the container called name, or None if there is none"""
+    found=search_containers(name,match="exact",dbfile=dbfile)
+    return found[0] if found else None
+
+
+SELECT_VALVES_SQL="""SELECT containers_valves_join.container,valves.id,valve_name,valve_type,valve_status,valve_diameter,valve_diameter_units,cont_valve_relationship
+FROM containers_valves_join JOIN valves ON valves.id=containers_valves_join.valve
+WHERE containers_valves_join.container IN ({0}) ORDER BY containers_valves_join.container,valves.id"""
+## Most ids put in one IN (...) list, under SQLite's oldest limit of 999 parameters
+ID_BATCH_SIZE=500
 
 
 class EquipmentData:
-    def __init__(datafile):
+    """A session on the equipment database, keeping one object for each
+    container id (an identity map): loading a container already loaded
+    returns the same object, changes and all.
+
+    Containers and their valves are loaded in batches, a query for each
+    ID_BATCH_SIZE ids and another for their valves. commit() writes back
+    only the containers changed since they were loaded or last committed,
+    and those added, in one transaction.
+
+    with EquipmentData(dbfile) as equipment:
+        for fermenter in equipment.find("fermenter"):
+            fermenter.clean=True
+        equipment.commit()
+"""
+    def __init__(self,datafile=None):
         
         if not datafile:
             datafile=os.path.join(os.environ["FATTYBREWHOME"],"var","fattybrew.db")
-        if os.path.exists(datafile):
-            self.conn=sqlite3.connect(datafile)
-        else:
+        if not os.path.exists(datafile):
             raise Exception("Unable to make a database connection to {0}".format(datafile))
         self.datafile=datafile
-            
-
-def find_container(container_name_regex=None,other_fields={},dataset=None):
-    """ Return a container from a name"""
-    ## Load the database to find the container
-
-    dbconn=EquipmentData(dataset)
-    container=None
-    chosen=0
-
-    while not chosen:
-        results=[]
-        
-        if container_name_regex:
-            dbstr='''SELECT id FROM containers WHERE containers.name LIKE ?'''
-
-
-            dbconn.execute(dbstr,container_name_regex)
-            ## if not container_name_regex:
-            ##     select from a list
-
-            dbconn.execute('''SELECT id FROM containers WHERE containers.name LIKE ?''',container_name_regex)
-
-            results=dbconn.fetchall()
-
-        else: 
-            dbstr='''SELECT id,name FROM container'''
-            dbconn.execute(dbstr)
-            results=dbconn.fetchall()
-        if len(results) == 1:
-            chosen=results[0][1]
-        elif len(results) == 0:
-            raise Exception("Unable to find any container")
-        else:
-            for r in results:
-                print(r[0]," : ",r[1])
-
-            while not 0 < chosen < len(results):                
-                try:
-                    chosen=results[input("Make your selection: ")][1]
-                except ValueError,KeyError:
-                    pass
-                
-        dbconn.execute('''SELECT total_volume,total_volume_units,current_volumen,current_volume_unit,
-        target_temperature,target_temperature_units,id,name
-        FROM containers WHERE containers.rowid LIKE ?''',chosen)
-        results=dbconn.fetchall()
-    cont=BrewContainer()
-
-
+        self.conn=connections.connect(datafile)
+        self.identity={}
+        ## id -> the row of the container as last loaded or stored, to find changes
+        self._stored_rows={}
+        self._new=[]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*exc_info):
+        self.close()
+
+    def __contains__(self,bcid):
+        return bcid in self.identity
+
+    def __len__(self):
+        return len(self.identity)
+
+    def get(self,bcid):
+        """Return the container with id bcid, or None"""
+        found=self.get_many([bcid])
+        return found[0] if found else None
+
+    def get_many(self,bcids):
+        """Return the containers with the given ids, in that order, loading
+        those not loaded yet together. Ids with no container are left out."""
+        missing=[bcid for bcid in dict.fromkeys(bcids) if bcid not in self.identity]
+        for start in range(0,len(missing),ID_BATCH_SIZE):
+            batch=missing[start:start+ID_BATCH_SIZE]
+            sql=SELECT_CONTAINERS_SQL+" WHERE containers.id IN ({0})".format(",".join("?"*len(batch)))
+            self._load(self.conn.execute(sql,batch).fetchall())
+        return [self.identity[bcid] for bcid in bcids if bcid in self.identity]
+
+    def find(self,name=None,match="prefix",min_volume=None,max_volume=None,min_temperature=None,max_temperature=None,clean=None,limit=None,cutoff=0.6):
+        """Return the containers search_containers would, as the objects of this session"""
+        rows=_find_rows(name,match,min_volume,max_volume,min_temperature,max_temperature,clean,limit,cutoff,self.datafile)
+        self._load([r for r in rows if r["id"] not in self.identity])
+        return [self.identity[r["id"]] for r in rows]
+
+    def add(self,container):
+        """Put a new container in the session, to be inserted by commit()"""
+        if container.bcid:
+            self._adopt(container)
+        elif not any(container is c for c in self._new):
+            self._new.append(container)
+
+    def dirty(self):
+        """Return the new containers and those changed since loaded or committed"""
+        return self._new+[c for (bcid,c) in self.identity.items() if c._row() != self._stored_rows[bcid]]
+
+    def commit(self):
+        """Write back the dirty containers
+        :return the number written"""
+        dirty=self.dirty()
+        if dirty:
+            store_many(dirty,self.datafile)
+        for c in dirty:
+            self._adopt(c)
+        self._new=[]
+        return len(dirty)
+
+    def close(self):
+        """Forget the loaded containers. Changes not committed are lost."""
+        self.identity.clear()
+        self._stored_rows.clear()
+        self._new=[]
+
+    def _adopt(self,container):
+        self.identity[container.bcid]=container
+        self._stored_rows[container.bcid]=container._row()
+
+    def _load(self,rows):
+        loaded=[]
+        for r in rows:
+            container=_hydrate_row(r)
+            self._adopt(container)
+            loaded.append(container)
+        self._load_valves(loaded)
+
+    def _load_valves(self,containers):
+        by_id=dict((c.bcid,c) for c in containers)
+        ids=list(by_id)
+        for start in range(0,len(ids),ID_BATCH_SIZE):
+            batch=ids[start:start+ID_BATCH_SIZE]
+            for r in self.conn.execute(SELECT_VALVES_SQL.format(",".join("?"*len(batch))),batch):
+                by_id[r["container"]].valves.append({"id": r["id"],
+                                                     "name": r["valve_name"],
+                                                     "type": r["valve_type"],
+                                                     "status": r["valve_status"],
+                                                     "diameter": r["valve_diameter"],
+                                                     "diameter_units": r["valve_diameter_units"],
+                                                     "relationship": r["cont_valve_relationship"]})
 
 
 def convert_units(in_amount,in_volume,target_units):
@@ -0,0 +1,276 @@
+"""A small stand-in for a CouchDB server, for tests
+
+Holds databases in memory and answers the requests couchdb-python makes
+for creating databases, saving, loading and bulk saving documents, with
+revision checks, the _changes feed (normal and longpoll) and views.
+Views are worked out on every query by running the map function of the
+design document in node (NODE), so tests of views are skipped where
+there is no node; the _count and _sum reduce functions are supported.
+Every request is recorded in requests as (method, path).
+
+Synopsis:
+-----------
+
+with StandInCouchDB() as standin:
+    server = couchdb.Server(standin.url)
+    database = server.create('brewing')
+
+"""
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, unquote, parse_qs
+from uuid import uuid4
+import hashlib
+import json
+import shutil
+import subprocess
+import threading
+
+NODE = shutil.which('node')
+
+# Runs a map function over documents: reads {"map": ..., "docs": [...]} and
+# writes the emitted [id, key, value] rows
+MAP_SCRIPT = """
+var input = JSON.parse(require('fs').readFileSync(0, 'utf8'));
+var rows = [];
+var current;
+function emit(key, value) { rows.push([current, key, value === undefined ? null : value]); }
+var map = eval('(' + input.map + ')');
+input.docs.forEach(function(doc) { current = doc._id; map(doc); });
+process.stdout.write(JSON.stringify(rows));
+"""
+
+# Query parameters given as JSON
+JSON_PARAMETERS = ('key', 'startkey', 'start_key', 'endkey', 'end_key')
+
+
+def collation_key(value):
+    """Sort key following CouchDB's view collation: null, false, true,
+    numbers, strings, arrays then objects
+    """
+    if value is None:
+        return (0,)
+    if value is False:
+        return (1,)
+    if value is True:
+        return (2,)
+    if isinstance(value, (int, float)):
+        return (3, value)
+    if isinstance(value, str):
+        return (4, value)
+    if isinstance(value, list):
+        return (5, tuple( collation_key(item) for item in value ))
+    return (6, tuple( (key, collation_key(item)) for (key, item) in value.items() ))
+
+
+class StandInCouchDB(object):
+
+    def __init__(self):
+        self.databases = {}
+        # database -> list of changes, {'seq': n, 'id': id, 'changes': [{'rev': rev}]}
+        self.changes = {}
+        self.seqs = {}
+        self.requests = []
+        # Waited on by longpoll _changes requests
+        self.lock = threading.Condition()
+        standin = self
+
+        class Handler(StandInHandler):
+            server_state = standin
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:%s/' % (self.httpd.server_address[1])
+        self.thread = threading.Thread(target=self.httpd.serve_forever, args=(0.05,), daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def save(self, db, document):
+        """Store document in database db
+        :return (status, response body)
+        """
+        docs = self.databases[db]
+        id = document.get('_id') or uuid4().hex
+        current = docs.get(id)
+        if current is not None and current['_rev'] != document.get('_rev'):
+            return (409, {'id': id, 'error': 'conflict', 'reason': 'Document update conflict.'})
+        if current is None and document.get('_rev'):
+            return (409, {'id': id, 'error': 'conflict', 'reason': 'Document update conflict.'})
+        generation = int(current['_rev'].split('-')[0]) + 1 if current else 1
+        body = json.dumps(document, sort_keys=True).encode('utf-8')
+        document = dict(document, _id=id, _rev='%s-%s' % (generation, hashlib.md5(body).hexdigest()))
+        docs[id] = document
+        seq = self.last_seq(db) + 1
+        changes = self.changes.setdefault(db, [])
+        changes[:] = [ change for change in changes if change['id'] != id ]
+        changes.append({'seq': seq, 'id': id, 'changes': [{'rev': document['_rev']}]})
+        self.seqs[db] = seq
+        self.lock.notify_all()
+        return (201, {'ok': True, 'id': id, 'rev': document['_rev']})
+
+    def last_seq(self, db):
+        return self.seqs.get(db, 0)
+
+    def changes_since(self, db, since, feed, timeout):
+        """Return the _changes response, waiting up to timeout ms for
+        changes if feed is longpoll
+        """
+        if since == 'now':
+            since = self.last_seq(db)
+        since = int(since or 0)
+        if feed == 'longpoll' and self.last_seq(db) <= since:
+            self.lock.wait(timeout / 1000.0)
+        results = [ change for change in self.changes.get(db, []) if change['seq'] > since ]
+        return {'results': results, 'last_seq': self.last_seq(db)}
+
+    def view(self, db, design, name, query):
+        """Return the response to a view query, or None if there is no such view"""
+        docs = self.databases[db]
+        functions = (docs.get('_design/' + design) or {}).get('views', {}).get(name)
+        if functions is None:
+            return None
+        mapped = [ doc for (id, doc) in sorted(docs.items()) if not id.startswith('_design/') ]
+        output = subprocess.run([NODE, '-e', MAP_SCRIPT], input=json.dumps({'map': functions['map'], 'docs': mapped}),
+                                capture_output=True, text=True, check=True).stdout
+        rows = sorted(json.loads(output), key=lambda row: (collation_key(row[1]), row[0]))
+        total_rows = len(rows)
+        startkey = query.get('startkey', query.get('start_key'))
+        endkey = query.get('endkey', query.get('end_key'))
+        if 'key' in query:
+            startkey = endkey = query['key']
+        if startkey is not None:
+            rows = [ row for row in rows if collation_key(row[1]) >= collation_key(startkey) ]
+        if endkey is not None:
+            if query.get('inclusive_end', True):
+                rows = [ row for row in rows if collation_key(row[1]) <= collation_key(endkey) ]
+            else:
+                rows = [ row for row in rows if collation_key(row[1]) < collation_key(endkey) ]
+        reduce_fun = functions.get('reduce')
+        if reduce_fun and query.get('reduce', True):
+            if query.get('group'):
+                group_level = None
+            elif 'group_level' in query:
+                group_level = query['group_level']
+            else:
+                group_level = 0
+            groups = []
+            for (id, key, value) in rows:
+                if group_level == 0:
+                    group_key = None
+                elif group_level is not None and isinstance(key, list):
+                    group_key = key[:group_level]
+                else:
+                    group_key = key
+                if groups and groups[-1][0] == group_key:
+                    groups[-1][1].append(value)
+                else:
+                    groups.append((group_key, [value]))
+            reduce = len if reduce_fun == '_count' else sum
+            return {'rows': [ {'key': key, 'value': reduce(values)} for (key, values) in groups ]}
+        result = []
+        for (id, key, value) in rows[:query.get('limit')]:
+            row = {'id': id, 'key': key, 'value': value}
+            if query.get('include_docs'):
+                row['doc'] = docs.get(id)
+            result.append(row)
+        return {'total_rows': total_rows, 'offset': 0, 'rows': result}
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+
+    server_state = None
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(data)
+
+    def _body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length).decode('utf-8')) if length else None
+
+    def _route(self):
+        parts = [ unquote(part) for part in urlsplit(self.path).path.split('/') if part ]
+        state = self.server_state
+        with state.lock:
+            state.requests.append((self.command, '/' + '/'.join(parts)))
+        return (state, parts)
+
+    def do_GET(self):
+        (state, parts) = self._route()
+        with state.lock:
+            if not parts:
+                return self._reply(200, {'couchdb': 'Welcome', 'version': 'stand-in'})
+            if parts[0] not in state.databases:
+                return self._reply(404, {'error': 'not_found', 'reason': 'Database does not exist.'})
+            docs = state.databases[parts[0]]
+            if len(parts) == 1:
+                return self._reply(200, {'db_name': parts[0], 'doc_count': len(docs), 'update_seq': state.last_seq(parts[0])})
+            if parts[1] == '_changes':
+                query = dict( (key, values[-1]) for (key, values) in parse_qs(urlsplit(self.path).query).items() )
+                return self._reply(200, state.changes_since(parts[0], query.get('since'), query.get('feed'),
+                                                            int(query.get('timeout', 60000))))
+            if parts[1] == '_design' and len(parts) == 5 and parts[3] == '_view':
+                query = {}
+                for (key, values) in parse_qs(urlsplit(self.path).query).items():
+                    query[key] = json.loads(values[-1]) if key in JSON_PARAMETERS or values[-1] in ('true', 'false') or values[-1].isdigit() else values[-1]
+                result = state.view(parts[0], parts[2], parts[4], query)
+                if result is None:
+                    return self._reply(404, {'error': 'not_found', 'reason': 'missing_named_view'})
+                return self._reply(200, result)
+            if parts[1] == '_all_docs':
+                rows = [ {'id': id, 'key': id, 'value': {'rev': doc['_rev']}} for (id, doc) in sorted(docs.items()) ]
+                return self._reply(200, {'total_rows': len(rows), 'offset': 0, 'rows': rows})
+            id = '/'.join(parts[1:])
+            if id not in docs:
+                return self._reply(404, {'error': 'not_found', 'reason': 'missing'})
+            return self._reply(200, docs[id])
+
+    def do_HEAD(self):
+        self.do_GET()
+
+    def do_PUT(self):
+        (state, parts) = self._route()
+        body = self._body()
+        with state.lock:
+            if len(parts) == 1:
+                if parts[0] in state.databases:
+                    return self._reply(412, {'error': 'file_exists', 'reason': 'The database could not be created, the file already exists.'})
+                state.databases[parts[0]] = {}
+                return self._reply(201, {'ok': True})
+            body['_id'] = '/'.join(parts[1:])
+            return self._reply(*state.save(parts[0], body))
+
+    def do_POST(self):
+        (state, parts) = self._route()
+        body = self._body()
+        with state.lock:
+            if parts[0] not in state.databases:
+                return self._reply(404, {'error': 'not_found', 'reason': 'Database does not exist.'})
+            if len(parts) == 1:
+                return self._reply(*state.save(parts[0], body))
+            if parts[1] == '_bulk_docs':
+                results = []
+                for document in body['docs']:
+                    (status, result) = state.save(parts[0], document)
+                    results.append(result)
+                return self._reply(201, results)
+            return self._reply(404, {'error': 'not_found', 'reason': 'missing'})
+
+    def do_DELETE(self):
+        (state, parts) = self._route()
+        with state.lock:
+            state.databases.pop(parts[0], None)
+            return self._reply(200, {'ok': True})
@@ -0,0 +1,145 @@
+import sys, os
+
+sys.path.append(os.path.join(os.path.dirname(__file__),"..","lib"))
+sys.path.append(os.path.dirname(__file__))
+
+import threading
+import time
+
+import couchdb
+
+from fattybrewing import container
+from fattybrewing.container import cache, embedded, persistence
+
+from couchdb_standin import StandInCouchDB
+
+
+def stored_containers(database, count):
+    containers = [ container.Fermenter((100, 'l')) for i in range(count) ]
+    store = persistence.ContainerStore(database)
+    store.add_many(containers)
+    store.flush()
+    return containers
+
+
+def test_lru():
+
+    with StandInCouchDB() as standin:
+        database = couchdb.Server(standin.url).create('brewing')
+        ids = [ c.id for c in stored_containers(database, 3) ]
+        containers = cache.ContainerCache(database, size=2)
+
+        first = containers.get(ids[0])
+        assert isinstance(first, container.Fermenter)
+        assert containers.get(ids[0]) is first
+        containers.get(ids[1])
+        containers.get(ids[0])
+        containers.get(ids[2])
+        assert ids[1] not in containers and ids[0] in containers
+        assert (containers.hits, containers.misses, containers.evictions) == (2, 3, 1)
+        assert len([ r for r in standin.requests if r == ('GET', '/brewing/' + ids[0]) ]) == 1
+        assert containers.get('missing') is None
+
+
+def test_process_changes():
+
+    with StandInCouchDB() as standin:
+        database = couchdb.Server(standin.url).create('brewing')
+        ids = [ c.id for c in stored_containers(database, 2) ]
+        containers = cache.ContainerCache(database)
+        containers.poll_changes(timeout=0)
+        cached = [ containers.get(id) for id in ids ]
+
+        # Our own write keeps the entry
+        cached[0].add_content('wort', (50, 'l'))
+        cached[0].store(database)
+        # Someone else's write drops it
+        other = persistence.load_container(database, ids[1])
+        other.add_content('wort', (60, 'l'))
+        other.store(database)
+
+        assert containers.poll_changes(timeout=0) == 2
+        assert ids[0] in containers and ids[1] not in containers
+
+        containers.refresh = True
+        fermenter = containers.get(ids[1])
+        other = persistence.load_container(database, ids[1])
+        other.remove_content('wort', (10, 'l'))
+        other.store(database)
+        containers.poll_changes(timeout=0)
+        assert containers.get(ids[1]) is fermenter
+        assert fermenter.rev == other.rev
+        assert fermenter.total_filled()[0] == 50
+
+
+def test_follow_changes():
+
+    with StandInCouchDB() as standin:
+        database = couchdb.Server(standin.url).create('brewing')
+        (stored,) = stored_containers(database, 1)
+        containers = cache.ContainerCache(database, refresh=True)
+        fermenter = containers.get(stored.id)
+        containers.follow_changes(timeout=100)
+        try:
+            stored.add_content('wort', (70, 'l'))
+            stored.store(database)
+            deadline = time.time() + 5
+            while fermenter.rev != stored.rev and time.time() < deadline:
+                time.sleep(0.01)
+            assert fermenter.rev == stored.rev
+            assert fermenter.contents[0].amount == 70
+        finally:
+            containers.stop()
+
+
+class SlowDatabase(embedded.EmbeddedDatabase):
+    """A database holding up each get, once it has read the document,
+    until let go (or for 5 seconds)
+    """
+
+    def __init__(self):
+        embedded.EmbeddedDatabase.__init__(self)
+        self.gets = 0
+        self.read = threading.Semaphore(0)
+        self.go = threading.Semaphore(0)
+
+    def get(self, id, default=None, **options):
+        data = embedded.EmbeddedDatabase.get(self, id, default, **options)
+        self.gets += 1
+        self.read.release()
+        self.go.acquire(timeout=5)
+        return data
+
+
+def test_concurrent_misses():
+
+    database = SlowDatabase()
+    (stored,) = stored_containers(database, 1)
+    containers = cache.ContainerCache(database)
+    containers.poll_changes(timeout=0)
+    got = []
+    threads = [ threading.Thread(target=lambda: got.append(containers.get(stored.id)), daemon=True) for i in range(3) ]
+    for thread in threads:
+        thread.start()
+
+    # The first load reads the document, then it is stored again before
+    # the loaded container is cached
+    assert database.read.acquire(timeout=5)
+    deadline = time.time() + 5
+    while containers.misses < 3 and time.time() < deadline:
+        time.sleep(0.01)
+    stored.add_content('wort', (30, 'l'))
+    stored.store(database)
+    containers.poll_changes(timeout=0)
+    database.go.release()
+    # so it is read again
+    assert database.read.acquire(timeout=5)
+    database.go.release()
+    for thread in threads:
+        thread.join(5)
+
+    assert database.gets == 2
+    assert len(got) == 3 and got[0] is got[1] is got[2]
+    assert got[0].rev == stored.rev
+    assert containers.get(stored.id) is got[0]
+    assert (containers.hits, containers.misses) == (1, 3)
@@ -5,6 +5,9 @@ sys.path.append(os.path.join(os.path.dirname(__file__),"..","lib"))
 from fattybrewing import container
 
 from datetime import datetime, timedelta
+from decimal import Decimal
+
+import numpy
 
 def test_mash_tun():
     
@@ -40,7 +43,7 @@ def test_mash_tun():
 
 class TestContentMovement:
     
-    def setup(self):
+    def setup_method(self):
         self.mash_tun = container.MashTun((50,'L'))
         self.big_fermenter = container.Fermenter((60,'L'))
         self.third_fermenter = container.Fermenter((30,'L'))
@@ -100,8 +103,113 @@ class TestContentMovement:
         self.big_fermenter.add_content('beer', (30, 'l'))
         self.big_fermenter.add_content('fragrance hops', (500, 'g'))
 
-        kegs = [ container.Keg((20,'l')) for i in range(3)) ]
+        kegs = [ container.Keg((20,'l')) for i in range(3) ]
         garbage = self.big_fermenter.into_kegs(kegs)
 
 
         
+def test_convert_amount():
+
+    assert container.convert_amount((10, 'l'), 'l') == 10
+    assert abs(container.convert_amount((1, 'gal'), 'l') - 3.78541) < 1e-9
+    assert container.convert_amount({"amount": 500, "unit": "ml"}, 'l') == 0.5
+    assert container.convert_amount((Decimal('2'), 'kg'), 'l') == Decimal('2')
+    assert container.convert_amount((Decimal('250'), 'g'), 'l') == Decimal('0.25')
+
+    try:
+        container.convert_amount((1, 'barrel'), 'l')
+        assert False
+    except container.ContainerError:
+        pass
+
+def test_convert_many():
+
+    converted = container.convert_many([1000, 2, 1], ['ml', 'l', 'gal'], 'l')
+    assert converted.tolist()[:2] == [1.0, 2.0]
+    assert abs(converted[2] - 3.78541) < 1e-9
+
+    converted = container.convert_many(numpy.array([1.5, 3.0]), 'kg', 'g')
+    assert converted.tolist() == [1500.0, 3000.0]
+
+def test_running_fill_level():
+
+    container.CHECK_FILL = True
+    try:
+        fermenter = container.Fermenter((60, 'L'))
+        for i in range(20):
+            fermenter.add_content('wort', (2, 'l'))
+        fermenter.add_content('yeast', (500, 'g'))
+        assert fermenter.total_filled() == (Decimal('40.5'), 'l')
+
+        fermenter.remove_content('yeast', (200, 'g'))
+        assert fermenter.total_filled()[0] == Decimal('40.3')
+        fermenter.check_filled()
+
+        fermenter.remove_all()
+        assert fermenter.total_filled()[0] == 0
+        assert not fermenter.full
+    finally:
+        container.CHECK_FILL = False
+
+def test_remove_across_lots():
+
+    storage = container.Storage((100, 'l'))
+    for i in range(4):
+        storage.add_content('water', (10, 'l'))
+        storage.add_content('malt', (1, 'kg'))
+
+    removed = storage.remove_content('water', (25, 'l'))
+    assert [ r[1]["amount"] for r in removed ] == [10, 10, 5]
+    assert storage.total_filled()[0] == 19
+
+    # Emptied lots are dropped once the contents are looked at
+    assert [ (c.content, c.amount) for c in storage.contents ] == [
+        ('malt', 1), ('malt', 1), ('water', 5), ('malt', 1), ('water', 10), ('malt', 1)]
+
+    storage.remove_content('malt', (4, 'kg'))
+    storage.remove_content('water', (15, 'l'))
+    assert len(storage.contents) == 0
+    try:
+        storage.remove_content('water', (1, 'l'))
+        assert False
+    except container.ContainerError:
+        pass
+
+def test_add_many():
+
+    mash_tun = container.MashTun((30, 'l'))
+    mash_tun.add_many([ ('water', (20, 'l'), (65, 'C')),
+                        ('malt', {"amount": 2, "unit": "kg"}, {"degrees": 20, "unit": "C"}),
+                        ('hops', (250, 'g'), (20, 'C')) ])
+    assert [ c.content for c in mash_tun.contents ] == ['water', 'malt', 'hops']
+    assert mash_tun.contents[0].temperature.degrees == 65
+    assert mash_tun.contents[2].content_type == container.ContentType.Hops
+    assert mash_tun.total_filled()[0] == Decimal('22.25')
+
+    batch = numpy.array([ ('water', 5, 'l', 70, 'C'), ('water', 5, 'l', 70, 'C') ], dtype=container.CONTENT_DTYPE)
+    try:
+        mash_tun.add_many(batch)
+        assert False
+    except container.ContainerError:
+        pass
+    assert mash_tun.full
+    assert mash_tun.contents[-1].amount == Decimal('2.75')
+    mash_tun.check_filled()
+
+def test_remove_many():
+
+    fermenter = container.Fermenter((60, 'l'))
+    fermenter.add_many([ ('wort', (20, 'l'), (20, 'C')), ('wort', (20, 'l'), (20, 'C')),
+                         ('yeast', (50, 'g'), (20, 'C')) ])
+
+    try:
+        fermenter.remove_many([ ('wort', (10, 'l')), ('beer', (10, 'l')) ])
+        assert False
+    except container.ContainerError:
+        pass
+    assert fermenter.total_filled()[0] == Decimal('40.05')
+
+    removed = fermenter.remove_many([ ('wort', (15, 'l')), ('yeast', (50, 'g')), ('wort', (10000, 'ml')) ])
+    assert [ (r[0], r[1]["amount"]) for r in removed ] == [ ('wort', 20), ('wort', 5), ('yeast', 50) ]
+    assert fermenter.total_filled()[0] == 15
+    fermenter.check_filled()
@@ -0,0 +1,57 @@
+import sys, os
+
+sys.path.append(os.path.join(os.path.dirname(__file__),"..","lib"))
+
+import asyncio
+
+from fattybrewing import container
+from fattybrewing.container import bus, controllers, simulation
+
+
+def test_bus_batches_and_backpressure():
+
+    async def scenario():
+        message_bus = bus.MessageBus(maxsize=2)
+        for number in range(2):
+            await message_bus.publish(bus.Message(bus.FERMENT_TOPIC, number, None))
+        blocked = asyncio.ensure_future(message_bus.publish(bus.Message(bus.FERMENT_TOPIC, 2, None)))
+        await asyncio.sleep(0)
+        assert not blocked.done()
+        batch = await message_bus.receive(bus.FERMENT_TOPIC, max_batch=5)
+        await blocked
+        assert [ m.order_number for m in batch ] == [0, 1]
+        assert message_bus.pending(bus.FERMENT_TOPIC) == 1
+        assert message_bus.published[bus.FERMENT_TOPIC] == 3
+        assert message_bus.delivered[bus.FERMENT_TOPIC] == 2
+
+    asyncio.run(scenario())
+
+
+def test_message_forward():
+
+    tank = container.Storage((100, 'l'))
+    message = bus.Message(bus.MASH_TOPIC, 7, 'recipe')
+    forwarded = message.forward(bus.FERMENT_TOPIC, [tank], volume=(90, 'l'))
+    assert (forwarded.topic, forwarded.order_number, forwarded.recipe) == (bus.FERMENT_TOPIC, 7, 'recipe')
+    assert forwarded.holding_tanks == [tank]
+    assert forwarded.measurements == {'volume': (90, 'l')}
+    assert message.measurements == {}
+
+
+def test_run_orders():
+
+    orders = [ (number, simulation.Recipe('pale ale')) for number in range(1, 6) ]
+    finished = asyncio.run(controllers.run_orders(
+        orders,
+        [ container.MashTun((1300, 'l')) ],
+        [ container.Fermenter((1100, 'l')) for i in range(2) ],
+        [ simulation.PackagingLine((50, 'l'), 500) ],
+        [ container.Storage((1100, 'l')) ],
+        [ container.Storage((1100, 'l')) for i in range(2) ]))
+
+    assert sorted( m.order_number for m in finished ) == [1, 2, 3, 4, 5]
+    for message in finished:
+        assert message.topic == bus.PACKAGED_TOPIC
+        assert message.measurements['packages'] == 20
+        assert message.measurements['volume'][0] == 1000
+        assert message.measurements['hours'] > 0
@@ -0,0 +1,106 @@
+import sys, os
+
+sys.path.append(os.path.join(os.path.dirname(__file__),"..","lib"))
+
+from couchdb.http import ResourceConflict
+import pytest
+
+from fattybrewing import container
+from fattybrewing.container import cache, embedded, persistence, views
+
+
+def test_revisions():
+
+    database = embedded.EmbeddedDatabase()
+    fermenter = container.Fermenter((100, 'l'))
+    fermenter.add_content('wort', (80, 'l'))
+    fermenter.store(database)
+    assert fermenter.rev.startswith('1-')
+
+    loaded = container.Fermenter.load(database, fermenter.id)
+    assert loaded.contents[0].amount == 80
+    loaded.remove_content('wort', (30, 'l'))
+    loaded.store(database)
+    assert loaded.rev.startswith('2-')
+    # A loaded document is a copy
+    assert database[fermenter.id]['contents'][0]['amount'] == '50'
+
+    with pytest.raises(ResourceConflict):
+        fermenter.store(database)
+    assert database.changes(since=0)['results'] == [{'seq': 2, 'id': fermenter.id, 'changes': [{'rev': loaded.rev}]}]
+
+
+def test_store_and_views():
+
+    database = persistence.open_database(':memory:', 'brewing')
+    views.install(database)
+    assert database['_design/containers']['language'] == 'python'
+    store = persistence.ContainerStore(database, batch_size=100)
+    fermenters = [ container.Fermenter((size, 'l')) for size in range(10, 510, 10) ]
+    for fermenter in fermenters[:20]:
+        fermenter.add_content('wort', (5, 'l'))
+    store.add_many(fermenters)
+    assert store.flush() == []
+    assert store.requests == 1
+
+    assert views.find_empty(database, 'fermenter', min_size=(60, 'l')).size.amount == 210
+    assert views.count_by_state(database, 'fermenter') == {'empty': 30, 'partial': 20, 'full': 0}
+    assert views.volume_by_content_type(database) == {'wort': 100.0}
+
+    # The index follows changes
+    fermenters[20].add_content('wort', (5, 'l'))
+    fermenters[20].store(database)
+    assert views.find_empty(database, 'fermenter', min_size=60).size.amount == 220
+    del database[fermenters[21].id]
+    assert views.find_empty(database, 'fermenter', min_size=60).size.amount == 230
+    assert len(views.containers_holding(database, 'wort')) == 21
+
+
+def test_file(tmp_path):
+
+    database = persistence.open_database(str(tmp_path), 'brewing')
+    kegs = [ container.Keg((20, 'l')) for i in range(3) ]
+    for keg in kegs:
+        keg.store(database)
+    kegs[0].add_content('beer', (20, 'l'))
+    kegs[0].store(database)
+    database.close()
+
+    # A write cut short
+    with open(str(tmp_path / 'brewing.jsonl'), 'a') as log:
+        log.write('{"_id": "half')
+
+    database = persistence.open_database(str(tmp_path), 'brewing')
+    assert len(database) == 3
+    assert database.info()['update_seq'] == 4
+    assert container.Keg.load(database, kegs[0].id).contents[0].content == 'beer'
+    # Writes after the torn line are read back
+    kegs[1].add_content('beer', (5, 'l'))
+    kegs[1].store(database)
+    database.close()
+    # and so is a last line missing only its newline
+    with open(str(tmp_path / 'brewing.jsonl'), 'rb+') as log:
+        log.seek(-1, os.SEEK_END)
+        log.truncate()
+    database = persistence.open_database(str(tmp_path), 'brewing')
+    kegs[2].add_content('beer', (2, 'l'))
+    kegs[2].store(database)
+    database.close()
+
+    database = persistence.open_database(str(tmp_path), 'brewing')
+    assert database.info()['update_seq'] == 6
+    assert [ float(container.Keg.load(database, keg.id).total_filled()[0]) for keg in kegs ] == [20, 5, 2]
+    database.compact()
+    with open(str(tmp_path / 'brewing.jsonl')) as log:
+        assert len(log.readlines()) == 3
+
+    # The cache follows an embedded database as it does CouchDB
+    containers = cache.ContainerCache(database, refresh=True)
+    keg = containers.get(kegs[1].id)
+    containers.poll_changes(timeout=0)
+    other = container.Keg.load(database, kegs[1].id)
+    other.add_content('beer', (10, 'l'))
+    other.store(database)
+    assert containers.poll_changes(timeout=1000) == 1
+    assert keg.rev == other.rev
+    database.close()
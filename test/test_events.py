@@ -0,0 +1,126 @@
+import sys, os
+import shutil
+import tempfile
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.join(os.path.dirname(__file__),"..","lib"))
+
+from fattybrewing import container
+from fattybrewing.container.events import EventLog
+
+
+class Clock(object):
+    """A clock moving on a minute every time it is read"""
+
+    def __init__(self):
+        self.now = datetime(2020, 1, 1)
+
+    def __call__(self):
+        self.now += timedelta(minutes=1)
+        return self.now
+
+
+def amounts(vessel):
+    return dict( (c.content, float(c.amount)) for c in vessel.contents if c.amount )
+
+
+def test_container_at():
+
+    directory = tempfile.mkdtemp()
+    clock = Clock()
+    log = EventLog(os.path.join(directory, 'contents.events'), snapshot_every=3, clock=clock, capacity=4)
+    log.attach()
+    try:
+        mash_tun = container.MashTun((50, 'l'))
+        fermenter = container.Fermenter((60, 'l'))
+        log.track(mash_tun)
+        mash_tun.add_content('water', (20, 'l'))
+        mash_tun.add_many([ ('malt', (2, 'kg'), (20, 'C')), ('hops', (1, 'kg'), (20, 'C')) ])
+        mash_tun.heat_contents((68, 'C'))
+        filled = clock.now
+        mash_tun.convert_to_wort()
+        mashed = clock.now
+        container.move_all(mash_tun, fermenter)
+        moved = clock.now
+        fermenter.remove_content('wort', (5, 'l'))
+        try:
+            fermenter.add_content('water', (100, 'l'))
+        except container.ContainerError:
+            pass
+        for i in range(10):
+            fermenter.heat_contents((18 + i, 'C'))
+    finally:
+        log.detach()
+
+    assert not hasattr(container.Container.add_content, '__wrapped__')
+    then = log.container_at(mash_tun.id, filled)
+    assert isinstance(then, container.MashTun)
+    assert amounts(then) == {'water': 20, 'malt': 2, 'hops': 1}
+    assert set(float(c.temperature.degrees) for c in then.contents) == set([68])
+    assert set(amounts(log.container_at(mash_tun.id, mashed))) == set(['wort', 'used malt', 'used hops'])
+    assert amounts(log.container_at(mash_tun.id, moved)) == {}
+    # The fermenter's history starts at its first change
+    assert log.container_at(fermenter.id, mashed) is None
+    assert amounts(log.container_at(fermenter.id, moved)) == {'wort': 20}
+    # The partial fill is replayed, as are the heating steps after the snapshots
+    now = log.container_at(fermenter.id)
+    assert amounts(now) == amounts(fermenter) == {'wort': 15, 'water': 45}
+    assert set(float(c.temperature.degrees) for c in now.contents) == set([27])
+
+    events = log.events(fermenter.id)
+    assert [ log.names[code] for code in events['content'][events['content'] >= 0] ] == ['wort', 'wort', 'water']
+    assert events['error'].sum() == 1
+    assert len(log.events(fermenter.id, start=moved + timedelta(minutes=1))) == 12
+
+    # Everything is kept in the files
+    log.close()
+    log = EventLog(os.path.join(directory, 'contents.events'), snapshot_every=3, clock=clock)
+    assert amounts(log.container_at(mash_tun.id, filled)) == {'water': 20, 'malt': 2, 'hops': 1}
+    assert amounts(log.container_at(fermenter.id)) == {'wort': 15, 'water': 45}
+    log.close()
+    shutil.rmtree(directory)
+
+
+def test_fermentation_progress():
+
+    directory = tempfile.mkdtemp()
+    log = EventLog(os.path.join(directory, 'contents.events'), snapshot_every=100, clock=Clock())
+    log.attach()
+    try:
+        fermenter = container.Fermenter((60, 'l'))
+        fermenter.add_many([ ('wort', (40, 'l'), (20, 'C')), ('yeast', (1, 'kg'), (20, 'C')) ])
+        fermenter.ferment_wort(timedelta(hours=2), mode='adaptive')
+    finally:
+        log.detach()
+    assert fermenter.fermentation.hours == 2
+    replayed = log.container_at(fermenter.id)
+    assert replayed.fermentation.hours == 2
+    assert replayed.fermentation.sugar == fermenter.fermentation.sugar
+    assert amounts(replayed) == amounts(fermenter)
+    log.close()
+    shutil.rmtree(directory)
+
+
+def test_overflow_replayed():
+
+    directory = tempfile.mkdtemp()
+    log = EventLog(os.path.join(directory, 'contents.events'), snapshot_every=100, clock=Clock())
+    log.attach()
+    try:
+        fermenter = container.Fermenter((10, 'l'))
+        log.track(fermenter)
+        fermenter.add_content('water', (6, 'l'))
+        try:
+            fermenter.add_content('water', (11, 'l'))
+        except container.ContainerError:
+            pass
+        else:
+            raise AssertionError("Overfilled the fermenter")
+    finally:
+        log.detach()
+    replayed = log.container_at(fermenter.id)
+    assert replayed.full
+    assert [ (c.content, float(c.amount)) for c in replayed.contents ] == [ ('water', 6), ('water', 4) ]
+    assert replayed.total_filled() == fermenter.total_filled()
+    log.close()
+    shutil.rmtree(directory)
@@ -0,0 +1,80 @@
+import sys, os
+
+sys.path.append(os.path.join(os.path.dirname(__file__),"..","lib"))
+
+from fattybrewing import container
+from fattybrewing.container import fermentation
+
+from datetime import timedelta
+
+import numpy
+
+
+def test_growth_factor():
+
+    factors = fermentation.DEFAULT_PARAMETERS.growth_factor([0, 2, 18, 32, 40, 45])
+    assert factors[0] == 0 and factors[1] == 0 and factors[4] == 0 and factors[5] == 0
+    assert abs(factors[3] - 1) < 1e-12
+    assert 0 < factors[2] < 1
+
+
+def test_advance_fleet():
+
+    count = 1000
+    temperatures = numpy.linspace(8, 30, count)
+    fixed = fermentation.FermentationState([90] * count, [0] * count, [0] * count, [1] * count)
+    adaptive = fermentation.FermentationState([90] * count, [0] * count, [0] * count, [1] * count)
+    fermentation.advance(fixed, temperatures, 72)
+    fermentation.advance(adaptive, temperatures, 72, mode='adaptive')
+
+    assert numpy.abs(fixed.sugar - adaptive.sugar).max() < 0.5
+    # Warmer worts ferment faster
+    assert (numpy.diff(fixed.sugar[temperatures < 30]) <= 1e-9).all()
+    consumed = 90 - fixed.sugar
+    assert numpy.allclose(fixed.ethanol, 0.46 * consumed)
+    assert numpy.allclose(fixed.co2, 0.44 * consumed)
+
+
+def test_ferment_wort():
+
+    fermenter = container.Fermenter((60, 'l'))
+    fermenter.add_content('wort', (30, 'l'), (18, 'C'))
+    fermenter.add_content('yeast', (30, 'g'))
+
+    assert fermenter.ferment_wort(timedelta(hours=12)) == []
+    assert fermenter.fermentation.hours == 12
+    assert 0 < fermenter.fermentation.sugar < 90
+    assert 'wort' in [ c.content for c in fermenter.contents ]
+    wort_date = [ c.updated_datetime for c in fermenter.contents if c.content == 'wort' ][0]
+
+    assert fermenter.ferment_wort(timedelta(days=3), mode='adaptive') == []
+    assert 4 < fermenter.fermentation.ethanol / 7.89 < 6
+    removed = fermenter.ferment_wort(timedelta(days=11), mode='adaptive')
+    assert removed[0][0] == 'wort'
+    assert [ c.content for c in fermenter.contents ] == ['yeast', 'beer']
+    # Dated by all the hours fermented, not only the last step
+    assert fermenter.contents[1].updated_datetime == wort_date + timedelta(hours=12, days=14)
+    # Ready for the next wort
+    assert fermenter.fermentation.sugar is None and fermenter.fermentation.hours is None
+
+    try:
+        fermenter.ferment_wort(timedelta(days=1))
+        assert False
+    except container.FermentationError:
+        pass
+
+
+def test_fermenter_reused():
+
+    fermenter = container.Fermenter((60, 'l'))
+    fermenter.add_content('wort', (30, 'l'), (18, 'C'))
+    fermenter.add_content('yeast', (30, 'g'))
+    assert fermenter.ferment_wort(timedelta(days=14))
+    fermenter.remove_all()
+
+    fermenter.add_content('wort', (30, 'l'), (18, 'C'))
+    fermenter.add_content('yeast', (30, 'g'))
+    assert fermenter.ferment_wort(timedelta(minutes=1)) == []
+    assert 'wort' in [ c.content for c in fermenter.contents ]
+    assert abs(fermenter.fermentation.hours - 1 / 60.0) < 1e-9
+    assert fermenter.fermentation.sugar > 89
@@ -0,0 +1,92 @@
+import sys, os
+
+sys.path.append(os.path.join(os.path.dirname(__file__),"..","lib"))
+
+from fattybrewing import container
+from fattybrewing.container import hooks
+
+
+
+def test_operation_stats():
+
+    original = container.Container.add_content
+    stats = hooks.OperationStats()
+    stats.attach()
+    try:
+        mash_tun = container.MashTun((50, 'l'))
+        fermenter = container.Fermenter((60, 'l'))
+        mash_tun.add_content('water', (20, 'l'))
+        mash_tun.add_many([ ('malt', (2, 'kg'), (20, 'C')) ])
+        container.move_all(mash_tun, fermenter)
+        fermenter.remove_content('water', (5, 'l'))
+        try:
+            fermenter.remove_content('beer', (5, 'l'))
+        except container.ContainerError:
+            pass
+    finally:
+        stats.detach()
+
+    assert stats.counts['transfer'] == 1
+    # Two direct adds and one add_many from move_all
+    assert stats.counts['add'] == 3
+    assert stats.counts['remove'] == 3
+    assert stats.errors['remove'] == 1
+    assert stats.percentile('add', 50) >= 1
+    assert set(stats.summary()) == set(['add', 'remove', 'transfer'])
+
+    # Nothing is wrapped once nobody listens
+    assert container.Container.add_content is original
+    assert not hasattr(container.Container.add_content, '__wrapped__')
+
+
+def test_subscribe_single_operation():
+
+    seen = []
+    callback = lambda operation, target, elapsed, error: seen.append((operation, target))
+    hooks.subscribe('add', callback)
+    try:
+        storage = container.Storage((10, 'l'))
+        storage.add_content('water', (1, 'l'))
+        storage.remove_content('water', (1, 'l'))
+    finally:
+        hooks.unsubscribe('add', callback)
+    assert seen == [('add', storage)]
+
+
+def test_subscribe_arguments():
+
+    calls = []
+    callback = lambda operation, target, elapsed, error, call: calls.append((operation, target, call))
+    hooks.subscribe('add', callback, arguments=True)
+    hooks.subscribe('remove', callback, arguments=True)
+    hooks.subscribe('mash', callback, arguments=True)
+    try:
+        mash_tun = container.MashTun((50, 'l'))
+        fermenter = container.Fermenter((60, 'l'))
+        mash_tun.add_content('water', (20, 'l'), content_type='liquid')
+        mash_tun.add_content('malt', (2, 'kg'))
+        mash_tun.convert_to_wort()
+        container.move_all(mash_tun, fermenter)
+    finally:
+        hooks.unsubscribe('add', callback)
+        hooks.unsubscribe('remove', callback)
+        hooks.unsubscribe('mash', callback)
+
+    assert calls[0] == ('add', mash_tun, hooks.Call('add_content', ('water', (20, 'l')), {'content_type': 'liquid'}, None))
+    # The changes made by the mash are reported before the mash itself
+    assert [ (call.name, call.within) for (operation, target, call) in calls[2:5] ] == [('remove_many', 'mash'), ('add_many', 'mash'), ('convert_to_wort', None)]
+    # move_all is a function, the containers it empties and fills are not claimed
+    assert [ (call.name, target, call.within) for (operation, target, call) in calls[5:] ] == [('remove_all', mash_tun, None), ('add_many', fermenter, None)]
+
+
+def test_unsubscribe_unknown_callback():
+
+    callback = lambda operation, target, elapsed, error: None
+    hooks.subscribe('add', callback)
+    hooks.unsubscribe('add', callback)
+    try:
+        hooks.unsubscribe('add', callback)
+        assert False
+    except ValueError:
+        pass
+    assert not hasattr(container.Container.add_content, '__wrapped__')
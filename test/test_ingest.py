@@ -0,0 +1,118 @@
+import sys, os
+import shutil
+import tempfile
+
+import numpy
+
+sys.path.append(os.path.join(os.path.dirname(__file__),"..","lib"))
+
+from fattybrewing import container
+from fattybrewing.container import hooks, ingest
+
+
+def brewery():
+    mash_tun = container.MashTun((50, 'l'))
+    mash_tun.add_content('water', (20, 'l'))
+    fermenter = container.Fermenter((60, 'l'))
+    fermenter.add_content('wort', (40, 'l'))
+    feed = ingest.Ingest(capacity=30000)
+    sensors = [ feed.sensor(mash_tun, 'top'), feed.sensor(mash_tun, 'bottom'),
+                feed.sensor(fermenter, 'jacket'), feed.sensor(fermenter, 'level', ingest.LEVEL) ]
+    return (mash_tun, fermenter, feed, sensors)
+
+
+def degrees(vessel):
+    return set(float(c.temperature.degrees) for c in vessel.contents)
+
+
+def test_coalesced_per_tick():
+
+    (mash_tun, fermenter, feed, (top, bottom, jacket, level)) = brewery()
+    # A burst of 10000 samples, the latest of each sensor is at 0.999 s
+    times = numpy.tile(numpy.linspace(0, 0.999, 2500), 4)
+    sensors = numpy.repeat([top, bottom, jacket, level], 2500)
+    values = numpy.r_[numpy.linspace(60, 66, 2500), numpy.linspace(60, 68, 2500),
+                      numpy.linspace(15, 18, 2500), numpy.linspace(39, 38, 2500)]
+    assert feed.feed(ingest.encode(times, sensors, values)) == 10000
+
+    stats = hooks.OperationStats(['heat'])
+    stats.attach()
+    try:
+        assert feed.advance(1.0) == [mash_tun, fermenter]
+    finally:
+        stats.detach()
+    assert stats.counts['heat'] == 2
+    assert degrees(mash_tun) == set([67.0])
+    assert degrees(fermenter) == set([18.0])
+    assert feed.level(fermenter) == 38
+    assert numpy.isnan(feed.level(mash_tun))
+    assert feed.counts['applied'] == 10000
+    assert feed.temperatures.current_temperature_readings(fermenter.id or id(fermenter)) == [('jacket', 18.0)]
+    (low, high, mean) = feed.temperatures.stats([0, 1], 0, 1)
+    assert list(low) == [60, 60] and list(high) == [66, 68]
+
+
+def test_dropped_and_late():
+
+    (mash_tun, fermenter, feed, (top, bottom, jacket, level)) = brewery()
+    good = ingest.encode([0.5, 0.6], [top, jacket], [64, 17])
+    # An unknown sensor, a reading of no value, and a broken datagram
+    bad = ingest.encode([0.5, 0.5], [99, top], [1, numpy.nan])
+    assert feed.feed_datagrams([good, bad, good[:-3]]) == 2
+    assert feed.counts['dropped'] == 3
+    feed.advance(1.0)
+    assert degrees(mash_tun) == set([64.0])
+    # For a tick already applied
+    assert feed.feed(ingest.encode([0.9], [top], [70])) == 0
+    # Kept for the next tick
+    assert feed.feed(ingest.encode([1.2, 2.5], [top, top], [65, 66])) == 2
+    assert feed.advance(2.0) == [mash_tun]
+    assert feed.pending == 1
+    assert degrees(mash_tun) == set([65.0])
+    assert feed.counts['late'] == 1
+    # Beyond the pending buffer
+    assert feed.feed(ingest.encode(numpy.full(40000, 3.0), numpy.full(40000, top), numpy.full(40000, 66))) == 29999
+    assert feed.counts['dropped'] == 3 + 10001
+
+
+def test_sockets():
+
+    directory = tempfile.mkdtemp()
+    (mash_tun, fermenter, feed, (top, bottom, jacket, level)) = brewery()
+    for (now, address) in [ (10.0, os.path.join(directory, 'readings.sock')), (20.0, ('127.0.0.1', 0)) ]:
+        source = ingest.DatagramSource(address)
+        sender = ingest.socket.socket(source.socket.family, ingest.socket.SOCK_DGRAM)
+        try:
+            sender.sendto(ingest.encode([now, now], [top, bottom], [70, 72]), source.address)
+            sender.sendto(ingest.encode([now + 0.5], [jacket], [20]), source.address)
+            assert feed.feed_datagrams(source.receive()) == 3
+            assert source.receive() == []
+        finally:
+            sender.close()
+            source.close()
+        feed.advance(now + 1)
+        assert degrees(mash_tun) == set([71.0])
+        assert degrees(fermenter) == set([20.0])
+    shutil.rmtree(directory)
+
+
+def test_replay():
+
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'plant.readings')
+    (mash_tun, fermenter, feed, (top, bottom, jacket, level)) = brewery()
+    # An hour of readings every second from three sensors
+    times = numpy.tile(numpy.arange(3600.0), 3)
+    ingest.write_replay(path, times, numpy.repeat([top, bottom, jacket], 3600),
+                        numpy.r_[numpy.full(3600, 60.0), numpy.full(3600, 62.0), 10 + times[:3600] / 360])
+    waited = []
+    clock = lambda: sum(waited)
+    assert ingest.replay(feed, path, speed=600.0, tick=60.0, clock=clock, sleep=waited.append) == 60
+    # An hour at 600 times real time takes six seconds
+    assert abs(sum(waited) - 6.0) < 1e-9
+    assert degrees(mash_tun) == set([61.0])
+    assert numpy.isclose(list(degrees(fermenter)), 10 + 3599 / 360.0)
+    assert feed.counts['applied'] == 3 * 3600
+    assert feed.counts['updates'] == 120
+    assert feed.counts['dropped'] == feed.counts['late'] == 0
+    shutil.rmtree(directory)
@@ -0,0 +1,71 @@
+import sys, os
+
+sys.path.append(os.path.join(os.path.dirname(__file__),"..","lib"))
+
+from fattybrewing import container
+from fattybrewing.container.ledger import ContentLedger
+
+from datetime import datetime
+
+
+class FakeDatabase:
+    def __init__(self):
+        self.saved = []
+
+    def save(self, data):
+        self.saved.append(dict(data))
+
+
+def test_ledger_container():
+
+    tank = container.Storage((1000, 'l'))
+    tank.use_ledger()
+    for i in range(100):
+        tank.add_content('water', (5, 'l'))
+        tank.add_content('malt', (1, 'kg'))
+    tank.heat_contents((65, 'c'))
+
+    assert tank.total_filled()[0] == 600
+    assert tank.ledger.totals_by_content_type('l') == {'water': 500.0, 'malt': 100.0}
+
+    removed = tank.remove_content('water', (12, 'l'))
+    assert [ r[1]["amount"] for r in removed ] == [5.0, 5.0, 2.0]
+    assert removed[0][2] == {"degrees": 65.0, "unit": "C"}
+    assert tank.total_filled()[0] == 588
+    tank.check_filled()
+
+    contents = tank.contents
+    assert contents[0].content == 'malt'
+    assert float(contents[2].amount) == 3.0
+
+
+def test_convert_to_wort_with_ledger():
+
+    mash_tun = container.MashTun((50, 'L'))
+    mash_tun.use_ledger()
+    mash_tun.add_content('water', (20, 'l'))
+    mash_tun.add_content('malt', (1, 'kg'))
+    mash_tun.convert_to_wort()
+
+    assert [ (c.content, float(c.amount)) for c in mash_tun.contents ] == [('wort', 20.0), ('used malt', 1.0)]
+
+
+def test_persistence_boundary():
+
+    when = datetime(2016, 3, 1, 12, 30, 15, 250)
+    fermenter = container.Fermenter((60, 'L'))
+    fermenter.add_content('wort', (30, 'l'), {"degrees": 18, "unit": "C"}, updated_datetime=when)
+    fermenter.add_content('yeast', (50, 'g'), updated_datetime=when)
+
+    ledger = ContentLedger.from_contents(fermenter._data['contents'])
+    assert len(ledger) == 2
+    lots = ledger.to_contents()
+    assert lots[0]['content'] == 'wort'
+    assert lots[0]['content_type'] == container.ContentType.Wort
+    assert lots[1]['updated_datetime'] == '2016-03-01T12:30:15.000250Z'
+
+    fermenter.use_ledger()
+    database = FakeDatabase()
+    fermenter.store(database)
+    assert [ lot['content'] for lot in database.saved[0]['contents'] ] == ['wort', 'yeast']
+    assert fermenter._data['contents'] == []
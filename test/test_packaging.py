@@ -0,0 +1,79 @@
+import sys, os
+
+sys.path.append(os.path.join(os.path.dirname(__file__),"..","lib"))
+
+from fattybrewing import container
+from fattybrewing.container import packaging
+
+
+def test_plan_packaging():
+
+    plan = packaging.plan_packaging(45, [20, 20, 20])
+    assert plan.fills.tolist() == [20, 20, 5]
+    assert (plan.filled_count, plan.packaged, plan.remainder, plan.shortfall, plan.headspace) == (3, 45, 0, 0, 15)
+
+    plan = packaging.plan_packaging(2000, [0.33] * 6000)
+    assert plan.filled_count == 6000
+    assert abs(plan.remainder - 20) < 1e-6
+    assert plan.shortfall == 61
+
+
+def test_into_bottles():
+
+    fermenter = container.Fermenter((200, 'l'))
+    fermenter.add_content('beer', (100, 'l'), (4, 'C'))
+    bottles = [ container.Bottle((330, 'ml')) for i in range(400) ]
+
+    plan = fermenter.into_kegs(bottles)
+    assert plan.filled_count == 304
+    assert bottles[0].contents[0].amount == 330
+    assert bottles[0].full
+    assert abs(float(bottles[303].contents[0].amount) - 10) < 1e-6
+    assert not bottles[304].contents
+    assert bottles[0].contents[0].temperature.degrees == 4
+    assert 'beer' not in [ c.content for c in fermenter.contents ]
+
+
+def test_too_few_kegs():
+
+    fermenter = container.Fermenter((100, 'l'))
+    fermenter.add_content('beer', (50, 'l'))
+    kegs = [ container.Keg((20, 'l')) for i in range(2) ]
+    try:
+        fermenter.into_kegs(kegs)
+        assert False
+    except container.PackagingError:
+        pass
+    assert kegs[1].full
+    assert fermenter.total_filled()[0] == 10
+
+
+def test_full_keg_skipped():
+
+    fermenter = container.Fermenter((100, 'l'))
+    fermenter.add_content('beer', (30, 'l'))
+    kegs = [ container.Keg((20, 'l')) for i in range(3) ]
+    kegs[1].add_content('beer', (20, 'l'))
+
+    plan = fermenter.into_kegs(kegs)
+    assert plan.filled.tolist() == [0, 2]
+    assert (plan.filled_count, plan.packaged, plan.headspace) == (2, 30, 10)
+    assert [ float(keg.total_filled()[0]) for keg in kegs ] == [20, 20, 10]
+    assert fermenter.total_filled()[0] == 0
+
+
+def test_exact_fit():
+
+    fermenter = container.Fermenter((500, 'l'))
+    fermenter.add_content('beer', (372 * 0.473, 'l'))
+    bottles = [ container.Bottle((473, 'ml')) for i in range(372) ]
+
+    plan = fermenter.into_kegs(bottles)
+    assert (plan.filled_count, plan.remainder, plan.shortfall) == (372, 0, 0)
+    assert all(bottle.full for bottle in bottles)
+    assert 'beer' not in [ c.content for c in fermenter.contents ]
+
+    # Exact fits of every count of bottles or kegs, as the planner sees them
+    for (size, count) in [ (size, count) for size in (0.33, 0.473, 0.5, 19.5, 58.67) for count in range(1, 400, 7) ]:
+        plan = packaging.plan_packaging(size * count, [size] * count)
+        assert (plan.filled_count, plan.remainder, plan.shortfall) == (count, 0, 0), (size, count)
@@ -0,0 +1,109 @@
+import sys, os
+
+sys.path.append(os.path.join(os.path.dirname(__file__),"..","lib"))
+sys.path.append(os.path.dirname(__file__))
+
+import couchdb
+
+from fattybrewing import container
+from fattybrewing.container import persistence
+from fattybrewing.container.embedded import EmbeddedDatabase
+
+from couchdb_standin import StandInCouchDB
+
+
+def test_flush_in_batches():
+
+    with StandInCouchDB() as standin:
+        database = couchdb.Server(standin.url).create('brewing')
+        store = persistence.ContainerStore(database, batch_size=400)
+        fermenters = [ container.Fermenter((100, 'l')) for i in range(1000) ]
+        for fermenter in fermenters:
+            fermenter.add_content('wort', (80, 'l'), (20, 'C'))
+        store.add_many(fermenters)
+        store.add(fermenters[0])
+        assert len(store) == 1000
+
+        assert store.flush() == []
+        assert store.requests == 3
+        assert len([ r for r in standin.requests if r[1].endswith('_bulk_docs') ]) == 3
+        assert len(store) == 0
+        assert len(standin.databases['brewing']) == 1000
+
+        loaded = container.Fermenter.load(database, fermenters[10].id)
+        assert loaded.contents[0].content == 'wort'
+        assert loaded.contents[0].amount == 80
+        assert fermenters[10].rev.startswith('1-')
+
+
+def test_conflicts():
+
+    with StandInCouchDB() as standin:
+        database = couchdb.Server(standin.url).create('brewing')
+        store = persistence.ContainerStore(database)
+        kegs = [ container.Keg((20, 'l')) for i in range(3) ]
+        store.add_many(kegs)
+        store.flush()
+
+        # Someone else changes the second keg
+        stale = container.Keg.load(database, kegs[1].id)
+        stale.store(database)
+
+        for keg in kegs:
+            keg.add_content('beer', (20, 'l'))
+            store.add(keg)
+        conflicts = store.flush()
+        assert [ conflict.id for conflict in conflicts ] == [kegs[1].id]
+        assert conflicts[0].container is kegs[1]
+        assert conflicts[0].revision_conflict
+        assert kegs[0].rev.startswith('2-') and kegs[2].rev.startswith('2-')
+
+
+def test_ledger_containers():
+
+    with StandInCouchDB() as standin:
+        database = couchdb.Server(standin.url).create('brewing')
+        storage = container.Storage((100, 'l'))
+        storage.use_ledger()
+        storage.add_content('water', (40, 'l'))
+        store = persistence.ContainerStore(database)
+        store.add(storage)
+        assert store.flush() == []
+        assert storage._data['contents'] == []
+        stored = standin.databases['brewing'][storage.id]
+        assert stored['contents'][0]['content'] == 'water'
+        assert stored['_rev'] == storage.rev
+
+
+class FailingDatabase(EmbeddedDatabase):
+    """Refuses every update after the first few"""
+
+    def __init__(self, updates):
+        super(FailingDatabase, self).__init__('brewing')
+        self.updates = updates
+
+    def update(self, documents, **options):
+        if not self.updates:
+            raise OSError("connection refused")
+        self.updates -= 1
+        return super(FailingDatabase, self).update(documents, **options)
+
+
+def test_failed_flush_is_retried():
+
+    database = FailingDatabase(1)
+    store = persistence.ContainerStore(database, batch_size=2)
+    kegs = [ container.Keg((20, 'l')) for i in range(5) ]
+    store.add_many(kegs)
+    try:
+        store.flush()
+        assert False
+    except OSError:
+        pass
+    assert len(store) == 3
+    assert len(database) == 2
+
+    database.updates = 2
+    assert store.flush() == []
+    assert len(store) == 0
+    assert sorted(database) == sorted(keg.id for keg in kegs)
@@ -0,0 +1,37 @@
+import sys, os
+
+sys.path.append(os.path.join(os.path.dirname(__file__),"..","lib"))
+
+import pickle
+
+from fattybrewing.container import scenarios
+
+
+def sweep():
+    return [ scenarios.Scenario('fermenters %s' % n, fermenters=[(1100, 'l')] * n, orders=6,
+                                order_interval=12, seed=n)
+             for n in (1, 3) ]
+
+
+def test_run_scenario():
+
+    result = scenarios.run_scenario(sweep()[0])
+    assert result.name == 'fermenters 1'
+    assert result.summary['completed'] == 6
+    assert len(result.lead_times) == 6
+    copy = pickle.loads(pickle.dumps(result))
+    assert copy.summary == result.summary and (copy.lead_times == result.lead_times).all()
+
+
+def test_run_scenarios_in_processes():
+
+    in_process = scenarios.run_scenarios(sweep(), workers=0)
+    pooled = scenarios.run_scenarios(sweep(), workers=2)
+
+    assert pooled == in_process
+    assert pooled['completed'] == 12 and pooled['litres'] == 12000
+    one = pooled['scenarios']['fermenters 1']
+    three = pooled['scenarios']['fermenters 3']
+    # More fermenters get the orders out sooner
+    assert three['lead_time'] < one['lead_time']
+    assert pooled['lead_time_p50'] <= pooled['lead_time_p99']
@@ -0,0 +1,62 @@
+import sys, os
+
+import numpy
+
+sys.path.append(os.path.join(os.path.dirname(__file__),"..","lib"))
+
+from fattybrewing.container.sensors import SensorStore
+
+
+def test_rings_and_downsampling():
+
+    store = SensorStore(raw_capacity=120, minute_capacity=30, hour_capacity=4, sensors=1)
+    top = store.sensor('mash tun 1', 'top')
+    jacket = store.sensor('mash tun 1', 'jacket')
+    other = store.sensor('fermenter 1', 'bottom')
+    assert store.sensor('mash tun 1', 'top') == top
+    size = store.nbytes
+
+    # Three hours of one reading a second, sent in batches of ten minutes
+    times = numpy.arange(3 * 3600, dtype=numpy.float64)
+    for start in range(0, len(times), 600):
+        batch = times[start:start + 600]
+        store.record_many(numpy.repeat([top, jacket], len(batch)),
+                          numpy.tile(batch, 2),
+                          numpy.r_[60 + batch / 3600.0, numpy.full(len(batch), 70.0)])
+    assert store.nbytes == size
+    assert store.late == 0
+    assert store.current_temperature_readings('mash tun 1') == [('top', numpy.float32(60 + 10799 / 3600.0)), ('jacket', 70.0)]
+
+    # The last two minutes are raw, the rest in buckets
+    (raw_times, degrees) = store.window(top, 0, 4 * 3600, 'raw')
+    assert list(raw_times) == list(times[-120:])
+    assert store.resolution([top], 3 * 3600 - 120) == 'raw'
+    assert store.resolution([top], 3 * 3600 - 1800) == 'minute'
+    assert store.resolution([top], 0) == 'hour'
+    (bucket_times, lows, highs, means) = store.window(top, 0, 4 * 3600)
+    assert list(bucket_times) == [0, 3600, 7200]
+    assert numpy.allclose(lows, [60, 61, 62])
+    assert numpy.allclose(means, [60 + 1799.5 / 3600, 61 + 1799.5 / 3600, 62 + 1799.5 / 3600])
+    (bucket_times, lows, highs, means) = store.window(top, 9000, 9120, 'minute')
+    assert list(bucket_times) == [9000, 9060]
+    assert numpy.allclose(highs, [60 + 9059 / 3600.0, 60 + 9119 / 3600.0])
+
+    (low, high, mean) = store.stats([top, jacket, other], 3600, 7200)
+    assert numpy.allclose(low[:2], [61, 70]) and numpy.allclose(high[:2], [61 + 3599 / 3600.0, 70])
+    assert numpy.allclose(mean[:2], [61 + 1799.5 / 3600, 70])
+    assert numpy.isnan(low[2]) and numpy.isnan(mean[2])
+
+
+def test_late_readings():
+
+    store = SensorStore(raw_capacity=10, minute_capacity=10, hour_capacity=10, sensors=0)
+    sensor = store.sensor('fermenter 2', 'jacket')
+    # Out of order within a batch is sorted, older than the last batch is late
+    assert store.record_many([sensor] * 3, [30, 10, 20], [18, 16, 17]) == 3
+    assert store.record_many([sensor] * 2, [25, 40], [1, 19]) == 1
+    assert store.late == 1
+    (times, degrees) = store.window(sensor, 0, 100, 'raw')
+    assert list(times) == [10, 20, 30, 40]
+    assert list(degrees) == [16, 17, 18, 19]
+    (low, high, mean) = store.stats([sensor], 0, 60, 'minute')
+    assert (low[0], high[0], mean[0]) == (16, 19, 17.5)
@@ -0,0 +1,109 @@
+import sys, os
+
+sys.path.append(os.path.join(os.path.dirname(__file__),"..","lib"))
+
+from fattybrewing import container
+from fattybrewing.container import simulation
+
+
+def test_scheduler():
+
+    scheduler = simulation.Scheduler()
+    ran = []
+    scheduler.schedule(5, ran.append, 'c')
+    scheduler.schedule(1, ran.append, 'a')
+    scheduler.schedule(1, ran.append, 'b')
+    dropped = scheduler.schedule(3, ran.append, 'dropped')
+    scheduler.schedule(10, ran.append, 'late')
+    scheduler.cancel(dropped)
+
+    assert scheduler.run(until=6) == 3
+    assert ran == ['a', 'b', 'c']
+    assert scheduler.now == 6
+    scheduler.run()
+    assert ran[-1] == 'late' and scheduler.now == 10
+
+
+def make_brewery():
+    return simulation.Brewery([container.MashTun((1300, 'l'))],
+                              [container.Fermenter((1100, 'l')) for i in range(2)],
+                              [simulation.PackagingLine((50, 'l'), 500)])
+
+
+def test_brewery():
+
+    brewery = make_brewery()
+    orders = [ brewery.submit(simulation.Recipe('pale ale'), at=i) for i in range(3) ]
+    brewery.run()
+
+    assert brewery.completed == orders
+    first = orders[0]
+    assert first.mashed == 1.5
+    assert first.fermenting == 2.0
+    assert first.fermented is not None and first.fermented > first.fermenting
+    assert first.packaged == first.fermented + 2.0
+    assert first.volume == 1000 and first.packages == 20
+    # The third order waits for a fermenter to be packaged out
+    assert orders[2].fermenting >= min(orders[0].packaged, orders[1].packaged)
+
+    summary = brewery.summary()
+    assert summary['completed'] == 3
+    assert summary['litres'] == 3000
+    assert 0 < summary['fermenter_utilization'] <= 1
+    for fermenter in brewery.fermenters:
+        assert not fermenter.contents
+        assert fermenter.fermentation.sugar is None
+
+
+def test_brewery_until():
+
+    brewery = make_brewery()
+    brewery.submit(simulation.Recipe('pale ale'))
+    brewery.run(until=24)
+    summary = brewery.summary()
+    assert summary['completed'] == 0 and summary['hours'] == 24
+    assert summary['mash_tun_utilization'] == 2.0 / 24
+
+
+def test_bottles():
+
+    brewery = simulation.Brewery([container.MashTun((1300, 'l'))], [container.Fermenter((1100, 'l'))],
+                                 [simulation.PackagingLine((330, 'ml'), 500, container.Bottle)])
+    order = brewery.submit(simulation.Recipe('pale ale', water=990))
+    brewery.run()
+    assert brewery.completed == [order] and not brewery.failed
+    assert order.volume == 990 and order.packages == 3000
+
+
+class ShortLine(simulation.PackagingLine):
+    """A packaging line giving short packages too few"""
+
+    short = 1
+
+    def packages_for(self, litres):
+        return simulation.PackagingLine.packages_for(self, litres)[self.short:]
+
+
+def test_failed_batches():
+
+    brewery = simulation.Brewery([container.MashTun((1300, 'l'))],
+                                 [container.Fermenter((1100, 'l')) for i in range(2)],
+                                 [ShortLine((50, 'l'), 500)])
+    short = brewery.submit(simulation.Recipe('pale ale'))
+    spilled = brewery.submit(simulation.Recipe('barley wine', water=1500), at=1)
+    overflowed = brewery.submit(simulation.Recipe('stout', water=1200), at=2)
+    brewery.run()
+
+    assert brewery.failed == [spilled, overflowed, short]
+    assert isinstance(spilled.failed, container.ContainerError) and spilled.mashed is None
+    assert isinstance(overflowed.failed, container.ContainerError) and overflowed.fermenting is None
+    assert isinstance(short.failed, container.PackagingError) and short.packaged is None
+    assert not brewery.completed
+    assert brewery.summary()['failed'] == 3
+    # Everything is cleaned out and free for the next order
+    for vessel in brewery.mash_tuns + brewery.fermenters:
+        assert not vessel.contents
+    brewery.packaging_lines[0].short = 0
+    order = brewery.submit(simulation.Recipe('pale ale', water=995))
+    brewery.run()
+    assert brewery.completed == [order] and order.volume == 995
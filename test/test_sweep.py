@@ -0,0 +1,62 @@
+import sys, os
+
+sys.path.append(os.path.join(os.path.dirname(__file__),"..","lib"))
+
+import numpy
+
+from fattybrewing.container import fermentation, sweep, simulation
+
+
+def test_sample():
+
+    space = sweep.SweepSpace(recipes=[simulation.Recipe('pale ale'), simulation.Recipe('stout')],
+                             fermenters=(4, 6), ferment_temperature=18)
+    (configurations, mix) = sweep.sample(space, 1000, seed=1)
+    assert set(configurations['fermenters'].tolist()) == set([4, 5, 6])
+    assert (configurations['ferment_temperature'] == 18).all()
+    assert (configurations['mash_tun_size'] >= 1000).all() and (configurations['mash_tun_size'] <= 2000).all()
+    assert mix.shape == (1000, 2)
+    assert numpy.allclose(mix.sum(axis=1), 1)
+
+
+def test_evaluate():
+
+    space = sweep.SweepSpace(mash_tuns=1, fermenters=2, packaging_lines=1, mash_tun_size=1300,
+                             fermenter_size=500, transfer_rate=1000, line_rate=500,
+                             ferment_temperature=20, order_interval=1000)
+    (configurations, mix) = sweep.sample(space, 3, seed=1)
+    result = sweep.evaluate(space, configurations, mix)
+
+    fermenting = fermentation.ferment_hours(20, 0.5, step=3.0)
+    # The recipe is scaled down for its wort and yeast to fit the 500 l fermenter
+    volume = 500.0 * 1000 / 1000.5
+    assert numpy.allclose(result['busy'][0], [1.5 + volume / 1000, volume / 1000 + fermenting + volume / 500, volume / 500])
+    assert numpy.allclose(result['throughput'], volume / 1000 * 168)
+    assert numpy.allclose(result['utilization'][0, 1], (volume * 3 / 1000 + fermenting) / 1000 / 2)
+    assert (result['bottleneck'] == sweep.STAGES.index('fermenter')).all()
+
+
+def test_sweep_report():
+
+    report = sweep.sweep(sweep.SweepSpace(), draws=500, seed=2)
+    assert report['draws'] == 500
+    assert report['throughput'][5] <= report['throughput'][50] <= report['throughput'][95]
+    assert set(report['utilization']) == set(sweep.STAGES)
+    assert abs(sum(report['bottleneck'].values()) - 1) < 1e-9
+
+
+def test_scenario():
+
+    space = sweep.SweepSpace(fermenters=3, fermenter_size=600)
+    (configurations, mix) = sweep.sample(space, 2, seed=3)
+    scenario = sweep.scenario(space, configurations, mix, 1, orders=4)
+    assert len(scenario.fermenters) == 3
+    recipe = scenario.recipes[0]
+    assert 599 < recipe.water + recipe.yeast <= 600
+    brewery = scenario.build()
+    assert brewery.fermenters[0].size.amount == 600
+    # The scaled recipe fills the fermenters to the brim, and no further
+    brewery.run()
+    assert not brewery.failed
+    assert len(brewery.completed) == 4
+    assert brewery.summary()['litres'] == 4 * recipe.water
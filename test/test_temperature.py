@@ -0,0 +1,73 @@
+import sys, os
+
+sys.path.append(os.path.join(os.path.dirname(__file__),"..","lib"))
+
+from fattybrewing import container
+from fattybrewing.container import temperature
+
+from decimal import Decimal
+import math
+
+
+def test_convert_temp():
+
+    assert abs(temperature.convert_temp((100, 'C'), 'F') - 212) < 1e-9
+    assert abs(temperature.convert_temp({"degrees": 32, "unit": "F"}, 'K') - 273.15) < 1e-9
+    assert temperature.convert_temp((Decimal('20'), 'c'), 'K') == Decimal('293.15')
+    assert temperature.convert_temp((20, 'C'), 'C') == 20
+    try:
+        temperature.convert_temp((20, 'X'), 'C')
+        assert False
+    except container.ContainerError:
+        pass
+
+    converted = temperature.convert_temps([0, 212, 300], ['C', 'F', 'K'], 'C')
+    assert converted[0] == 0
+    assert abs(converted[1] - 100) < 1e-9
+    assert abs(converted[2] - 26.85) < 1e-9
+
+
+def test_mix_temperatures():
+
+    assert temperature.mix_temperatures([1, 1], [10, 30]) == 20
+    # Equal masses, the hot one holding three times the heat per degree
+    assert temperature.mix_temperatures([1, 1], [80, 20], [3, 1]) == 65
+    mixed = temperature.mix_temperatures([[1, 1], [1, 0], [0, 0]], [[10, 30], [50, 99], [0, 0]])
+    assert mixed[:2].tolist() == [20, 50]
+    assert math.isnan(mixed[2])
+
+
+def test_convert_to_wort_temperature():
+
+    mash_tun = container.MashTun((50, 'l'))
+    mash_tun.add_content('water', (15, 'l'), (80, 'C'))
+    mash_tun.add_content('water', (5, 'l'), (20, 'C'))
+    mash_tun.add_content('malt', (5, 'kg'), (20, 'C'))
+    mash_tun.add_content('yeast', (10, 'g'), (20, 'C'))
+
+    expected = (15 * 4186 * 80 + 5 * 4186 * 20 + 5 * 1700 * 20) / (20 * 4186 + 5 * 1700.0)
+    assert abs(temperature.mash_temperatures([mash_tun])[0] - expected) < 1e-9
+
+    removed = mash_tun.convert_to_wort()
+    assert [ r[0] for r in removed ] == ['water', 'water', 'malt']
+    contents = dict( (c.content, c) for c in mash_tun.contents )
+    assert sorted(contents) == ['used malt', 'wort', 'yeast']
+    assert contents['wort'].amount == 20
+    assert abs(float(contents['wort'].temperature.degrees) - expected) < 1e-9
+    assert contents['used malt'].temperature.degrees == contents['wort'].temperature.degrees
+    assert contents['yeast'].temperature.degrees == 20
+
+
+def test_mash_temperatures_many_tuns():
+
+    tuns = []
+    for degrees in (60, 65, 70):
+        tun = container.MashTun((50, 'l'))
+        tun.add_content('water', (10, 'l'), (degrees, 'C'))
+        tuns.append(tun)
+    tuns[1].use_ledger()
+    tuns.append(container.MashTun((50, 'l')))
+
+    mixed = temperature.mash_temperatures(tuns, 'F')
+    assert [ round(t, 6) for t in mixed[:3].tolist() ] == [140, 149, 158]
+    assert math.isnan(mixed[3])
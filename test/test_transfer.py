@@ -0,0 +1,99 @@
+import sys, os
+
+sys.path.append(os.path.join(os.path.dirname(__file__),"..","lib"))
+
+from fattybrewing import container
+from fattybrewing.container import transfer
+
+from datetime import datetime, timedelta
+
+
+def test_valve_flow_rate():
+
+    valve = transfer.Valve(2, 'cm')
+    # pi * 0.01**2 m2 at 1 m/s is 0.314 l/s
+    assert abs(valve.flow_rate() - 1130.97) < 0.01
+    assert transfer.Valve(2, 'cm', 'partial').flow_rate() * 2 == valve.flow_rate()
+    assert transfer.Valve(2, 'cm', 'closed').flow_rate() == 0
+
+
+def test_stream():
+
+    mash_tun = container.MashTun((50, 'l'))
+    mash_tun.add_content('wort', (30, 'l'), (60, 'C'))
+    mash_tun.add_content('used malt', (5, 'kg'))
+    fermenter = container.Fermenter((40, 'l'))
+
+    flow = transfer.Transfer(mash_tun, fermenter, rate=60, start=datetime(2020, 1, 1))
+    slices = list(flow.stream(timedelta(minutes=10)))
+    assert len(slices) == 3
+    assert [ litres for (elapsed, litres) in slices ] == [10, 10, 10]
+    assert slices[-1][0] == timedelta(minutes=30)
+    assert fermenter.contents[0].temperature.degrees == 60
+    assert sum(c.amount for c in fermenter.contents) == 30
+    assert fermenter.contents[-1].updated_datetime == datetime(2020, 1, 1, 0, 30)
+    assert flow.garbage == ['used malt']
+    assert [ c.content for c in mash_tun.contents if c.amount ] == ['used malt']
+
+
+def test_stream_keeps_the_mix():
+
+    source = container.Storage((100, 'l'))
+    source.add_content('water', (30, 'l'))
+    source.add_content('beer', (10, 'l'))
+    destination = container.Storage((100, 'l'))
+
+    flow = transfer.Transfer(source, destination, rate=6)
+    elapsed, litres = next(flow.stream(timedelta(hours=1)))
+    assert litres == 6
+    moved = dict( (c.content, float(c.amount)) for c in destination.contents )
+    assert abs(moved['water'] - 4.5) < 1e-9 and abs(moved['beer'] - 1.5) < 1e-9
+
+
+def test_engine_blocks_on_full_destination():
+
+    sources = [ container.Storage((50, 'l')) for i in range(3) ]
+    for source in sources:
+        source.add_content('beer', (20, 'l'))
+    small = container.Storage((5, 'l'))
+    large = container.Storage((100, 'l'))
+
+    engine = transfer.TransferEngine()
+    flows = [ engine.add(transfer.Transfer(sources[0], small, rate=4)),
+              engine.add(transfer.Transfer(sources[1], large, rate=4)),
+              engine.add(transfer.Transfer(sources[2], large, rate=8)) ]
+    ticks = list(engine.run(timedelta(hours=1)))
+
+    assert flows[0].blocked and small.full
+    assert sources[0].total_filled()[0] == 15
+    assert not flows[1].blocked and not flows[2].blocked
+    assert abs(large.total_filled()[0] - 40) < 1e-9
+    assert len(ticks) == 5
+    assert ticks[0][1].tolist() == [4, 4, 8]
+
+
+def test_move_all_leaves_garbage():
+
+    mash_tun = container.MashTun((50, 'l'))
+    mash_tun.add_content('wort', (30, 'l'))
+    mash_tun.add_content('used malt', (5, 'kg'))
+    fermenter = container.Fermenter((40, 'l'))
+
+    garbage = container.move_all(mash_tun, fermenter)
+    assert [ g[0] for g in garbage ] == ['used malt']
+    assert [ c.content for c in fermenter.contents ] == ['wort']
+
+
+def test_move_into_fuller_destination():
+
+    fermenter = container.Fermenter((50, 'l'))
+    fermenter.add_content('beer', (40, 'l'))
+    keg = container.Keg((20, 'l'))
+    keg.add_content('beer', (15, 'l'))
+
+    flow = transfer.Transfer(fermenter, keg, rate=100)
+    assert flow.move(40) == 5
+    assert flow.blocked and flow.moved_litres == 5 and flow.remaining_litres == 35
+    assert fermenter.total_filled()[0] == 35
+    assert keg.total_filled()[0] == 20
+    assert flow.move(10) == 0
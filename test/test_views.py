@@ -0,0 +1,76 @@
+import sys, os
+
+sys.path.append(os.path.join(os.path.dirname(__file__),"..","lib"))
+sys.path.append(os.path.dirname(__file__))
+
+import couchdb
+import pytest
+
+from fattybrewing import container
+from fattybrewing.container import persistence, views
+
+from couchdb_standin import StandInCouchDB, NODE
+
+pytestmark = pytest.mark.skipif(NODE is None, reason="the stand-in needs node to run views")
+
+
+def brewery_database(standin):
+    database = couchdb.Server(standin.url).create('brewing')
+    views.install(database)
+    store = persistence.ContainerStore(database)
+    vessels = dict( small = container.Fermenter((50, 'l')),
+                    big = container.Fermenter((20, 'gal')),
+                    bigger = container.Fermenter((100, 'l')),
+                    busy = container.Fermenter((200, 'l')),
+                    mash_tun = container.MashTun((200, 'l')),
+                    keg = container.Keg((20, 'l')) )
+    vessels['busy'].add_content('wort', (150, 'l'))
+    vessels['keg'].add_content('beer', (20, 'l'))
+    vessels['mash_tun'].add_content('water', (100, 'l'))
+    vessels['mash_tun'].add_content('malt', (20, 'kg'))
+    store.add_many(vessels.values())
+    assert store.flush() == []
+    return (database, vessels)
+
+
+def test_install_once():
+
+    with StandInCouchDB() as standin:
+        database = couchdb.Server(standin.url).create('brewing')
+        assert views.install(database)
+        assert not views.install(database)
+        assert sorted(database['_design/containers']['views']) == ['by_content_type', 'by_state', 'by_type']
+
+
+def test_find_empty_fermenter():
+
+    with StandInCouchDB() as standin:
+        (database, vessels) = brewery_database(standin)
+        del standin.requests[:]
+
+        fermenter = views.find_empty(database, 'fermenter', min_size=(60, 'l'))
+        assert isinstance(fermenter, container.Fermenter)
+        # 20 gal is about 76 l
+        assert fermenter.id == vessels['big'].id
+        assert [ path for (method, path) in standin.requests ] == ['/brewing/_design/containers/_view/by_state']
+
+        assert views.find_empty(database, 'fermenter', min_size=500) is None
+        empty = views.containers_in_state(database, 'fermenter', 'empty')
+        assert [ f.id for f in empty ] == [ vessels[name].id for name in ('small', 'big', 'bigger') ]
+        assert views.count_by_state(database, 'fermenter') == {'empty': 3, 'partial': 1, 'full': 0}
+
+
+def test_contents():
+
+    with StandInCouchDB() as standin:
+        (database, vessels) = brewery_database(standin)
+
+        assert len(views.containers_of_type(database, 'fermenter')) == 4
+        kegs = views.containers_holding(database, 'beer')
+        assert [ type(keg) for keg in kegs ] == [container.Keg]
+        assert kegs[0].contents[0].amount == 20
+        assert views.containers_holding(database, 'beer', container_type='fermenter') == []
+        assert [ c.id for c in views.containers_holding(database, 'malt') ] == [vessels['mash_tun'].id]
+
+        volumes = views.volume_by_content_type(database)
+        assert volumes == {'beer': 20.0, 'malt': 20.0, 'water': 100.0, 'wort': 150.0}